@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from api.cache import get_version, bump_version
+
+
+def auth_cache_ttl():
+    """How long an authenticated user stays cached (seconds)"""
+    return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Drop the cached user so the next request loads it again.
+    Saving a User does this automatically (see api/signals.py) - call it
+    yourself after queryset.update() on users, which sends no signals.
+    """
+    bump_version('auth', user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that serves the user from the cache.
+    Saves the user lookup query on every authenticated request.
+
+    The key has the user id and the user's auth version, which is bumped
+    whenever the user is saved (profile update, deactivation, password
+    change), so a cached user is never older than its last change.
+    """
+    
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        
+        cache_key = f"auth-user:{user_id}:v{get_version('auth', user_id)}"
+        user = cache.get(cache_key)
+        if user is None:
+            # Full lookup, including the is_active / revoked token checks
+            user = super().get_user(validated_token)
+            cache.set(cache_key, user, auth_cache_ttl())
+        
+        return user
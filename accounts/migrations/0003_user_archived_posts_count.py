@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-19 15:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_archived_posts(apps, schema_editor):
+    """Fill the new column from the posts archived so far"""
+    User = apps.get_model('accounts', 'User')
+    ArchivedPost = apps.get_model('api', 'ArchivedPost')
+    counts = ArchivedPost.objects.order_by().values('user_id').annotate(n=Count('id')).values_list('user_id', 'n')
+    for user_id, n in counts:
+        User.objects.filter(pk=user_id).update(archived_posts_count=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_user_profile_picture'),
+        ('api', '0011_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='archived_posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_archived_posts, migrations.RunPython.noop),
+    ]
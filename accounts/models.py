@@ -7,6 +7,7 @@ class User(AbstractUser):
     profile_picture = models.URLField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    archived_posts_count = models.PositiveIntegerField(default=0)  # Kept by archive_cold, so posts_count needs no archive query
     
     def __str__(self):
         return self.username
@@ -24,7 +25,7 @@ class User(AbstractUser):
     @property
     def posts_count(self):
         """Get number of posts by this user"""
-        return self.posts.count()  # From Post model's related_name
+        return self.posts.count() + self.archived_posts_count  # Post model's related_name + archived posts
     
     def is_following(self, user):
         """Check if this user is following another user"""
@@ -5,9 +5,9 @@ from .views import (
     LoginView, 
     UserProfileView, 
     UserDetailView,
-    UserListView
+    UserListView,
+    TokenRefreshView,
 )
-from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
     path('users/', UserListView.as_view(), name='user-list'),
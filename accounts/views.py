@@ -9,6 +9,11 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .serializers import RegisterSerializer, LoginSerializer, UserProfileSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt import views as jwt_views
+from django.http import Http404
+from api.cache import get_user_data, add_user_viewer_state, get_versions
+from api.conditional import ConditionalGetMixin, make_etag, user_profile_etag
+from api.account_deletion import request_deletion
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -18,6 +23,8 @@ User = get_user_model()
 class UserListView(generics.ListAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 34
+    known_n_plus_one = True  # Per-user queries in UserDetailSerializer (api/query_budget.py)
     
     # Add filters
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -34,6 +41,7 @@ class RegisterView(APIView):
     """View for user registration"""
     
     permission_classes = [IsPublicEndpoint]  # Anyone can register
+    query_budget = 8
     
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
@@ -58,6 +66,7 @@ class LoginView(APIView):
     """View for user login"""
     
     permission_classes = [IsPublicEndpoint]  # Anyone can login
+    query_budget = 7
     
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -78,11 +87,23 @@ class LoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileView(generics.RetrieveUpdateAPIView):
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    """simplejwt's refresh view, with its query budget (api/query_budget.py)"""
+    
+    query_budget = 3
+
+
+class UserProfileView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     """View to see and update user profile"""
     
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    query_budget = 8
+    
+    def get_etag(self, request, *args, **kwargs):
+        # Edit time + cache version (bumped by follows and posts)
+        user = request.user
+        return make_etag('me', user.pk, user.updated_at.isoformat(), get_versions('user', [user.pk]))
     
     def get_object(self):
         # Always return the current user
@@ -94,18 +115,38 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
             request.data.pop('password')
         
         return super().update(request, *args, **kwargs)
+    
+    def delete(self, request, *args, **kwargs):
+        """Delete my account: deactivated now, data removed in the background"""
+        request_deletion(request.user)
+        return Response(
+            {"message": "Your account has been deactivated and will be deleted shortly."},
+            status=status.HTTP_202_ACCEPTED
+        )
 
 
-class UserDetailView(generics.RetrieveAPIView):
+class UserDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     """View to see other users' profiles (read-only)"""
     
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     queryset = User.objects.all()
     lookup_field = 'username'  # Use username instead of ID in URL
     
+    def get_etag(self, request, *args, **kwargs):
+        return user_profile_etag(self.kwargs['username'], request.user)
+    
     def get_serializer_context(self):
         # Add request context for serializers
         return {'request': self.request}
+    
+    def retrieve(self, request, *args, **kwargs):
+        # Profile comes from the cache, follow flags are per viewer
+        data = get_user_data(self.kwargs['username'])
+        if data is None:
+            raise Http404("No User matches the given query.")
+        
+        return Response(add_user_viewer_state(data, request.user))
 
 
@@ -0,0 +1,173 @@
+"""
+Account deletion in the background.
+
+Deleting a User in one go cascades over all their posts, likes, comments,
+follows and notifications (and everything attached to their posts) in a
+single transaction, locking big parts of those tables for seconds.
+
+Instead, DELETE /api/accounts/me/ deactivates the account at once - the
+user can't log in and their tokens stop working - and records an
+AccountDeletion. A background worker then removes the user's rows step by
+step, children before parents, in small batches with pauses (see
+api/purge.py). Every row still goes through the delete signals, so
+popularity scores, cached counts, the feed buffer and image references
+are fixed up as it goes. The User row itself is deleted last, when
+nothing heavy is left to cascade.
+
+Each batch commits on its own, so after a crash or restart the deletion
+just continues with what is left: `python manage.py delete_accounts`.
+"""
+import logging
+import os
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import executors
+from .archive import forget_archived_post_count
+from .chunked_upload import cancel_upload
+from .image_jobs import job_path
+from .models import (
+    AccountDeletion, ArchivedNotification, ArchivedPost, Comment, Follow, ImageJob,
+    Like, Notification, Post, UploadSession
+)
+from .purge import BATCH_SIZE, PAUSE, delete_in_batches
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+def get_executor():
+    """One worker thread - deletions run one at a time"""
+    return executors.get_executor('account-deletion', 1)
+
+
+def deletion_steps(user_id):
+    """(name, queryset) pairs, deleted in this order"""
+    own_posts = Post.all_objects.filter(user_id=user_id)
+    return [
+        ('notifications', Notification.objects.filter(
+            Q(user_id=user_id) | Q(related_user_id=user_id) | Q(related_post__in=own_posts)
+        )),
+        ('likes', Like.objects.filter(Q(user_id=user_id) | Q(post__in=own_posts))),
+        ('comments', Comment.all_objects.filter(Q(user_id=user_id) | Q(post__in=own_posts))),
+        ('follows', Follow.objects.filter(Q(follower_id=user_id) | Q(following_id=user_id))),
+        ('posts', own_posts),
+        ('archived_posts', ArchivedPost.objects.filter(user_id=user_id)),
+        ('archived_notifications', ArchivedNotification.objects.filter(
+            Q(user_id=user_id) | Q(related_user_id=user_id)
+        )),
+    ]
+
+
+def request_deletion(user):
+    """Deactivate the account now and queue the removal of its data"""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])  # Signal drops the cached user - tokens stop working
+        deletion, _ = AccountDeletion.objects.get_or_create(
+            user_id=user.pk, defaults={'username': user.username}
+        )
+        transaction.on_commit(lambda: get_executor().submit(_run_in_pool, deletion.pk))
+    return deletion
+
+
+def _run_in_pool(deletion_id):
+    try:
+        run_deletion(deletion_id)
+    except Exception:
+        logger.exception("Account deletion %s failed - run delete_accounts to resume", deletion_id)
+    finally:
+        connections.close_all()
+
+
+def run_deletion(deletion_id, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """
+    Remove everything of one deleted account. Safe to run again after a
+    crash: finished steps find nothing left to delete.
+    """
+    claimed = AccountDeletion.objects.filter(pk=deletion_id, status='pending').update(
+        status='running', updated_at=timezone.now()
+    )
+    if not claimed:
+        return  # Done, or another worker has it
+    deletion = AccountDeletion.objects.get(pk=deletion_id)
+
+    for name, queryset in deletion_steps(deletion.user_id):
+        done_before = 0
+
+        def record(deleted, rate, name=name):
+            nonlocal done_before
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                step=name, deleted_rows=F('deleted_rows') + deleted - done_before, updated_at=timezone.now()
+            )
+            done_before = deleted
+            if progress:
+                progress(name, deleted, rate)
+
+        delete_in_batches(queryset, batch_size, pause, record)
+
+    forget_archived_post_count()  # The archived_posts step changed it
+    _scrub_archived_posts(deletion.user_id, batch_size)
+    _remove_uploads(deletion.user_id)
+
+    # Only small things are left to cascade now
+    with transaction.atomic():
+        User.objects.filter(pk=deletion.user_id).delete()
+        AccountDeletion.objects.filter(pk=deletion.pk).update(status='done', step='user', updated_at=timezone.now())
+
+
+def _scrub_archived_posts(user_id, batch_size):
+    """Other users' archived posts keep likes and comments as JSON - drop this user's"""
+    # Text match to narrow things down (also matches e.g. id 15 for 1), checked properly below
+    candidates = ArchivedPost.objects.filter(
+        Q(liked_by__icontains=str(user_id)) | Q(comments__icontains=f'"user_id": {user_id}')
+    ).exclude(user_id=user_id)
+
+    last_pk = 0
+    while True:
+        batch = list(candidates.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return
+        with transaction.atomic():
+            for post in batch:
+                liked_by = [uid for uid in post.liked_by if uid != user_id]
+                removed = {c['id'] for c in post.comments if c['user_id'] == user_id}
+                comments = [c for c in post.comments if c['id'] not in removed]
+                # Replies to removed comments go too, as they would by cascade
+                while True:
+                    orphans = {c['id'] for c in comments if c['parent_id'] in removed}
+                    if not orphans:
+                        break
+                    removed |= orphans
+                    comments = [c for c in comments if c['id'] not in orphans]
+                if liked_by != post.liked_by or comments != post.comments:
+                    ArchivedPost.objects.filter(pk=post.pk).update(liked_by=liked_by, comments=comments)
+        last_pk = batch[-1].pk
+
+
+def _remove_uploads(user_id):
+    """Unfinished uploads and image jobs keep files on disk - remove them with the rows"""
+    for session in UploadSession.objects.filter(user_id=user_id):
+        cancel_upload(session)
+    for job in ImageJob.objects.filter(user_id=user_id):
+        try:
+            os.remove(job_path(job))
+        except FileNotFoundError:
+            pass
+        job.delete()
+
+
+def resume_deletions(older_than, progress=None):
+    """Run deletions that are pending, or were interrupted before `older_than`; returns how many"""
+    unfinished = AccountDeletion.objects.filter(
+        Q(status='pending') | Q(status='running', updated_at__lt=older_than)
+    )
+    count = 0
+    for deletion in unfinished:
+        AccountDeletion.objects.filter(pk=deletion.pk).update(status='pending')
+        run_deletion(deletion.pk, progress=progress)
+        count += 1
+    return count
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import Post,Follow,Like, Comment
 
 @admin.register(Post)
@@ -9,7 +10,7 @@ class PostAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'content_preview', 'created_at', 'likes_count')
     
     # Add filters on the right
-    list_filter = ('created_at', 'user')
+    list_filter = ('created_at', 'user', 'is_deleted')
     
     # Search functionality
     search_fields = ('content', 'user__username')
@@ -39,10 +40,17 @@ class PostAdmin(admin.ModelAdmin):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content Preview'
     
+    def get_queryset(self, request):
+        """Include soft-deleted posts; authors and like counts in the same query"""
+        return Post.all_objects.select_related('user').annotate(
+            num_likes=Count('likes')
+        ).order_by(*self.get_ordering(request))
+    
     def likes_count(self, obj):
         """Show likes count"""
-        return obj.likes_count
+        return obj.num_likes
     likes_count.short_description = 'Likes'
+    likes_count.admin_order_field = 'num_likes'
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
@@ -65,6 +73,10 @@ class LikeAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'post__content')
     readonly_fields = ('created_at',)
     
+    def get_queryset(self, request):
+        """Optimize database queries"""
+        return super().get_queryset(request).select_related('user', 'post')
+    
     def post_preview(self, obj):
         return obj.post.content[:50] + "..." if len(obj.post.content) > 50 else obj.post.content
     post_preview.short_description = 'Post'
@@ -76,6 +88,10 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'content', 'post__content')
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        """Include soft-deleted comments"""
+        return Comment.all_objects.select_related('user', 'post').order_by(*self.get_ordering(request))
+    
     def post_preview(self, obj):
         return f"Post #{obj.post.id}: {obj.post.content[:30]}..."
     post_preview.short_description = 'Post'
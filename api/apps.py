@@ -5,4 +5,8 @@ class ApiConfig(AppConfig):
     name = 'api'
     
     def ready(self):
-        import api.signals 
\ No newline at end of file
+        import api.signals
+        from api.metrics import instrument_serializers
+        from api.slow_queries import install
+        instrument_serializers()
+        install() 
\ No newline at end of file
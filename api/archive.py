@@ -0,0 +1,302 @@
+"""
+Archive tables for old posts and notifications.
+
+Almost all reads are for recent posts, but the Post and Notification
+tables (and their indexes) keep growing. `python manage.py archive_cold`
+moves rows older than ARCHIVE_AFTER_DAYS into ArchivedPost and
+ArchivedNotification, so the hot tables and indexes stay small enough to
+fit in the database's memory.
+
+- Posts are archived with their likes and comments (stored as JSON on the
+  archived row), so the Like and Comment tables shrink too. Archived posts
+  keep their ids, and notifications about them keep those ids too.
+- Only read notifications are archived - unread counts stay exact.
+- Soft-deleted posts are left for purge_deleted.
+
+Every archived post is older than every post still in the Post table, so a
+newest-first list is simply "hot rows, then archived rows". HotThenArchive
+gives views that list: user post pages and deep global feed pages fall
+back to the archive without clients noticing. Notifications don't work
+that way - an unread notification stays hot however old it is - so
+MergedByDate interleaves the two tables by date instead.
+
+Rows are moved in small batches, each in its own transaction, with a pause
+in between. We use plain archive tables rather than native partitions so
+the same code and migrations work on SQLite, MySQL and PostgreSQL.
+"""
+import heapq
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+
+from .cache import cache_ttl
+from .images import add_reference
+from .models import (
+    ArchivedNotification, ArchivedPost, Comment, Like, Notification, Post
+)
+
+User = get_user_model()
+
+BATCH_SIZE = 200
+PAUSE = 0.2
+
+ARCHIVED_POST_COUNT_KEY = 'archive:post-count'
+
+
+def archive_after_days():
+    """Age (days) after which posts and read notifications are archived"""
+    return getattr(settings, 'ARCHIVE_AFTER_DAYS', 180)
+
+
+class HotThenArchive:
+    """
+    A newest-first list made of a hot queryset followed by an archive
+    queryset. Supports count() and slicing, so Paginator and DRF
+    pagination can use it like a queryset.
+    """
+
+    def __init__(self, hot, archived):
+        self.hot = hot
+        self.archived = archived
+
+    @cached_property
+    def hot_count(self):
+        return self.hot.count()
+
+    def count(self):
+        return self.hot_count + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop = index.start or 0, index.stop
+        items = list(self.hot[start:stop])
+        if stop is not None and len(items) == stop - start:
+            return items  # The whole slice is hot - no archive query
+
+        # Where the hot rows ended tells us where to start in the archive
+        hot_count = start + len(items) if items else self.hot_count
+        archive_start = max(start - hot_count, 0)
+        archive_stop = None if stop is None else archive_start + (stop - start - len(items))
+        return items + list(self.archived[archive_start:archive_stop])
+
+
+class MergedByDate:
+    """
+    Newest-first list of two querysets whose dates overlap, merged by
+    (created_at, id). Supports count() and slicing like HotThenArchive;
+    a slice reads up to `stop` rows from each table.
+    """
+
+    def __init__(self, hot, archived):
+        self.hot = hot.order_by('-created_at', '-id')
+        self.archived = archived.order_by('-created_at', '-id')
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop = index.start or 0, index.stop
+        hot = self.hot if stop is None else self.hot[:stop]
+        archived = self.archived if stop is None else self.archived[:stop]
+        merged = heapq.merge(hot, archived, key=lambda row: (row.created_at, row.pk), reverse=True)
+        return list(islice(merged, start, stop))
+
+
+def archived_post_count():
+    """Number of archived posts (cached - it only changes when archive_cold runs or an account goes)"""
+    return cache.get_or_set(ARCHIVED_POST_COUNT_KEY, ArchivedPost.objects.count, cache_ttl())
+
+
+def forget_archived_post_count():
+    """Archived posts were added or removed - count them again on the next read"""
+    cache.delete(ARCHIVED_POST_COUNT_KEY)
+
+
+def _batches(queryset, batch_size, pause, move, progress):
+    """Run move(ids) on queryset's primary keys, batch_size at a time; returns rows moved"""
+    moved = 0
+    working = 0.0  # Time spent moving, without the pauses
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return moved
+
+        started = time.monotonic()
+        with transaction.atomic():
+            move(ids)
+        working += time.monotonic() - started
+
+        moved += len(ids)
+        if progress:
+            progress(moved, moved / working if working else 0)
+        time.sleep(pause)
+
+
+def _archive_post_batch(ids):
+    posts = list(Post.objects.filter(pk__in=ids))
+
+    liked_by = defaultdict(list)
+    for post_id, user_id in Like.objects.filter(post_id__in=ids).order_by('pk').values_list('post_id', 'user_id'):
+        liked_by[post_id].append(user_id)
+
+    comments = defaultdict(list)
+    for comment in Comment.objects.filter(post_id__in=ids).order_by('pk').values(
+        'id', 'post_id', 'user_id', 'parent_id', 'content', 'created_at'
+    ):
+        comment['created_at'] = comment['created_at'].isoformat()
+        comments[comment.pop('post_id')].append(comment)
+
+    ArchivedPost.objects.bulk_create([
+        ArchivedPost(
+            id=post.pk,
+            user_id=post.user_id,
+            content=post.content,
+            image=post.image,
+            image_asset_id=post.image_asset_id,
+            created_at=post.created_at,
+            updated_at=post.updated_at,
+            popularity_score=post.popularity_score,
+            liked_by=liked_by[post.pk],
+            comments=comments[post.pk],
+        )
+        for post in posts
+    ])
+
+    # Each author's posts_count reads this instead of counting their archived posts
+    archived_by_user = defaultdict(int)
+    for post in posts:
+        archived_by_user[post.user_id] += 1
+    for user_id, count in archived_by_user.items():
+        User.objects.filter(pk=user_id).update(archived_posts_count=F('archived_posts_count') + count)
+
+    # The archived copy takes over the post's image reference
+    for post in posts:
+        if post.image_asset_id:
+            add_reference(post.image_asset_id)
+
+    # Deleting the posts clears the notifications' links - keep the ids
+    Notification.objects.filter(related_post_id__in=ids).update(archived_post_id=F('related_post_id'))
+    Notification.objects.filter(related_comment__post_id__in=ids).update(archived_comment_id=F('related_comment_id'))
+
+    # Also removes the likes and comments (now stored on the archived post)
+    Post.all_objects.filter(pk__in=ids).delete()
+
+
+def _archive_notification_batch(ids):
+    notifications = list(Notification.objects.filter(pk__in=ids))
+    ArchivedNotification.objects.bulk_create([
+        ArchivedNotification(
+            id=n.pk,
+            user_id=n.user_id,
+            type=n.type,
+            message=n.message,
+            related_user_id=n.related_user_id,
+            related_post_id=n.related_post_id or n.archived_post_id,
+            related_comment_id=n.related_comment_id or n.archived_comment_id,
+            is_read=n.is_read,
+            created_at=n.created_at,
+        )
+        for n in notifications
+    ])
+    Notification.objects.filter(pk__in=ids).delete()
+
+
+def archive_posts(older_than, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """Move posts created before `older_than` to the archive; returns how many"""
+    posts = Post.objects.filter(created_at__lt=older_than)  # Soft-deleted posts are left for the purge
+    try:
+        return _batches(posts, batch_size, pause, _archive_post_batch, progress)
+    finally:
+        forget_archived_post_count()
+
+
+def archive_notifications(older_than, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """Move read notifications created before `older_than` to the archive; returns how many"""
+    notifications = Notification.objects.filter(created_at__lt=older_than, is_read=True)
+    return _batches(notifications, batch_size, pause, _archive_notification_batch, progress)
+
+
+# Size report
+
+HOT_MODELS = [Post, Like, Comment, Notification]
+
+
+def table_sizes(table):
+    """(data bytes, index bytes) of a table, or (None, None) if the database can't tell"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table])
+            return cursor.fetchone()
+
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT data_length, index_length FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [table]
+            )
+            row = cursor.fetchone()
+            return row if row else (None, None)
+
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+                data = cursor.fetchone()[0]
+                cursor.execute(
+                    'SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                    '(SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)', ['index', table]
+                )
+                return data, cursor.fetchone()[0] or 0
+            except Exception:
+                return None, None  # SQLite built without the dbstat table
+
+    return None, None
+
+
+def index_memory():
+    """Bytes the database keeps in memory for table and index pages, if known"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT setting::bigint * current_setting('block_size')::bigint FROM pg_settings WHERE name = 'shared_buffers'")
+            return cursor.fetchone()[0]
+        if connection.vendor == 'mysql':
+            cursor.execute('SELECT @@innodb_buffer_pool_size')
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA cache_size')
+            pages = cursor.fetchone()[0]
+            if pages < 0:
+                return -pages * 1024  # Negative means KiB
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+    return None
+
+
+def size_report():
+    """Rows and sizes of the hot tables, plus the memory their indexes compete for"""
+    tables = {}
+    for model in HOT_MODELS:
+        table = model._meta.db_table
+        data, indexes = table_sizes(table)
+        tables[table] = {
+            'rows': model._base_manager.count(),
+            'data_bytes': data,
+            'index_bytes': indexes,
+        }
+    return {'tables': tables, 'memory_bytes': index_memory()}
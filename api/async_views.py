@@ -0,0 +1,247 @@
+"""
+Async versions of the feed, notification list and profile views.
+
+Under ASGI (e.g. `uvicorn socialmedia.asgi:application`) a sync view holds
+a worker for the whole request, mostly waiting on the database. These
+views are coroutines, so one worker serves many requests at once, and the
+independent queries of a request run at the same time instead of one
+after the other:
+
+- feed: the page of posts, the total count and the following count
+- notifications: the newest 50, the unread count and the total count
+- profile: the follow flags and the "posts in your feed" count
+
+Django's async ORM (aupdate, aaggregate...) runs every query of a request
+on one thread, so gathering async ORM calls doesn't overlap them.
+gather_sync() runs each group on its own thread - and its own database
+connection - so they really do.
+
+They reuse the sync views' querysets, ETags and response shapes, so
+responses are the same. Turn them on with ASYNC_VIEWS=True (api/urls.py).
+Compare both with `python manage.py bench_async_views`.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import close_old_connections
+from django.db.models import Count, Max, Q
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import executors
+from .archive import MergedByDate
+from .cache import add_user_viewer_state, get_user_data, get_versions
+from .conditional import make_etag, post_versions
+from .models import ArchivedNotification, Notification, Post
+from .views import FeedView, NotificationListView, UserFollowDetailView
+
+
+
+def get_executor():
+    """
+    Threads for gather_sync(), shared by all requests. Also caps how many
+    database connections the async views hold (ASYNC_QUERY_THREADS; see
+    api/executors.py).
+    """
+    return executors.get_executor('async-query', getattr(settings, 'ASYNC_QUERY_THREADS', 32))
+
+
+def _own_connection(func):
+    def run():
+        try:
+            return func()
+        finally:
+            close_old_connections()  # Worker threads get no end-of-request cleanup
+    return run
+
+
+async def gather_sync(*funcs):
+    """Run independent sync functions (queries) at the same time; returns their results in order"""
+    return await asyncio.gather(*(
+        sync_to_async(_own_connection(func), thread_sensitive=False, executor=get_executor())()
+        for func in funcs
+    ))
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with an async get(). Authentication, permissions and throttling
+    run exactly as in DRF (on a thread); subclasses implement
+    async respond() and may override async aget_etag().
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Same steps as APIView.dispatch, awaiting the handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                handler = self.http_method_not_allowed
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_etag(self, request, *args, **kwargs):
+        return await sync_to_async(self.get_etag)(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        # Conditional GET as in ConditionalGetMixin
+        etag = await self.aget_etag(request, *args, **kwargs)
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                patch_vary_headers(not_modified, ['Authorization'])
+                return not_modified
+
+        response = await self.respond(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+
+class AsyncFeedView(AsyncAPIView, FeedView):
+    """FeedView: page, count and following count at once"""
+
+    async def aget_etag(self, request, *args, **kwargs):
+        if request.query_params.get('rank') == 'relevance':
+            return None  # Ranked pages are already cached per user
+
+        try:
+            page_size = int(request.query_params.get('page_size', 10))
+            page_number = int(request.query_params.get('page', 1))
+        except ValueError:
+            return None
+
+        queryset = self.filter_queryset(self.get_queryset())
+        start = (page_number - 1) * page_size
+
+        def page_versions():
+            page_ids = list(queryset.values_list('id', flat=True)[start:start + page_size]) if start >= 0 else []
+            return post_versions(page_ids)
+
+        timeline, versions = await gather_sync(
+            lambda: queryset.aggregate(newest=Max('id'), changed=Max('updated_at'), total=Count('id', distinct=True)),
+            page_versions,
+        )
+
+        return make_etag(
+            'feed', request.user.pk, request.query_params.urlencode(),
+            timeline['newest'], timeline['changed'], timeline['total'],
+            await sync_to_async(get_versions)('user', [request.user.pk]),  # following_count
+            versions
+        )
+
+    async def respond(self, request, *args, **kwargs):
+        if request.query_params.get('rank') == 'relevance':
+            # Ranked ids come from a per-user cache - nothing to overlap
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page_size = int(request.query_params.get('page_size', 10))
+        page_number = int(request.query_params.get('page', 1))
+        start = (page_number - 1) * page_size
+
+        def page_posts():
+            if start < 0 or page_size <= 0:
+                return []
+            return self.get_serializer(queryset[start:start + page_size], many=True).data
+
+        count, posts_data, following_count = await gather_sync(
+            queryset.count, page_posts, lambda: request.user.following_count
+        )
+
+        # The count is known, so the paginator checks the page without a query
+        paginator = Paginator(queryset, page_size)
+        paginator.count = count
+        try:
+            page = Page(posts_data, paginator.validate_number(page_number), paginator)
+        except Exception:
+            return Response(
+                {"error": "Invalid page number."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(self.feed_data(request, paginator, page, posts_data, following_count, 'chronological'))
+
+
+class AsyncNotificationListView(AsyncAPIView, NotificationListView):
+    """NotificationListView: newest 50, unread count and total count at once"""
+
+    async def aget_etag(self, request, *args, **kwargs):
+        if request.query_params.get('mark_read', '').lower() == 'true':
+            return None  # Has a side effect - always run it
+
+        summary = await Notification.objects.filter(user=request.user).aaggregate(
+            newest=Max('id'), total=Count('id'), unread=Count('id', filter=Q(is_read=False))
+        )
+        return make_etag('notifications', request.user.pk, summary['newest'], summary['total'], summary['unread'])
+
+    async def respond(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # Mark all as read if requested - before the counts
+        if request.query_params.get('mark_read', '').lower() == 'true':
+            await queryset.aupdate(is_read=True)
+
+        # Newest 50 - older ones continue into the archive (api/archive.py)
+        archived = ArchivedNotification.objects.filter(user=request.user).select_related('related_user')
+        newest = MergedByDate(queryset, archived)
+        everything = MergedByDate(queryset, archived)  # Its own copy - they run on different threads
+
+        notifications, unread_count, total_count = await gather_sync(
+            lambda: [self.notification_data(n) for n in newest[:50]],
+            queryset.filter(is_read=False).count,
+            everything.count,
+        )
+
+        return Response({
+            'unread_count': unread_count,
+            'total_count': total_count,
+            'notifications': notifications
+        })
+
+
+class AsyncUserFollowDetailView(AsyncAPIView, UserFollowDetailView):
+    """UserFollowDetailView: follow flags and feed stats at once"""
+
+    async def respond(self, request, *args, **kwargs):
+        # Profile comes from the cache, follow flags are per viewer
+        data = await sync_to_async(get_user_data)(self.kwargs['username'])
+        if data is None:
+            raise Http404("No User matches the given query.")
+
+        is_own_profile = data['id'] == request.user.pk
+        queries = [lambda: add_user_viewer_state(data, request.user)]
+        if not is_own_profile:
+            queries.append(Post.objects.filter(
+                user_id=data['id'],
+                is_deleted=False,
+                user__followers__follower=request.user
+            ).count)
+        results = await gather_sync(*queries)
+
+        data['feed_stats'] = {
+            'total_posts': data['posts_count'],
+            'posts_in_your_feed': results[1] if not is_own_profile else 'N/A (your own profile)',
+            'would_see_in_feed': data['is_following']
+        }
+
+        return Response(data)
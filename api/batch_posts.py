@@ -0,0 +1,150 @@
+"""
+Creating many posts in one request: POST /api/posts/batch/
+
+Importers and scheduling tools used to call POST /api/posts/ once per post.
+Every call is a full request with its own validation, insert and side
+effects (popularity update, cache invalidation, feed buffer write, image
+reference). Here a whole batch is:
+
+- validated in one pass - image ids are checked with one query for all
+  attached images and one for all image jobs
+- inserted with a single bulk_create (a row at a time on MySQL, which
+  can't return the new ids)
+- followed by the side effects once per batch: one score update, one
+  bump of the author's cache version, one image reference update per
+  image and one feed buffer write
+
+bulk_create doesn't send post_save, so everything the Post signals do on
+create (api/signals.py) is done here instead.
+
+Each post gets its own result, so one bad item doesn't fail the rest:
+
+    {"index": 0, "status": 201, "id": 42, "created_at": "..."}
+    {"index": 1, "status": 400, "errors": {"content": ["Content cannot be empty."]}}
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import feed_buffer
+from .cache import bump_version
+from .image_jobs import resolve_if_done
+from .images import add_reference
+from .models import ImageAsset, ImageJob, Post
+from .popularity import compute_score
+from .serializers import PostBatchItemSerializer
+
+
+def max_batch_size():
+    """Most posts one request may create"""
+    return getattr(settings, 'POST_BATCH_MAX', 100)
+
+
+def validate_posts(user, items):
+    """
+    Check every item. Returns (valid, errors): valid is a list of
+    (index, unsaved Post), errors maps index -> error dict.
+    """
+    errors = {}
+    checked = []
+    for index, item in enumerate(items):
+        serializer = PostBatchItemSerializer(data=item)
+        if serializer.is_valid():
+            checked.append((index, serializer.validated_data))
+        else:
+            errors[index] = serializer.errors
+
+    # Users can only attach their own uploads - one query each for the whole batch
+    asset_ids = {data['image_asset'] for _, data in checked if data.get('image_asset')}
+    job_ids = {data['image_job'] for _, data in checked if data.get('image_job')}
+    own_assets = set(
+        ImageAsset.objects.filter(pk__in=asset_ids, uploaders=user).values_list('pk', flat=True)
+    ) if asset_ids else set()
+    own_jobs = {
+        job.pk: job for job in ImageJob.objects.filter(pk__in=job_ids, user=user)
+    } if job_ids else {}
+
+    valid = []
+    for index, data in checked:
+        asset_id = data.get('image_asset')
+        job_id = data.get('image_job')
+        job = own_jobs.get(job_id)
+
+        if asset_id and asset_id not in own_assets:
+            errors[index] = {'image_asset': ["You can only use images you uploaded."]}
+            continue
+        if job_id and job is None:
+            errors[index] = {'image_job': ["You can only use images you uploaded."]}
+            continue
+        if job is not None and job.status == 'failed':
+            errors[index] = {'image_job': [f"This image could not be processed: {job.error}"]}
+            continue
+
+        # A finished job is stored as the image itself
+        if job is not None and job.status == 'done':
+            asset_id, job_id = job.asset_id, None
+
+        valid.append((index, Post(
+            user=user, content=data['content'], image_asset_id=asset_id, image_job_id=job_id
+        )))
+
+    return valid, errors
+
+
+def _insert(posts):
+    """bulk_create, making sure every post ends up with its id"""
+    if connection.features.can_return_rows_from_bulk_insert:
+        Post.objects.bulk_create(posts)
+        return
+
+    # MySQL doesn't return ids from bulk inserts, and the ids of one multi-row
+    # insert aren't always consecutive (innodb_autoinc_lock_mode=2). Insert one
+    # row at a time and ask for its id - still without the per-post signals.
+    with connection.cursor() as cursor:
+        for post in posts:
+            Post.objects.bulk_create([post])
+            cursor.execute('SELECT LAST_INSERT_ID()')
+            post.pk = cursor.fetchone()[0]
+
+
+def create_posts(user, items):
+    """
+    Validate and create `items` (dicts like a POST /api/posts/ body) for
+    `user`. Returns one result dict per item, in order.
+    """
+    valid, errors = validate_posts(user, items)
+    posts = [post for _, post in valid]
+
+    if posts:
+        with transaction.atomic():
+            _insert(posts)
+
+            # What set_initial_popularity does per post, as one bulk update
+            for post in posts:
+                post.popularity_score = compute_score(0, 0, post.created_at)
+                post.last_activity_at = post.created_at
+            Post.objects.bulk_update(posts, ['popularity_score', 'last_activity_at'])
+
+            # One reference per post showing an image
+            for asset_id, count in Counter(p.image_asset_id for p in posts if p.image_asset_id).items():
+                add_reference(asset_id, count)
+
+            # New posts have no cached copies - only the author's posts_count changed
+            bump_version('user', user.pk)
+
+            # Before resolving jobs, so their refreshes land after the push
+            transaction.on_commit(lambda: feed_buffer.push_many(posts))
+
+            # Jobs may have finished while we were saving
+            for job_id in {p.image_job_id for p in posts if p.image_job_id}:
+                resolve_if_done(job_id)
+
+    results = [None] * len(items)
+    for index, post in valid:
+        results[index] = {
+            'index': index, 'status': 201, 'id': post.pk, 'created_at': post.created_at,
+        }
+    for index, error in errors.items():
+        results[index] = {'index': index, 'status': 400, 'errors': error}
+    return results
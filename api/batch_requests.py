@@ -0,0 +1,204 @@
+"""
+Several API calls in one HTTP request: POST /api/batch/
+
+On launch the app needs the profile, feed, notifications, followers...
+Sent one by one, every call pays a round trip plus authentication and
+middleware again. The batch endpoint authenticates once, then runs each
+sub-request straight through the normal URLconf and views:
+
+    {
+        "parallel": true,
+        "requests": [
+            {"id": "me", "url": "/api/accounts/me/"},
+            {"id": "feed", "url": "/api/feed/?page_size=20"},
+            {"id": "notifications", "url": "/api/notifications/",
+             "headers": {"If-None-Match": "\\"abc\\""}}
+        ]
+    }
+
+returns
+
+    {"responses": {"me": {"status": 200, "headers": {...}, "body": {...}}, ...}}
+
+- Sub-requests run as the batch's user; their own Authorization headers
+  are ignored. Throttling still counts every sub-request.
+- Sub-requests run in order, or with "parallel": true all at once on a
+  small thread pool (only for calls that don't depend on each other).
+- Only /api/ URLs can be called, and batches can't be nested.
+"""
+import json
+from io import BytesIO
+from urllib.parse import unquote_to_bytes, urlsplit
+
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import executors
+from .db_router import route_request
+
+METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Headers a sub-request may set - the rest come from the batch request
+ALLOWED_HEADERS = ('Accept', 'Accept-Language', 'If-None-Match', 'If-Match', 'If-Modified-Since')
+
+# Batch request headers sub-requests don't inherit
+SKIPPED_META = ('HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'CONTENT_TYPE', 'CONTENT_LENGTH')
+
+def max_requests():
+    """Most sub-requests per batch"""
+    return getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+
+
+def get_executor():
+    """Threads for parallel sub-requests, shared by all batches (api/executors.py)"""
+    return executors.get_executor('api-batch', getattr(settings, 'BATCH_WORKERS', 8))
+
+
+def url_path(url):
+    """The path of `url`, percent-decoded the way WSGI hands it to Django"""
+    return unquote_to_bytes(urlsplit(url).path).decode('iso-8859-1')
+
+
+def is_batch_url(url):
+    """Whether `url` reaches the batch endpoint, however it's spelled (e.g. /api/%62atch/)"""
+    from .views import BatchRequestView
+
+    try:
+        match = resolve(url_path(url))
+    except Resolver404:
+        return False
+    return getattr(match.func, 'view_class', None) is BatchRequestView
+
+
+def validate_batch(data):
+    """Check a batch body - returns an error message, or None if it's fine"""
+    if not isinstance(data, dict):
+        return "Send a JSON object with a list of requests."
+
+    requests = data.get('requests')
+    if not isinstance(requests, list) or not requests:
+        return "Send a non-empty list of requests."
+    if len(requests) > max_requests():
+        return f"At most {max_requests()} requests per batch."
+    if not isinstance(data.get('parallel', False), bool):
+        return "parallel must be true or false."
+
+    ids = set()
+    for position, spec in enumerate(requests):
+        if not isinstance(spec, dict):
+            return f"Request {position} must be an object."
+
+        request_id = spec.get('id')
+        if not isinstance(request_id, (str, int)) or isinstance(request_id, bool):
+            return f"Request {position} needs an id (string or number)."
+        if str(request_id) in ids:
+            return f"Duplicate request id: {request_id}"
+        ids.add(str(request_id))
+
+        url = spec.get('url')
+        if not isinstance(url, str) or not url.startswith('/api/'):
+            return f"Request {request_id}: url must be an /api/ path."
+        if is_batch_url(url):
+            return f"Request {request_id}: batches can't be nested."
+
+        method = spec.get('method', 'GET')
+        if not isinstance(method, str) or method.upper() not in METHODS:
+            return f"Request {request_id}: unsupported method."
+
+        headers = spec.get('headers', {})
+        if not isinstance(headers, dict) or not all(isinstance(v, str) for v in headers.values()):
+            return f"Request {request_id}: headers must map names to strings."
+        allowed = {name.lower() for name in ALLOWED_HEADERS}
+        for name in headers:
+            if name.lower() not in allowed:
+                return f"Request {request_id}: header {name} can't be set (allowed: {', '.join(ALLOWED_HEADERS)})."
+
+    return None
+
+
+def build_request(batch_request, spec):
+    """A Django request for one sub-request, authenticated as the batch's user"""
+    url = urlsplit(spec['url'])
+    body = b'' if spec.get('body') is None else json.dumps(spec['body']).encode()
+
+    environ = {
+        key: value for key, value in batch_request.META.items()
+        if key not in SKIPPED_META and not key.startswith('wsgi.')
+    }
+    environ.update({
+        'REQUEST_METHOD': spec.get('method', 'GET').upper(),
+        'PATH_INFO': url_path(spec['url']),
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+        'wsgi.url_scheme': batch_request.scheme,
+    })
+    for name, value in spec.get('headers', {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    request = WSGIRequest(environ)
+    # Share the batch's authentication - DRF uses these instead of the authenticators
+    request.user = batch_request.user
+    request._force_auth_user = batch_request.user
+    request._force_auth_token = batch_request.auth
+    return request
+
+
+def dispatch(request):
+    """Resolve and call the view, turning errors into responses like Django does"""
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return JsonResponse({"error": "Not found."}, status=404)
+
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()  # DRF and template responses render lazily
+    except Exception as exc:
+        response = response_for_exception(request, exc)
+    return response
+
+
+def response_data(response):
+    """status / headers / body of a sub-response"""
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    body = None
+    if content:
+        if response.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(content)
+        else:
+            body = content.decode(response.charset, errors='replace')
+    return {
+        'status': response.status_code,
+        'headers': {name: value for name, value in response.items() if name != 'Content-Length'},
+        'body': body,
+    }
+
+
+def run_one(batch_request, spec):
+    request = build_request(batch_request, spec)
+    # Replica routing and stickiness per sub-request (see api/db_router.py)
+    return response_data(route_request(request, dispatch))
+
+
+def _run_in_pool(batch_request, spec):
+    try:
+        return run_one(batch_request, spec)
+    finally:
+        close_old_connections()  # Pool threads don't get Django's end-of-request cleanup
+
+
+def run_batch(batch_request, specs, parallel=False):
+    """Run the sub-requests; returns {id: response data}"""
+    if parallel and len(specs) > 1:
+        futures = [get_executor().submit(_run_in_pool, batch_request, spec) for spec in specs]
+        results = [future.result() for future in futures]
+    else:
+        results = [run_one(batch_request, spec) for spec in specs]
+    return {str(spec['id']): result for spec, result in zip(specs, results)}
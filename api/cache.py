@@ -0,0 +1,263 @@
+"""
+Per-object cache for serialized posts and user profiles.
+
+Each object has a version number in the cache. Data is stored under
+"<kind>:<pk>:v<version>", so invalidating an object is just bumping its
+version - old entries are never read again and expire on their own.
+Versions are bumped from the save/delete signals in api/signals.py.
+
+Cached data is viewer independent. Fields that depend on who is asking
+(is_liked, is_following, follows_you) are filled in per request.
+
+Hot entries go through single_flight(), so when one expires only one
+worker rebuilds it while the others keep serving the old copy.
+"""
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+
+from .metrics import record_cache_lookup
+from .models import Post, Like, Follow
+
+User = get_user_model()
+
+HITS_KEY = 'cache-stats:hits'
+MISSES_KEY = 'cache-stats:misses'
+
+
+def cache_ttl():
+    """How long cached objects live (seconds)"""
+    return getattr(settings, 'CACHE_TTL', 300)
+
+
+def _version_key(kind, pk):
+    return f'{kind}:{pk}:version'
+
+
+def get_version(kind, pk):
+    """Current version of an object (created on first use)"""
+    key = _version_key(kind, pk)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, not 1, so a lost version key can never
+        # point back at an old entry that is still in the cache
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(kind, pk):
+    """Invalidate every cached copy of an object"""
+    try:
+        cache.incr(_version_key(kind, pk))
+    except ValueError:
+        # No version yet - start one, so ETags built from versions still change
+        cache.add(_version_key(kind, pk), int(time.time() * 1000), None)
+
+
+def get_versions(kind, pks):
+    """Current versions of many objects, with one cache call when they all exist"""
+    keys = {_version_key(kind, pk): pk for pk in pks}
+    found = cache.get_many(list(keys))
+    return {
+        pk: found[key] if key in found else get_version(kind, pk)
+        for key, pk in keys.items()
+    }
+
+
+def _count(key):
+    """Increment a stats counter"""
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def _record(key, hit):
+    """Count a lookup of `key` in the shared stats and the metrics"""
+    _count(HITS_KEY if hit else MISSES_KEY)
+    record_cache_lookup(key, hit)
+
+
+def acquire_lease(key, timeout):
+    """Try to become the one worker allowed to rebuild `key`"""
+    token = uuid.uuid4().hex
+    if cache.add(f'{key}:lease', token, timeout):
+        return token
+    return None
+
+
+def release_lease(key, token):
+    if cache.get(f'{key}:lease') == token:
+        cache.delete(f'{key}:lease')
+
+
+def _rebuild(key, build, ttl, stale_ttl):
+    """Build a value and store it with its soft expiry and build time"""
+    started = time.time()
+    value = build()
+    if value is not None:
+        cache.set(key, {
+            'value': value,
+            'expires': time.time() + ttl,
+            'delta': time.time() - started,
+        }, ttl + stale_ttl)
+    return value
+
+
+def single_flight(key, build, ttl, stale_ttl=None, lease_timeout=10, beta=1.0):
+    """
+    Cache-aside read with stampede protection.
+
+    - Fresh entry: served. As it nears expiry, a caller may refresh it
+      early, with a chance that grows the closer expiry is and the longer
+      the value takes to build (probabilistic early refresh / XFetch).
+    - Stale entry (soft TTL passed, still within stale_ttl): one caller
+      takes a lease and rebuilds, everyone else is served the stale copy.
+    - Missing entry: one caller builds, the others wait for its result
+      instead of all hitting the database.
+
+    `build` returns the value, or None if there is nothing to cache.
+    """
+    if stale_ttl is None:
+        stale_ttl = ttl
+
+    entry = cache.get(key)
+    if entry is not None:
+        # XFetch: -log(random) is usually small, now and then large
+        early = entry['delta'] * beta * -math.log(random.random() or 1e-12)
+        if time.time() + early < entry['expires']:
+            _record(key, hit=True)
+            return entry['value']
+
+        token = acquire_lease(key, lease_timeout)
+        if token is None:
+            # Someone else is refreshing - serve stale while they do
+            _record(key, hit=True)
+            return entry['value']
+        try:
+            _record(key, hit=False)
+            value = _rebuild(key, build, ttl, stale_ttl)
+            return value if value is not None else entry['value']
+        finally:
+            release_lease(key, token)
+
+    _record(key, hit=False)
+    token = acquire_lease(key, lease_timeout)
+    if token is None:
+        # Wait for the worker holding the lease to fill the cache
+        deadline = time.time() + lease_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry['value']
+            if cache.get(f'{key}:lease') is None:
+                break  # Builder finished with nothing to cache, or gave up
+        return build()
+
+    try:
+        return _rebuild(key, build, ttl, stale_ttl)
+    finally:
+        release_lease(key, token)
+
+
+def get_or_build(kind, pk, build):
+    """
+    Get an object's cached data, or build and cache it.
+    `build` returns the data, or None if the object does not exist.
+    """
+    key = f'{kind}:{pk}:v{get_version(kind, pk)}'
+    return single_flight(key, build, cache_ttl())
+
+
+def cache_stats():
+    """Hit / miss counters and the hit ratio"""
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+# Posts
+
+def _build_post(pk):
+    from .serializers import PostSerializer
+
+    post = Post.objects.filter(pk=pk, is_deleted=False).select_related('user', 'image_asset').first()
+    if post is None:
+        return None
+    # No request in the context, so is_liked is left for add_post_viewer_state
+    return dict(PostSerializer(post).data)
+
+
+def get_post_data(pk):
+    """Serialized post (viewer independent), or None if it does not exist"""
+    return get_or_build('post', pk, lambda: _build_post(pk))
+
+
+def add_post_viewer_state(posts_data, user):
+    """Fill in is_liked for a list of serialized posts (one query)"""
+    ids = [post['id'] for post in posts_data]
+    liked = set(
+        Like.objects.filter(user=user, post_id__in=ids).values_list('post_id', flat=True)
+    ) if ids else set()
+
+    for post in posts_data:
+        post['is_liked'] = post['id'] in liked
+    return posts_data
+
+
+# Users
+
+def _build_user(pk):
+    from .serializers import UserDetailSerializer
+
+    user = User.objects.filter(pk=pk).first()
+    if user is None:
+        return None
+    # No request in the context, so the follow flags are left for add_user_viewer_state
+    return dict(UserDetailSerializer(user).data)
+
+
+def get_user_data(username, retry=True):
+    """Serialized user profile (viewer independent), or None if not found"""
+    alias_key = f'user-id:{username}'
+    pk = cache.get(alias_key)
+    if pk is None:
+        retry = False  # The alias is fresh from the database
+        pk = User.objects.filter(username=username).values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        cache.set(alias_key, pk, cache_ttl())
+
+    data = get_or_build('user', pk, lambda: _build_user(pk))
+    if data is None or data['username'] != username:
+        # The user was deleted or renamed since the alias was cached
+        cache.delete(alias_key)
+        return get_user_data(username, retry=False) if retry else None
+    return data
+
+
+def add_user_viewer_state(user_data, viewer):
+    """Fill in is_following / follows_you for a serialized user (one query)"""
+    pairs = set(
+        Follow.objects.filter(
+            Q(follower=viewer, following_id=user_data['id']) |
+            Q(follower_id=user_data['id'], following=viewer)
+        ).values_list('follower_id', 'following_id')
+    )
+    user_data['is_following'] = (viewer.pk, user_data['id']) in pairs
+    user_data['follows_you'] = (user_data['id'], viewer.pk) in pairs
+    return user_data
@@ -0,0 +1,148 @@
+"""
+Resumable, chunked image uploads.
+
+    POST   /api/upload/image/chunked/                  {"size": 3145728}  -> upload_id
+    PUT    /api/upload/image/chunked/<id>/             raw bytes, Upload-Offset: <n>
+    GET    /api/upload/image/chunked/<id>/             -> {"offset": n} to resume
+    POST   /api/upload/image/chunked/<id>/finalize/    -> image job (see api/image_jobs.py)
+
+Chunks are streamed to a file under settings.CHUNKED_UPLOAD_DIR in small
+blocks, so a worker never holds more than READ_BLOCK bytes of an upload in
+memory, however large the chunk. Each chunk is written at its offset and
+the session only moves forward once the whole chunk is on disk - after a
+dropped connection the client asks for the offset and sends the rest.
+The first chunk must start with the magic bytes of an accepted format.
+"""
+import os
+
+from django.conf import settings
+
+from .cache import acquire_lease, release_lease
+from .images import MAX_UPLOAD_SIZE, detect_image_type, file_hash
+from .image_jobs import create_job_from_file
+from .models import UploadSession
+
+# Largest chunk accepted in one request
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# How much of a chunk is read into memory at a time
+READ_BLOCK = 64 * 1024
+
+# How long a finalize may hold the upload's lock (seconds)
+FINALIZE_LOCK_TIMEOUT = 60
+
+# Bytes needed to recognise every accepted format (WebP is 'RIFF....WEBP')
+MAGIC_LENGTH = 12
+
+
+class ChunkError(ValueError):
+    """A chunk that can't be accepted; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_path(session):
+    """Where the session's bytes are kept until finalize"""
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.id}.part')
+
+
+def start_upload(user, size):
+    """Create an upload session for a file of `size` bytes"""
+    if size <= 0 or size > MAX_UPLOAD_SIZE:
+        raise ChunkError(f"size must be between 1 and {MAX_UPLOAD_SIZE} bytes.")
+
+    session = UploadSession.objects.create(user=user, size=size)
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(upload_path(session), 'wb').close()
+    return session
+
+
+def append_chunk(session, offset, stream, length):
+    """
+    Write `length` bytes from `stream` at `offset`. Returns the new offset.
+    Raises ChunkError (409 if the offset is not where the upload stands).
+    """
+    if offset != session.received:
+        raise ChunkError(f"Expected offset {session.received}.", status=409)
+    if length <= 0 or length > MAX_CHUNK_SIZE:
+        raise ChunkError(f"Chunks must be between 1 and {MAX_CHUNK_SIZE} bytes.", status=413)
+    if offset + length > session.size:
+        raise ChunkError(f"Chunk goes past the declared size ({session.size} bytes).")
+
+    written = 0
+    with open(upload_path(session), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(READ_BLOCK, length - written))
+            if not block:
+                break  # Client went away - the next attempt resumes from `offset`
+
+            if offset == 0 and written == 0:
+                check_magic_bytes(session, block)
+            f.write(block)
+            written += len(block)
+
+    if written < length:
+        raise ChunkError("Chunk was cut short. Resume from the returned offset.")
+
+    # Only move forward if no other request got here first
+    updated = UploadSession.objects.filter(pk=session.pk, received=offset).update(received=offset + written)
+    if not updated:
+        session.refresh_from_db()
+        raise ChunkError(f"Expected offset {session.received}.", status=409)
+
+    session.received = offset + written
+    return session.received
+
+
+def check_magic_bytes(session, head):
+    """The first chunk must look like an accepted image"""
+    if len(head) < min(MAGIC_LENGTH, session.size):
+        raise ChunkError(f"The first chunk must be at least {MAGIC_LENGTH} bytes.")
+
+    content_type = detect_image_type(head)
+    if content_type is None:
+        raise ChunkError("Invalid file type. Allowed: JPG, PNG, GIF, WebP", status=415)
+
+    UploadSession.objects.filter(pk=session.pk).update(content_type=content_type)
+    session.content_type = content_type
+
+
+def finish_upload(session):
+    """
+    Hand a complete upload to a background image job; returns the job.
+    Raises ChunkError (409) if another request is finishing it already.
+    """
+    if session.received < session.size:
+        raise ChunkError(f"Upload incomplete: {session.received} of {session.size} bytes received.")
+
+    # One finalize per upload - a retried request must not move the file twice
+    lock = f'upload:{session.id}:finalize'
+    token = acquire_lease(lock, FINALIZE_LOCK_TIMEOUT)
+    if token is None:
+        raise ChunkError("Upload is already being finalized.", status=409)
+
+    try:
+        path = upload_path(session)
+        try:
+            with open(path, 'r+b') as f:
+                f.truncate(session.size)  # Drop leftovers of cut-short retries
+            job = create_job_from_file(session.user, path, file_hash(path))
+        except FileNotFoundError:
+            # Finished by a worker that doesn't share our cache
+            raise ChunkError("Upload was already finalized.", status=409)
+        session.delete()  # The file now belongs to the job
+        return job
+    finally:
+        release_lease(lock, token)
+
+
+def cancel_upload(session):
+    """Remove an upload session and its file"""
+    try:
+        os.remove(upload_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
@@ -0,0 +1,38 @@
+"""
+Lazy Cloudinary client.
+
+The SDK is configured on the first upload / delete, not when settings
+load - so worker boot, manage.py commands and tests never touch the
+network. (cloudinary.uploader itself is imported at startup anyway:
+CloudinaryField pulls it in through cloudinary.forms.) Credentials come from settings.CLOUDINARY_STORAGE (read from
+the environment), or from CLOUDINARY_URL, which the SDK picks up itself.
+"""
+import threading
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_configured = False
+
+
+def get_uploader():
+    """cloudinary.uploader, configured on first call"""
+    global _configured
+
+    import cloudinary
+    import cloudinary.uploader
+
+    if not _configured:
+        with _lock:
+            if not _configured:
+                credentials = getattr(settings, 'CLOUDINARY_STORAGE', {})
+                if credentials.get('CLOUD_NAME'):
+                    cloudinary.config(
+                        cloud_name=credentials['CLOUD_NAME'],
+                        api_key=credentials.get('API_KEY'),
+                        api_secret=credentials.get('API_SECRET'),
+                        secure=True
+                    )
+                _configured = True
+
+    return cloudinary.uploader
@@ -0,0 +1,66 @@
+"""
+Conditional GET support (ETag / If-None-Match).
+
+Views add ConditionalGetMixin and implement get_etag(), which returns a
+cheap validator string built without serializing anything - timestamps,
+newest ids and the cache versions from api/cache.py (bumped on every
+edit, like, comment and follow). When the client's If-None-Match matches,
+the view answers 304 Not Modified and skips the real work.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+
+from .cache import get_versions
+
+User = get_user_model()
+
+
+def make_etag(*parts):
+    """Hash validator parts into a short quoted ETag"""
+    raw = '|'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def post_versions(post_ids):
+    """Cache versions for a list of posts, as a stable string"""
+    versions = get_versions('post', post_ids)
+    return ','.join(f'{pk}:{versions[pk]}' for pk in post_ids)
+
+
+def user_profile_etag(username, viewer):
+    """ETag for a user profile: edit time + cache version (follows, posts) + viewer"""
+    row = User.objects.filter(username=username).values_list('pk', 'updated_at').first()
+    if row is None:
+        return None
+    pk, updated_at = row
+    return make_etag('profile', pk, updated_at.isoformat(), get_versions('user', [pk]), viewer.pk)
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET with 304 Not Modified when the client already has the
+    current version. Implement get_etag(request, *args, **kwargs); it
+    should include everything the response depends on, including the
+    user (responses are per user). Return None to skip the check.
+    """
+
+    def get_etag(self, request, *args, **kwargs):
+        return None
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request, *args, **kwargs)
+        if etag is None:
+            return super().get(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ['Authorization'])
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Authorization'])
+        return response
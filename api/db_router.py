@@ -0,0 +1,135 @@
+"""
+Read replicas.
+
+With DATABASE_REPLICA_URLS set, reads (feeds, profiles, comment lists...)
+go to a replica and writes go to the primary (`default`). Replicas lag a
+little behind the primary, so we avoid reading stale data in three cases:
+
+- requests that can write (POST/PUT/PATCH/DELETE) read from the primary,
+- once a request has written, the rest of it reads from the primary,
+- a user who wrote reads from the primary for REPLICA_STICKY_SECONDS
+  afterwards, so they see their own new post, like or comment.
+
+Code outside a request (management commands, image jobs) always uses the
+primary. ReplicaMiddleware tracks the current request for the router.
+
+The "user wrote recently" flag is a cache key, so every worker must share
+the cache: settings refuse DATABASE_REPLICA_URLS without a shared CACHE_URL.
+
+Try it locally with two SQLite files:
+
+    cp db.sqlite3 replica.sqlite3
+    CACHE_URL=file:///tmp/socialmedia-cache DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 python manage.py runserver
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import empty
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# State of the request being handled in this thread / task
+_state = ContextVar('db_router_state', default=None)
+
+
+class RequestState:
+    def __init__(self, request):
+        self.request = request
+        self.wrote = request.method not in SAFE_METHODS
+        self.sticky = None  # Unknown until the user is authenticated
+
+
+def current_request():
+    """The request being handled in this thread / task, or None"""
+    state = _state.get()
+    return state.request if state is not None else None
+
+
+def sticky_key(user_id):
+    return f'db-primary:{user_id}'
+
+
+def authenticated_user_id(request):
+    """The request's user id, without triggering an authentication query"""
+    user = request.__dict__.get('user')
+    if user is None:
+        return None
+    if getattr(user, '_wrapped', None) is empty:
+        return None  # Lazy session user not loaded yet - loading it here would recurse into the router
+    if not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def use_primary(state):
+    """Should this request read from the primary?"""
+    if state.wrote:
+        return True
+    if state.sticky is None:
+        user_id = authenticated_user_id(state.request)
+        if user_id is None:
+            return False  # Ask again once the user is known
+        state.sticky = bool(cache.get(sticky_key(user_id)))
+    return state.sticky
+
+
+class PrimaryReplicaRouter:
+    """Send reads to a replica and writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        state = _state.get()
+        if not replicas or state is None or use_primary(state):
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """Let the router see the current request, and pin users who wrote to the primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return route_request(request, self.get_response)
+
+
+def route_request(request, get_response):
+    """
+    Run get_response(request) with the router tracking `request`. Also used
+    for the sub-requests of /api/batch/, which skip the middleware.
+    """
+    state = RequestState(request)
+    token = _state.set(state)
+    try:
+        response = get_response(request)
+    finally:
+        _state.reset(token)
+
+    if state.wrote and settings.DATABASE_REPLICAS:
+        user = getattr(request, 'user', None)  # Safe to load now, the request is done
+        if user is not None and user.is_authenticated:
+            cache.set(sticky_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+    return response
+
+
+def reads_only():
+    """
+    The current request doesn't write, whatever its method - e.g. POST
+    /api/batch/, whose sub-requests are tracked on their own.
+    """
+    state = _state.get()
+    if state is not None:
+        state.wrote = False
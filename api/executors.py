@@ -0,0 +1,40 @@
+"""
+Shared thread pools for work that leaves the request thread.
+
+Each kind of work gets one pool per process, created on first use:
+
+    get_executor('api-batch', getattr(settings, 'BATCH_WORKERS', 8))
+
+Database connections: every pool thread that runs a query opens its own
+connection and keeps it for CONN_MAX_AGE (600 seconds) between tasks, so
+a busy worker process can hold, per database (the primary and each
+replica it reads from), up to
+
+    1                       the request thread (or ASGI's sync thread)
+    + BATCH_WORKERS         parallel batch sub-requests (default 8)
+    + ASYNC_QUERY_THREADS   async view queries, with ASYNC_VIEWS (default 32)
+    + IMAGE_WORKERS         image jobs (default 2)
+    + 1                     account deletions
+    + 1                     slow-query EXPLAINs
+    + 1                     post refreshes after a rename
+
+That is 14 connections with the defaults, or 46 with ASYNC_VIEWS on -
+times the number of worker processes. The database's max_connections
+(or a connection pooler in front of it) has to allow for that.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, workers):
+    """The `name` pool, created with `workers` threads the first time it's asked for"""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return executor
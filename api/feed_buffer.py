@@ -0,0 +1,188 @@
+"""
+Shared ring buffer of the newest posts for the global feed.
+
+The global feed is the same for everyone, so we keep the newest N
+serialized posts in the cache (shared between workers when CACHE_URL
+points at a shared backend). The first pages of GlobalFeedView are
+sliced straight out of it - no ORDER BY / OFFSET / COUNT queries.
+
+The buffer is kept current from the Post / Like / Comment signals:
+new posts are pushed in, soft-deleted posts are taken out, and edited
+or liked posts (and posts whose author was renamed, from the User
+signal) are re-serialized in place. Requests past the end of
+the buffer fall back to keyset queries that start at its last post.
+
+Each entry is {'key': [created_at iso, id], 'post': serialized post},
+newest first. The key doubles as the keyset cursor value.
+
+A rebuild can run its query just before a post changes and store the
+buffer just after. Changes made while a rebuild holds its lease bump a
+generation number; the rebuilding worker compares it before and after,
+and builds again if it moved, so the change isn't lost for BUFFER_TTL.
+"""
+import time
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import single_flight, acquire_lease, release_lease, bump_version, get_version
+from .models import Post
+
+BUFFER_KEY = 'feed:global:buffer'
+
+# The buffer is kept current by signals - the TTL is only a safety net
+BUFFER_TTL = 60 * 60
+
+# How long a change waits for another worker's write (seconds)
+WRITE_WAIT = 2
+
+
+def buffer_size():
+    """How many of the newest posts the buffer holds"""
+    return getattr(settings, 'GLOBAL_FEED_BUFFER_SIZE', 200)
+
+
+def entry_key(post):
+    """Sort / cursor key for a post: newest first by (created_at, id)"""
+    created_at = post.created_at.astimezone(dt_timezone.utc)
+    return [created_at.isoformat(timespec='microseconds'), post.pk]
+
+
+def _serialize(post):
+    from .serializers import PostSerializer
+
+    # No request in the context - is_liked is added per user
+    return {'key': entry_key(post), 'post': dict(PostSerializer(post).data)}
+
+
+def _build():
+    """Load the newest posts from the database"""
+    posts = list(
+        Post.objects.filter(is_deleted=False).select_related('user', 'image_asset')
+        .order_by('-created_at', '-id')[:buffer_size()]
+    )
+    return {
+        'entries': [_serialize(post) for post in posts],
+        'count': Post.objects.filter(is_deleted=False).count(),
+    }
+
+
+def _generation():
+    return get_version('feed:global', 'buffer')
+
+
+def _note_change():
+    """Make a rebuild that is running right now start over - it may have read the posts too early"""
+    if cache.get(f'{BUFFER_KEY}:lease') is not None:
+        bump_version('feed:global', 'buffer')
+
+
+def get_buffer(retry=True):
+    """The buffer, rebuilt from the database (by one worker) if missing"""
+    started = []
+
+    def build():
+        started.append(_generation())
+        return _build()
+
+    buffer = single_flight(BUFFER_KEY, build, BUFFER_TTL)
+    if started and retry and started[-1] != _generation():
+        # Posts changed while we were building - what we cached may be missing them
+        cache.delete(BUFFER_KEY)
+        return get_buffer(retry=False)
+    return buffer
+
+
+def _update(change):
+    """Apply `change` to the cached buffer under a short write lock"""
+    # Writes only take a moment - wait for another worker's to finish
+    deadline = time.time() + WRITE_WAIT
+    token = acquire_lease(f'{BUFFER_KEY}:write', 5)
+    while token is None and time.time() < deadline:
+        time.sleep(0.01)
+        token = acquire_lease(f'{BUFFER_KEY}:write', 5)
+    if token is None:
+        # Something is badly stuck - drop the buffer rather than lose an update
+        cache.delete(BUFFER_KEY)
+        return
+
+    try:
+        entry = cache.get(BUFFER_KEY)
+        if entry is None:
+            return  # Nothing cached - the next read builds it fresh
+        entry['value'] = change(entry['value'])
+        cache.set(BUFFER_KEY, entry, BUFFER_TTL * 2)
+    finally:
+        release_lease(f'{BUFFER_KEY}:write', token)
+
+
+def push(post):
+    """A post was created - put it at the front"""
+    push_many([post])
+
+
+def push_many(posts):
+    """Several posts were created (e.g. by a batch) - put them in with one write"""
+    _note_change()
+    if cache.get(BUFFER_KEY) is None:
+        return  # Nothing cached - the next read builds it fresh, don't serialize for nothing
+
+    # Only the newest can end up in the buffer - don't serialize the rest
+    newest = sorted(posts, key=entry_key, reverse=True)[:buffer_size()]
+    new_entries = [_serialize(post) for post in newest]
+    new_ids = {post.pk for post in posts}
+
+    def change(buffer):
+        entries = [e for e in buffer['entries'] if e['key'][1] not in new_ids]
+        entries.extend(new_entries)
+        entries.sort(key=lambda e: e['key'], reverse=True)
+        buffer['entries'] = entries[:buffer_size()]
+        buffer['count'] += len(new_ids)
+        return buffer
+
+    _update(change)
+
+
+def remove(post_id):
+    """A post was (soft) deleted - take it out"""
+    _note_change()
+    # Recount instead of decrementing - saving an already deleted post again must not drift it
+    count = Post.objects.filter(is_deleted=False).count()
+
+    def change(buffer):
+        buffer['entries'] = [e for e in buffer['entries'] if e['key'][1] != post_id]
+        buffer['count'] = count
+        return buffer
+
+    _update(change)
+
+
+def refresh(post_id):
+    """A post was edited, liked or commented on - re-serialize it if buffered"""
+    refresh_many([post_id])
+
+
+def refresh_many(post_ids):
+    """Re-serialize whichever of these posts are buffered (e.g. after their author changed)"""
+    _note_change()
+    entry = cache.get(BUFFER_KEY)
+    if entry is None:
+        return
+    buffered = {e['key'][1] for e in entry['value']['entries']} & set(post_ids)
+    if not buffered:
+        return
+
+    posts = Post.objects.filter(pk__in=buffered, is_deleted=False).select_related('user', 'image_asset')
+    new_entries = {post.pk: _serialize(post) for post in posts}
+    if not new_entries:
+        return
+
+    def change(buffer):
+        buffer['entries'] = [
+            new_entries.get(e['key'][1], e)
+            for e in buffer['entries']
+        ]
+        return buffer
+
+    _update(change)
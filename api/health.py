@@ -1,9 +1,12 @@
 from django.http import JsonResponse
 from django.views.decorators.http import require_GET
-import psycopg2
 from django.db import connection
-import socket
+from django.core.cache import cache, caches
+from django.utils import timezone
+from .cache import cache_stats
+from .query_budget import with_query_budget
 
+@with_query_budget(3)
 @require_GET
 def health_check(request):
     """Comprehensive health check for Railway"""
@@ -17,11 +20,20 @@ def health_check(request):
         with connection.cursor() as cursor:
             cursor.execute("SELECT 1")
             checks['database'] = 'connected'
+        checks['database_vendor'] = connection.vendor
     except Exception as e:
         checks['database'] = f'error: {str(e)}'
     
-    # 3. Cache check (if using)
-    checks['cache'] = 'not_configured'
+    # 3. Cache check
+    try:
+        cache.set('health-check', 'ok', 10)
+        checks['cache'] = {
+            'status': 'connected' if cache.get('health-check') == 'ok' else 'unavailable',
+            'backend': type(caches['default']).__name__,
+            **cache_stats(),
+        }
+    except Exception as e:
+        checks['cache'] = {'status': f'error: {str(e)}'}
     
     # 4. External services (if any)
     checks['external_services'] = 'none'
@@ -31,7 +43,7 @@ def health_check(request):
     
     return JsonResponse({
         'status': overall,
-        'timestamp': '2024-01-01T00:00:00Z',  # You can import timezone
+        'timestamp': timezone.now().isoformat(),
         'service': 'Social Media API',
         'version': '1.0.0',
         'checks': checks
@@ -0,0 +1,150 @@
+"""
+Background image processing jobs.
+
+POST /api/upload/image/ no longer waits for resizing or for the image
+storage (which may be a remote service). The request streams the upload
+to a spool file, creates an ImageJob and answers 202 with its id. A small
+pool of job runner threads then processes the image (api/images.py) and
+saves the variants to the image storage. Clients poll
+/api/upload/image/jobs/<id>/ for the result.
+
+A post can be created with the job id before the job is done - it holds
+the job as a pending image and gets the real image when the job finishes.
+
+Jobs only live in memory once submitted, so jobs interrupted by a restart
+are picked up again by `python manage.py retry_image_jobs`. With
+IMAGE_JOBS_EAGER (tests) jobs run right away in the calling thread.
+"""
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import executors
+from .images import ImageProcessingError, find_duplicate, add_uploader, ingest
+from .models import ImageJob, Post
+
+logger = logging.getLogger(__name__)
+
+def get_job_executor():
+    """Job runner threads - they decode and resize the images too (api/images.py)"""
+    return executors.get_executor('image-job', getattr(settings, 'IMAGE_WORKERS', 2))
+
+
+def job_path(job):
+    """Spool file holding the job's upload until it is processed"""
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{job.id}.job')
+
+
+def create_job(user, chunks):
+    """Spool an upload (an iterable of byte chunks) to disk and queue a job for it"""
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    job = ImageJob(user=user)
+    digest = hashlib.sha256()
+    with open(job_path(job), 'wb') as f:
+        for chunk in chunks:
+            digest.update(chunk)
+            f.write(chunk)
+    job.key = digest.hexdigest()
+    return queue(job)
+
+
+def create_job_from_file(user, path, key):
+    """Queue a job for a file already on disk (a finished chunked upload)"""
+    job = ImageJob(user=user, key=key)
+    os.replace(path, job_path(job))
+    return queue(job)
+
+
+def queue(job):
+    """Save and start a job. Repeat uploads of a stored image are done at once."""
+    existing = find_duplicate(key=job.key)
+    if existing is not None:
+        add_uploader(existing, job.user)
+        job.status = 'done'
+        job.asset = existing
+        job.save()
+        os.remove(job_path(job))
+        return job
+
+    job.save()
+    submit(job)
+    return job
+
+
+def submit(job):
+    """Start the job once the transaction that created it has committed"""
+    if getattr(settings, 'IMAGE_JOBS_EAGER', False):
+        transaction.on_commit(lambda: run_job(job.pk))
+    else:
+        transaction.on_commit(lambda: get_job_executor().submit(_run_in_pool, job.pk))
+
+
+def _run_in_pool(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        connections.close_all()  # Runner threads are long-lived
+
+
+def run_job(job_id):
+    """Process one job: resize, store, then give the image to waiting posts"""
+    updated = ImageJob.objects.filter(pk=job_id, status='pending').update(status='processing', updated_at=timezone.now())
+    if not updated:
+        return  # Already taken by another runner
+    job = ImageJob.objects.select_related('user').get(pk=job_id)
+    path = job_path(job)
+
+    try:
+        asset, _ = ingest(job.user, job.key, path)
+    except ImageProcessingError as e:
+        fail(job, str(e))
+    except Exception:
+        logger.exception("Image job %s failed", job.pk)
+        fail(job, "Image processing failed.")
+    else:
+        job.status = 'done'
+        job.asset = asset
+        job.save(update_fields=['status', 'asset', 'updated_at'])
+        resolve_posts(job)
+    finally:
+        if job.status in ('done', 'failed') and os.path.exists(path):
+            os.remove(path)
+
+
+def fail(job, error):
+    job.status = 'failed'
+    job.error = error[:255]
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def resolve_posts(job):
+    """Posts created while the job ran get the finished image"""
+    for post in Post.objects.filter(image_job=job):
+        post.image_asset = job.asset
+        post.image_job = None
+        post.save(update_fields=['image_asset', 'image_job'])  # Signals count the reference, refresh caches
+
+
+def resolve_if_done(job_id):
+    """A job may finish while a post is being saved with it - catch that case"""
+    job = ImageJob.objects.filter(pk=job_id, status='done').select_related('asset').first()
+    if job is not None:
+        resolve_posts(job)
+
+
+def retry_stale_jobs(older_than):
+    """Re-queue jobs a restart interrupted; returns how many"""
+    stale = ImageJob.objects.filter(status__in=['pending', 'processing'], updated_at__lt=older_than)
+    count = 0
+    for job in stale:
+        if not os.path.exists(job_path(job)):
+            fail(job, "Upload was lost. Please upload the image again.")
+            continue
+        ImageJob.objects.filter(pk=job.pk).update(status='pending')
+        run_job(job.pk)
+        count += 1
+    return count
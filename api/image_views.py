@@ -1,15 +1,53 @@
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-import cloudinary.uploader
+from .chunked_upload import ChunkError, MAX_CHUNK_SIZE, start_upload, append_chunk, finish_upload, cancel_upload
+from .cloudinary_client import get_uploader
+from .image_jobs import create_job
+from .images import MAX_UPLOAD_SIZE, release_reference
+from .models import ImageAsset, ImageJob, UploadSession
+
+
+def image_data(asset):
+    """Upload response / API representation of an ImageAsset"""
+    full = asset.variants['full']
+    return {
+        "id": asset.id,
+        "url": full['url'],
+        "public_id": asset.key,
+        "format": "webp",
+        "width": full['width'],
+        "height": full['height'],
+        "variants": asset.urls(),
+        "srcset": asset.srcset(),
+    }
+
+
+def job_response(job, status_code=status.HTTP_200_OK):
+    """Image job status; includes the stored image once it is done"""
+    data = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "status_url": reverse('image-job', args=[job.id]),
+    }
+    if job.status == 'done' and job.asset:
+        data["image"] = image_data(job.asset)
+    if job.status == 'failed':
+        data["error"] = job.error
+    
+    return Response(data, status=status_code)
+
 
 class ImageUploadView(APIView):
-    """Handle image uploads to Cloudinary"""
+    """Handle image uploads (processed in the background, see api/image_jobs.py)"""
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     
     def post(self, request):
-        """Upload image to Cloudinary"""
+        """Upload an image; poll the returned job, or attach it to a post with image_job=<job_id>"""
         image_file = request.FILES.get('image')
         
         if not image_file:
@@ -27,47 +65,137 @@ class ImageUploadView(APIView):
             )
         
         # Validate file size (max 5MB)
-        if image_file.size > 5 * 1024 * 1024:
+        if image_file.size > MAX_UPLOAD_SIZE:
             return Response(
                 {"error": "File too large. Max size is 5MB."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Spool to disk and answer right away - resizing happens in a job
+        job = create_job(request.user, image_file.chunks())
+        return job_response(job, status.HTTP_202_ACCEPTED)
+
+
+def upload_session_data(session):
+    return {
+        "upload_id": str(session.id),
+        "offset": session.received,
+        "size": session.size,
+        "max_chunk_size": MAX_CHUNK_SIZE,
+    }
+
+
+class ChunkedUploadStartView(APIView):
+    """Start a resumable, chunked image upload (see api/chunked_upload.py)"""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 3
+    
+    def post(self, request):
+        """Body: {"size": <total bytes>}"""
         try:
-            # Upload to Cloudinary
-            upload_result = cloudinary.uploader.upload(
-                image_file,
-                folder="social_media/",
-                transformation=[
-                    {"width": 1200, "height": 1200, "crop": "limit"},
-                    {"quality": "auto"},
-                ]
+            size = int(request.data.get('size', 0))
+        except (TypeError, ValueError):
+            size = 0
+        
+        try:
+            session = start_upload(request.user, size)
+        except ChunkError as e:
+            return Response({"error": str(e)}, status=e.status)
+        
+        return Response(upload_session_data(session), status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadView(APIView):
+    """Send chunks of an upload, check how far it got, or cancel it"""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 5
+    
+    def get_session(self, request, upload_id):
+        return get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    
+    def get(self, request, upload_id):
+        """Where to resume: the next offset to send"""
+        return Response(upload_session_data(self.get_session(request, upload_id)))
+    
+    def put(self, request, upload_id):
+        """Append the raw request body at the Upload-Offset header (or ?offset=)"""
+        session = self.get_session(request, upload_id)
+        
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.query_params.get('offset', '')))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response(
+                {"error": "Send the chunk's offset in the Upload-Offset header."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            return Response({
-                "url": upload_result['secure_url'],
-                "public_id": upload_result['public_id'],
-                "format": upload_result['format'],
-                "width": upload_result['width'],
-                "height": upload_result['height']
-            }, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
+        
+        try:
+            # Read straight from the request stream - the body is never loaded whole
+            append_chunk(session, offset, request.stream, length)
+        except ChunkError as e:
+            if e.status == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE:
+                cancel_upload(session)  # Not an image - the upload can't continue
+            return Response({"error": str(e), "offset": session.received}, status=e.status)
+        
+        return Response(upload_session_data(session))
+    
+    def delete(self, request, upload_id):
+        """Cancel the upload"""
+        cancel_upload(self.get_session(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadFinishView(APIView):
+    """Finish a chunked upload: process it in a job like a regular image upload"""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
+    
+    def post(self, request, upload_id):
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        if session.received < session.size:
             return Response(
-                {"error": f"Upload failed: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Upload incomplete.", **upload_session_data(session)},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        
+        try:
+            job = finish_upload(session)
+        except ChunkError as e:
+            return Response({"error": str(e)}, status=e.status)
+        
+        return job_response(job, status.HTTP_202_ACCEPTED)
+
+
+class ImageJobView(APIView):
+    """Status of an image job; includes the image once it is done"""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 3
+    
+    def get(self, request, job_id):
+        job = get_object_or_404(ImageJob.objects.select_related('asset'), pk=job_id, user=request.user)
+        return job_response(job)
 
 
 class ImageDeleteView(APIView):
-    """Delete image from Cloudinary"""
+    """Delete an uploaded image (local variants, or a legacy Cloudinary image)"""
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 15
     
     def delete(self, request, public_id):
         """Delete image by public_id"""
+        asset = ImageAsset.objects.filter(key=public_id).first()
+        if asset is not None:
+            return self.delete_asset(request, asset)
+        
+        # Images uploaded before the local pipeline live on Cloudinary
         try:
-            result = cloudinary.uploader.destroy(public_id)
+            result = get_uploader().destroy(public_id)
             
             if result.get('result') == 'ok':
                 return Response(
@@ -84,4 +212,24 @@ class ImageDeleteView(APIView):
             return Response(
                 {"error": f"Delete failed: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+    
+    def delete_asset(self, request, asset):
+        """Drop the user's reference; the files go when nothing else uses them"""
+        if not asset.uploaders.filter(pk=request.user.pk).exists():
+            return Response(
+                {"error": "You can only delete your own images."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        asset.uploaders.remove(request.user)
+        deleted = release_reference(asset.pk)
+        
+        return Response(
+            {
+                "message": "Image deleted successfully.",
+                # Other uploads or posts still use it - the file is kept for them
+                "in_use": not deleted,
+            },
+            status=status.HTTP_200_OK
+        )
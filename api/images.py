@@ -0,0 +1,258 @@
+"""
+Local image processing pipeline.
+
+Uploads are decoded with Pillow and re-encoded as WebP in a few sizes:
+
+    thumb   - 150px   small previews
+    medium  - 600px   feed cards
+    full    - 1200px  post detail
+
+Re-encoding drops EXIF / GPS / ICC metadata (nothing is copied over), after
+the EXIF orientation has been applied to the pixels. The work runs on the
+image job threads (api/image_jobs.py, settings.IMAGE_WORKERS), not the
+request thread, so concurrent uploads can't use more than that many cores
+per process - Pillow releases the GIL while resizing and encoding.
+
+Variants are saved to the 'images' storage (settings.STORAGES), which is
+the local filesystem unless IMAGE_STORAGE_BACKEND says otherwise.
+
+Storage is content-addressed: an asset's key is the SHA-256 of the
+uploaded bytes, so a repeat upload (memes, reposts) is answered from the
+index without decoding anything. With IMAGE_PERCEPTUAL_DEDUP on, images
+that only differ by re-encoding or resizing are matched by a perceptual
+hash (dHash) too. Assets are reference counted - each uploader and each
+post holds one reference - and the files go when the last one is released.
+
+Pillow is imported on first use, so it stays out of worker startup.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .models import ImageAsset
+
+# Variant name -> longest edge in pixels, smallest first
+VARIANTS = {
+    'thumb': 150,
+    'medium': 600,
+    'full': 1200,
+}
+
+WEBP_QUALITY = 80
+
+# Largest upload accepted, in bytes
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# Near-duplicates: most dHash bits that may differ (the 4 stored bands
+# guarantee every match up to 3 bits apart is found)
+MAX_PHASH_DISTANCE = 3
+
+
+class ImageProcessingError(ValueError):
+    """The upload is not an image Pillow can decode"""
+
+
+def get_storage():
+    """The storage backend variants are saved to"""
+    return storages['images']
+
+
+def perceptual_dedup_enabled():
+    return getattr(settings, 'IMAGE_PERCEPTUAL_DEDUP', False)
+
+
+def content_hash(data):
+    """SHA-256 of the uploaded bytes - the asset key"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path, block_size=64 * 1024):
+    """content_hash of a file, read in small blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Leading bytes of the formats we accept
+MAGIC_BYTES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def detect_image_type(head):
+    """Image type from the first 12+ bytes of a file, or None if not an accepted image"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for magic, content_type in MAGIC_BYTES:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash (dHash) as 16 hex chars. Shrink to 9x8 greyscale
+    and record whether each pixel is brighter than its right neighbour -
+    re-encoding, resizing or stripping metadata leaves this unchanged.
+    """
+    from PIL import Image
+
+    pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def make_variants(source, with_phash=False):
+    """
+    Decode an image (bytes, or a file path) and return
+    ({name: (webp bytes, width, height)}, phash). phash is '' unless
+    with_phash. Raises ImageProcessingError if it is not a usable image.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as original:
+            original.load()  # Decode now, so broken files fail here
+            image = ImageOps.exif_transpose(original)  # Keep the orientation, lose the EXIF
+    except Image.DecompressionBombError:
+        raise ImageProcessingError("Image dimensions are too large.")
+    except (UnidentifiedImageError, OSError):
+        raise ImageProcessingError("Could not read image. Allowed: JPG, PNG, GIF, WebP")
+
+    # WebP supports RGB and RGBA; keep transparency if there is any
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = {}
+    for name, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)  # Never upscales
+
+        buffer = io.BytesIO()
+        # No exif= / icc_profile= arguments - the output carries no metadata
+        resized.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+        variants[name] = (buffer.getvalue(), resized.width, resized.height)
+    return variants, perceptual_hash(image) if with_phash else ''
+
+
+def store_variants(key, variants):
+    """Save processed variants, return the {name: {...}} dict kept on ImageAsset"""
+    storage = get_storage()
+    stored = {}
+    for name, (data, width, height) in variants.items():
+        path = storage.save(f'{key}/{name}.webp', ContentFile(data))
+        stored[name] = {
+            'path': path,
+            'url': storage.url(path),
+            'width': width,
+            'height': height,
+        }
+    return stored
+
+
+def delete_files(variants):
+    storage = get_storage()
+    for variant in variants.values():
+        storage.delete(variant['path'])
+
+
+def add_reference(asset_id, count=1):
+    """Something (an uploader or a post) started using the asset - `count` times"""
+    ImageAsset.objects.filter(pk=asset_id).update(ref_count=F('ref_count') + count)
+
+
+def release_reference(asset_id):
+    """
+    Something stopped using the asset. Deletes it, and its files, when that
+    was the last reference. Returns True if the asset was deleted.
+    """
+    with transaction.atomic():
+        asset = ImageAsset.objects.select_for_update().filter(pk=asset_id).first()
+        if asset is None:
+            return False
+        if asset.ref_count > 1:
+            ImageAsset.objects.filter(pk=asset_id).update(ref_count=F('ref_count') - 1)
+            return False
+
+        variants = asset.variants
+        asset.delete()
+        # Only remove files once the delete is committed
+        transaction.on_commit(lambda: delete_files(variants))
+        return True
+
+
+def add_uploader(asset, user):
+    """Give `user` their reference to the asset (once per user)"""
+    with transaction.atomic():
+        if not asset.uploaders.filter(pk=user.pk).exists():
+            asset.uploaders.add(user)
+            add_reference(asset.pk)
+
+
+def find_duplicate(key=None, phash=None):
+    """Existing asset with the same bytes (key), or a near-identical look (phash)"""
+    if key:
+        return ImageAsset.objects.filter(key=key).first()
+    if not phash:
+        return None
+
+    same_band = Q()
+    for band in range(4):
+        same_band |= Q(**{f'phash_band_{band}': phash[band * 4:band * 4 + 4]})
+    candidates = ImageAsset.objects.filter(same_band).order_by('id').values_list('id', 'phash')[:100]
+
+    best = min(
+        ((bin(int(phash, 16) ^ int(other, 16)).count('1'), pk) for pk, other in candidates),
+        default=None
+    )
+    if best is not None and best[0] <= MAX_PHASH_DISTANCE:
+        return ImageAsset.objects.get(pk=best[1])
+    return None
+
+
+def ingest(user, key, source):
+    """
+    Store an image as an ImageAsset, or reuse an identical one.
+    `key` is the content hash of `source` (bytes, or a file path).
+    Returns (asset, deduplicated). Runs on an image job thread
+    (api/image_jobs.py), so decoding and resizing happen right here.
+    """
+    asset = find_duplicate(key=key)
+    if asset is None:
+        with_phash = perceptual_dedup_enabled()
+        variants, phash = make_variants(source, with_phash)
+        asset = find_duplicate(phash=phash)
+
+    if asset is not None:
+        add_uploader(asset, user)
+        return asset, True
+
+    stored = store_variants(key, variants)
+    try:
+        with transaction.atomic():
+            asset = ImageAsset.objects.create(owner=user, key=key, phash=phash, variants=stored)
+    except IntegrityError:
+        # The same image was uploaded and finished first in another request
+        delete_files(stored)
+        asset = ImageAsset.objects.get(key=key)
+        add_uploader(asset, user)
+        return asset, True
+
+    add_uploader(asset, user)
+    return asset, False
+
@@ -0,0 +1,25 @@
+import threading
+
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+
+
+def lazy_view(dotted_path, **initkwargs):
+    """
+    A class-based view that is imported on its first request.
+    Keeps heavy, rarely used views (API docs, schema) out of worker startup:
+
+        path('api/docs/', lazy_view('drf_spectacular.views.SpectacularSwaggerView', url_name='schema'))
+    """
+    lock = threading.Lock()
+    loaded = {}
+
+    @csrf_exempt
+    def view(request, *args, **kwargs):
+        if 'view' not in loaded:
+            with lock:
+                if 'view' not in loaded:
+                    loaded['view'] = import_string(dotted_path).as_view(**initkwargs)
+        return loaded['view'](request, *args, **kwargs)
+
+    return view
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.archive import (
+    BATCH_SIZE, PAUSE, archive_after_days, archive_notifications, archive_posts, size_report
+)
+
+
+def mb(size):
+    return 'n/a' if size is None else f"{size / 1024 / 1024:.1f} MB"
+
+
+class Command(BaseCommand):
+    """
+    Move posts and read notifications older than --days to the archive
+    tables, then report how much smaller the hot tables and their indexes
+    got. Run it from cron, e.g. once a week:
+
+        python manage.py archive_cold --days 180
+        python manage.py archive_cold --report    # Sizes only
+    """
+
+    help = 'Archive old posts and notifications and report hot table sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=archive_after_days(), help='Archive rows older than this (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Rows per batch (default: {BATCH_SIZE})')
+        parser.add_argument('--pause', type=float, default=PAUSE, help=f'Seconds to wait between batches (default: {PAUSE})')
+        parser.add_argument('--report', action='store_true', help='Only print the size report')
+
+    def handle(self, *args, **options):
+        before = size_report()
+        if options['report']:
+            self.print_report(before)
+            return
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        def progress(kind):
+            return lambda moved, rate: self.stdout.write(f"{kind}: {moved} archived ({rate:.0f} rows/s)")
+
+        posts = archive_posts(cutoff, options['batch_size'], options['pause'], progress('posts'))
+        notifications = archive_notifications(cutoff, options['batch_size'], options['pause'], progress('notifications'))
+        self.stdout.write(self.style.SUCCESS(f"Archived {posts} posts and {notifications} notifications."))
+
+        self.print_report(size_report(), before)
+
+    def print_report(self, report, before=None):
+        """Hot table rows / sizes, with the change since `before`"""
+        total_indexes = 0
+        for table, stats in report['tables'].items():
+            line = f"{table}: {stats['rows']} rows, data {mb(stats['data_bytes'])}, indexes {mb(stats['index_bytes'])}"
+            if before:
+                old = before['tables'][table]
+                line += f" (rows {stats['rows'] - old['rows']:+d}"
+                if stats['index_bytes'] is not None and old['index_bytes'] is not None:
+                    line += f", indexes {(stats['index_bytes'] - old['index_bytes']) / 1024 / 1024:+.1f} MB"
+                line += ")"
+            self.stdout.write(line)
+            total_indexes += stats['index_bytes'] or 0
+
+        # Hot indexes that fit in the database's cache are served from memory
+        memory = report['memory_bytes']
+        if memory:
+            self.stdout.write(
+                f"Hot indexes use {mb(total_indexes)} of {mb(memory)} database cache "
+                f"({100 * total_indexes / memory:.0f}%)"
+            )
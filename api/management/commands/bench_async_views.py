@@ -0,0 +1,144 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import ThreadSensitiveContext
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import AsyncRequestFactory, RequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.async_views import AsyncFeedView, AsyncNotificationListView, AsyncUserFollowDetailView
+from api.views import FeedView, NotificationListView, UserFollowDetailView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Send the same burst of requests to the sync and the async feed,
+    notification and profile views, with every database query slowed down
+    by --latency-ms (like a remote database under load):
+
+    - sync: --workers threads, one request each at a time (sync workers)
+    - async: one event loop with up to --concurrency requests in flight
+
+        python manage.py bench_async_views --requests 200 --latency-ms 20
+
+    Requests are authenticated with a real JWT as the user who follows the
+    most people (or --username).
+    """
+
+    help = 'Compare sync and async view throughput with slow database queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per view (default: 200)')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Delay added to every query (default: 20)')
+        parser.add_argument('--workers', type=int, default=8, help='Threads serving sync requests (default: 8)')
+        parser.add_argument('--concurrency', type=int, default=100, help='Async requests in flight (default: 100)')
+        parser.add_argument('--username', help='User to send the requests as')
+        parser.add_argument('--view', action='append', choices=['feed', 'notifications', 'profile'], help='Only these views (repeatable)')
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.annotate(n=Count('following')).order_by('-n').first()
+        if user is None:
+            raise CommandError("No user to run the benchmark as.")
+        other = User.objects.exclude(pk=user.pk).first() or user
+        token = f'Bearer {RefreshToken.for_user(user).access_token}'
+
+        views = [
+            ('feed', '/api/feed/', FeedView, AsyncFeedView, {}),
+            ('notifications', '/api/notifications/', NotificationListView, AsyncNotificationListView, {}),
+            ('profile', f'/api/users/{other.username}/', UserFollowDetailView, AsyncUserFollowDetailView,
+             {'username': other.username}),
+        ]
+
+        if options['view']:
+            views = [view for view in views if view[0] in options['view']]
+
+        latency = options['latency_ms'] / 1000
+        self.stdout.write(
+            f"{options['requests']} requests per view as {user.username}, +{options['latency_ms']:.0f} ms per query, "
+            f"{options['workers']} sync workers, {options['concurrency']} async in flight\n"
+        )
+        self.stdout.write(f"{'view':<14} {'mode':<6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8}")
+
+        with self.slow_queries(latency):
+            for name, path, sync_view, async_view, kwargs in views:
+                for mode, run in [('sync', self.run_sync), ('async', self.run_async)]:
+                    view = (sync_view if mode == 'sync' else async_view).as_view()
+                    elapsed, latencies = run(view, path, kwargs, token, options)
+                    self.stdout.write(
+                        f"{name:<14} {mode:<6} {options['requests'] / elapsed:>7.1f} "
+                        f"{1000 * statistics.median(latencies):>8.0f} "
+                        f"{1000 * statistics.quantiles(latencies, n=20)[-1]:>8.0f}"
+                    )
+
+    @contextmanager
+    def slow_queries(self, latency):
+        """Add `latency` seconds to every query, on every connection, while active"""
+        def slow(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_wrapper(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow)
+
+        connections.close_all()  # New connections get the wrapper
+        connection_created.connect(add_wrapper)
+        try:
+            yield
+        finally:
+            connection_created.disconnect(add_wrapper)
+            connections.close_all()
+
+    def check_ok(self, response):
+        # A fast error page would look like a fast view
+        if response.status_code != 200:
+            raise CommandError(f"Got {response.status_code}: {response.content[:200]}")
+
+    def run_sync(self, view, path, kwargs, token, options):
+        factory = RequestFactory()
+
+        def one(queued_at):
+            request = factory.get(path, headers={'Authorization': token})
+            try:
+                self.check_ok(view(request, **kwargs).render())
+            finally:
+                close_old_connections()  # Like the end of a real request
+            return time.perf_counter() - queued_at
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [pool.submit(one, time.perf_counter()) for _ in range(options['requests'])]
+            latencies = [future.result() for future in futures]
+        return time.perf_counter() - started, latencies
+
+    def run_async(self, view, path, kwargs, token, options):
+        factory = AsyncRequestFactory()
+
+        async def one(limit, queued_at):
+            async with limit:
+                # Each request gets its own thread for sync code, as under ASGIHandler
+                async with ThreadSensitiveContext():
+                    request = factory.get(path, headers={'Authorization': token})
+                    response = await view(request, **kwargs)
+                    self.check_ok(response.render())
+            return time.perf_counter() - queued_at
+
+        async def burst():
+            limit = asyncio.Semaphore(options['concurrency'])
+            queued_at = time.perf_counter()
+            return await asyncio.gather(*(one(limit, queued_at) for _ in range(options['requests'])))
+
+        started = time.perf_counter()
+        latencies = asyncio.run(burst())
+        return time.perf_counter() - started, latencies
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpRequest
+from rest_framework.request import Request
+
+from api.cache import single_flight
+from api.views import GlobalFeedView
+
+
+class Command(BaseCommand):
+    """
+    Simulate a cache expiry storm on the first global feed page and count
+    the database queries it causes:
+
+    - naive: plain get / build / set - every worker rebuilds
+    - missing: single_flight with the entry gone - one builds, the rest wait
+    - stale: single_flight with the entry past its soft TTL - one rebuilds,
+      the rest are served the stale copy
+
+        python manage.py bench_cache_stampede --workers 32
+    """
+
+    help = 'Count database queries during a simulated cache expiry storm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=32, help='Concurrent requests (default: 32)')
+        parser.add_argument('--page-size', type=int, default=20, help='Posts per page (default: 20)')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        page_size = options['page_size']
+        key = 'bench:feed:global'
+
+        # A bare request with no query params, like a plain GET /api/feed/global/
+        view = GlobalFeedView()
+        view.request = Request(HttpRequest())
+        view.format_kwarg = None
+
+        def build():
+            return view.build_page(1, page_size)
+
+        def naive():
+            data = cache.get(key)
+            if data is None:
+                data = build()
+                cache.set(key, data, 30)
+            return data
+
+        def protected():
+            return single_flight(key, build, 30)
+
+        scenarios = [
+            ('naive', naive, lambda: cache.delete(key)),
+            ('missing', protected, lambda: cache.delete(key)),
+            ('stale', protected, self.expire_soft(key, build)),
+        ]
+
+        self.stdout.write(f"{workers} concurrent requests for the first global feed page\n")
+        self.stdout.write(f"{'scenario':<10} {'queries':>8} {'builds':>7} {'seconds':>8}")
+        for name, read, prepare in scenarios:
+            queries, builds, elapsed = self.storm(read, build, prepare, workers)
+            self.stdout.write(f"{name:<10} {queries:>8} {builds:>7} {elapsed:>8.3f}")
+
+        cache.delete(key)
+
+    def expire_soft(self, key, build):
+        """Return a setup step that leaves a stale (soft-expired) entry in the cache"""
+        def prepare():
+            cache.set(key, {'value': build(), 'expires': time.time() - 1, 'delta': 0}, 60)
+        return prepare
+
+    def storm(self, read, build, prepare, workers):
+        """Release `workers` threads at once against an expired entry"""
+        prepare()
+        barrier = threading.Barrier(workers)
+        lock = threading.Lock()
+        counts = {'queries': 0}
+
+        def count_query(execute, sql, params, many, context):
+            with lock:
+                counts['queries'] += 1
+            return execute(sql, params, many, context)
+
+        def worker():
+            with connection.execute_wrapper(count_query):
+                barrier.wait()
+                read()
+            connection.close()
+
+        # Count builds separately from queries
+        builds = {'count': 0}
+        original_build_page = GlobalFeedView.build_page
+
+        def counted_build_page(view, *args):
+            with lock:
+                builds['count'] += 1
+            return original_build_page(view, *args)
+
+        GlobalFeedView.build_page = counted_build_page
+        try:
+            threads = [threading.Thread(target=worker) for _ in range(workers)]
+            started = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - started
+        finally:
+            GlobalFeedView.build_page = original_build_page
+
+        return counts['queries'], builds['count'], elapsed
@@ -0,0 +1,80 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import PostBatchCreateView, PostListCreateView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Create the same posts through POST /api/posts/ (one request per post)
+    and through POST /api/posts/batch/, and compare posts per second and
+    database queries. Runs as a throwaway user that is deleted afterwards.
+
+        python manage.py bench_post_batch --posts 500 --batch-size 100
+    """
+
+    help = 'Compare single-post and batch post creation throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500, help='Posts to create per path (default: 500)')
+        parser.add_argument('--batch-size', type=int, default=100, help='Posts per batch request (default: 100)')
+
+    def handle(self, *args, **options):
+        total = options['posts']
+        batch_size = options['batch_size']
+        factory = APIRequestFactory()
+        user = User.objects.create_user(username=f'bench-{uuid.uuid4().hex[:12]}', password=uuid.uuid4().hex)
+
+        # No throttling - we want to measure the work, not the rate limit
+        single_view = PostListCreateView.as_view(throttle_classes=[])
+        batch_view = PostBatchCreateView.as_view(throttle_classes=[])
+
+        def call(view, body):
+            request = factory.post('/api/posts/', body, format='json')
+            force_authenticate(request, user=user)
+            response = view(request)
+            response.render()
+            if response.status_code != 201:
+                raise RuntimeError(f"Unexpected {response.status_code}: {response.content[:200]}")
+
+        def single():
+            for i in range(total):
+                call(single_view, {'content': f'Single post {i}', 'user_id': user.pk})
+
+        def batch():
+            for start in range(0, total, batch_size):
+                posts = [{'content': f'Batch post {i}'} for i in range(start, min(start + batch_size, total))]
+                call(batch_view, {'posts': posts})
+
+        try:
+            self.stdout.write(f"{total} posts, batches of {batch_size}\n")
+            self.stdout.write(f"{'path':<8} {'seconds':>8} {'posts/s':>9} {'queries':>8}")
+            results = {}
+            for name, run in [('single', single), ('batch', batch)]:
+                elapsed, queries = self.measure(run)
+                results[name] = elapsed
+                self.stdout.write(f"{name:<8} {elapsed:>8.3f} {total / elapsed:>9.0f} {queries:>8}")
+            self.stdout.write(self.style.SUCCESS(f"Batch is {results['single'] / results['batch']:.1f}x faster."))
+        finally:
+            user.delete()  # Takes the benchmark posts with it
+
+    def measure(self, run):
+        """Seconds and database queries for one run"""
+        counts = {'queries': 0}
+
+        def count_query(execute, sql, params, many, context):
+            counts['queries'] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+        return elapsed, counts['queries']
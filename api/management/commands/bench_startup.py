@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Measure how long a fresh worker takes to boot, and which modules the
+    time goes to (python -X importtime in a subprocess).
+
+        python manage.py bench_startup
+        python manage.py bench_startup --entrypoint wsgi --top 30
+        python manage.py bench_startup --budget-ms 700 --output startup.json
+
+    With --budget-ms the command fails when import time goes over budget,
+    so it can run in CI and catch boot-time regressions.
+    """
+
+    help = 'Report per-module import time for a cold worker start'
+
+    # What a fresh worker runs. The URLconf is loaded on the first request,
+    # which pulls in every view module, so it counts as startup too.
+    ENTRYPOINTS = {
+        'wsgi': 'import socialmedia.wsgi; import socialmedia.urls',
+        'asgi': 'import socialmedia.asgi; import socialmedia.urls',
+    }
+
+    # Rarely used integrations that must only load on first use
+    LAZY_MODULES = [
+        'cloudinary.api',
+        'drf_spectacular.views',
+        'drf_spectacular.openapi',
+        'psycopg2',
+        'PIL.Image',
+    ]
+
+    # Loaded at startup on purpose - reported, but not as a regression
+    EAGER_ALLOWED = {
+        'cloudinary.uploader': 'CloudinaryField (api/models.py) imports cloudinary.forms, which imports it',
+        'prometheus_client': 'MetricsMiddleware times every request, so the first one would load it anyway',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--entrypoint', nargs='+', choices=sorted(self.ENTRYPOINTS), default=sorted(self.ENTRYPOINTS),
+            help='Which worker entrypoints to profile (default: asgi wsgi)'
+        )
+        parser.add_argument('--top', type=int, default=20, help='How many modules to list (default: 20)')
+        parser.add_argument('--budget-ms', type=float, help='Fail if import time goes over this many ms')
+        parser.add_argument('--output', help='Also write the full report to this JSON file')
+
+    def handle(self, *args, **options):
+        reports = {}
+        over_budget = []
+
+        for entrypoint in options['entrypoint']:
+            report = self.profile(self.ENTRYPOINTS[entrypoint])
+            reports[entrypoint] = report
+            self.print_report(entrypoint, report, options['top'])
+
+            budget = options['budget_ms']
+            if budget is not None and report['import_ms'] > budget:
+                over_budget.append(f"{entrypoint}: {report['import_ms']:.0f} ms > {budget:.0f} ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(reports, f, indent=2)
+            self.stdout.write(f"\nReport written to {options['output']}")
+
+        if over_budget:
+            raise CommandError("Startup import budget exceeded - " + "; ".join(over_budget))
+
+    def print_report(self, entrypoint, report, top):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {entrypoint} =="))
+        self.stdout.write(f"Cold start: {report['wall_ms']:.0f} ms wall, "
+                          f"{report['import_ms']:.0f} ms in imports, "
+                          f"{len(report['modules'])} modules\n")
+
+        self.stdout.write("Slowest modules (cumulative, includes their imports):")
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>8}  module")
+        for module in report['modules'][:top]:
+            self.stdout.write(f"{module['cumulative_us'] / 1000:>14.1f} {module['self_us'] / 1000:>8.1f}  {module['name']}")
+
+        self.stdout.write("\nBy top-level package (self time):")
+        for package, self_us in list(report['packages'].items())[:top]:
+            self.stdout.write(f"{self_us / 1000:>14.1f}  {package}")
+
+        self.stdout.write("\nLazy integrations:")
+        for name in self.LAZY_MODULES:
+            if name in report['eager_lazy_modules']:
+                self.stdout.write(self.style.WARNING(f"  {name}: imported at startup"))
+            else:
+                self.stdout.write(f"  {name}: lazy")
+
+        self.stdout.write("\nAllowed at startup:")
+        for name, reason in self.EAGER_ALLOWED.items():
+            state = 'imported' if name in report['allowed_eager_modules'] else 'not imported'
+            self.stdout.write(f"  {name}: {state} - {reason}")
+
+    def profile(self, code):
+        """Boot a fresh interpreter and parse its -X importtime output"""
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'socialmedia.settings')
+
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            env=env, capture_output=True, text=True
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        if result.returncode != 0:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+
+        modules = []
+        packages = defaultdict(int)
+        for line in result.stderr.splitlines():
+            # import time:   self [us] | cumulative | imported package
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            modules.append({'name': name, 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+            packages[name.split('.')[0]] += int(self_us)
+
+        modules.sort(key=lambda m: m['cumulative_us'], reverse=True)
+        imported = {m['name'] for m in modules}
+        return {
+            'wall_ms': round(wall_ms, 1),
+            'import_ms': round(sum(m['self_us'] for m in modules) / 1000, 1),
+            'modules': modules,
+            'packages': dict(sorted(packages.items(), key=lambda p: p[1], reverse=True)),
+            'eager_lazy_modules': [name for name in self.LAZY_MODULES if name in imported],
+            'allowed_eager_modules': [name for name in self.EAGER_ALLOWED if name in imported],
+        }
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Write the OpenAPI schema to static files, so API workers never have to
+    generate it. Run it before collectstatic, which adds the content hash:
+
+        python manage.py build_schema && python manage.py collectstatic --noinput
+
+    bin/post_compile does both when the app is built for deploy.
+    """
+
+    help = 'Write the OpenAPI schema to api/static/api/ for WhiteNoise to serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--api-version', default=None, help='API version to generate (default: none)')
+
+    def handle(self, *args, **options):
+        from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+
+        from api.schema import SCHEMA_FILES, generate_schema
+
+        schema = generate_schema(options['api_version'])
+        renderers = {
+            'yaml': OpenApiYamlRenderer(),
+            'json': OpenApiJsonRenderer(),
+        }
+
+        static_dir = Path(__file__).resolve().parents[2] / 'static'
+        for format, name in SCHEMA_FILES.items():
+            path = static_dir / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(renderers[format].render(schema, renderer_context={}))
+            self.stdout.write(f"Wrote {path} ({path.stat().st_size / 1024:.0f} KB)")
+
+        self.stdout.write(self.style.SUCCESS("Schema built - run collectstatic to publish it"))
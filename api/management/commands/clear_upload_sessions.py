@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.chunked_upload import cancel_upload
+from api.models import UploadSession
+
+
+class Command(BaseCommand):
+    """
+    Delete chunked uploads that were abandoned (no chunk for --hours) and
+    their partial files. Run it from cron, e.g. once a day:
+
+        python manage.py clear_upload_sessions --hours 24
+    """
+
+    help = 'Delete abandoned chunked image uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Idle time before an upload is abandoned (default: 24)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(updated_at__lt=cutoff)
+
+        count = 0
+        for session in stale.iterator():
+            cancel_upload(session)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} abandoned uploads."))
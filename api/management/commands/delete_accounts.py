@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.account_deletion import resume_deletions
+
+
+class Command(BaseCommand):
+    """
+    Finish account deletions: pending ones, and ones a crash or restart
+    interrupted (no progress for --minutes). Run it after deploys or from cron:
+
+        python manage.py delete_accounts --minutes 10
+    """
+
+    help = 'Run pending or interrupted account deletions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=10, help='Time without progress before a deletion counts as interrupted (default: 10)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['minutes'])
+
+        def progress(step, deleted, rate):
+            self.stdout.write(f"{step}: {deleted} rows deleted ({rate:.0f} rows/s)")
+
+        count = resume_deletions(cutoff, progress)
+        self.stdout.write(self.style.SUCCESS(f"Finished {count} account deletions."))
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.purge import BATCH_SIZE, PAUSE, purge_deleted, purge_steps
+
+
+class Command(BaseCommand):
+    """
+    Hard-delete posts and comments that were soft-deleted more than --days
+    ago, with their likes, comments and notifications. Run it from cron,
+    e.g. once a night:
+
+        python manage.py purge_deleted --days 30
+    """
+
+    help = 'Permanently remove soft-deleted posts and comments after a grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'PURGE_GRACE_DAYS', 30),
+            help='Grace period before deleted content is purged (default: PURGE_GRACE_DAYS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Rows per batch (default: {BATCH_SIZE})')
+        parser.add_argument('--pause', type=float, default=PAUSE, help=f'Seconds to wait between batches (default: {PAUSE})')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be purged')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            for name, queryset in purge_steps(cutoff):
+                self.stdout.write(f"{name}: {queryset.count()} rows")
+            return
+
+        def progress(step, deleted, rate):
+            self.stdout.write(f"{step}: {deleted} rows deleted ({rate:.0f} rows/s)")
+
+        totals = purge_deleted(cutoff, options['batch_size'], options['pause'], progress)
+        summary = ', '.join(f"{count} {name}" for name, count in totals.items())
+        self.stdout.write(self.style.SUCCESS(f"Purged {summary}."))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.image_jobs import retry_stale_jobs
+
+
+class Command(BaseCommand):
+    """
+    Run image jobs that a restart interrupted (still pending or processing
+    after --minutes). Run it after deploys or from cron:
+
+        python manage.py retry_image_jobs --minutes 10
+    """
+
+    help = 'Re-run interrupted image upload jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=10, help='Age before a job counts as interrupted (default: 10)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['minutes'])
+        count = retry_stale_jobs(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"Re-ran {count} image jobs."))
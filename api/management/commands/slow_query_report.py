@@ -0,0 +1,100 @@
+import json
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.slow_queries import log_files
+
+SORTS = {
+    'total': lambda group: group['total_ms'],
+    'max': lambda group: group['slowest']['ms'],
+    'count': lambda group: group['count'],
+    'avg': lambda group: group['total_ms'] / group['count'],
+}
+
+
+class Command(BaseCommand):
+    """
+    Group the slow-query log (api/slow_queries.py) by query fingerprint and
+    show the worst ones: how often they ran, their total / average / worst
+    time, the views that ran them, the slowest example and its EXPLAIN plan.
+
+        python manage.py slow_query_report --top 5
+        python manage.py slow_query_report --hours 24 --sort max
+    """
+
+    help = 'Summarize the slow-query log by query fingerprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Fingerprints to show (default: 10)')
+        parser.add_argument('--sort', choices=list(SORTS), default='total', help='Rank by total, max, count or avg time (default: total)')
+        parser.add_argument('--hours', type=float, help='Only queries from the last N hours')
+        parser.add_argument('--log', help="Read this file instead of every process's SLOW_QUERY_LOG and its rotated copies")
+
+    def handle(self, *args, **options):
+        files = [options['log']] if options['log'] else log_files()
+        if not files:
+            raise CommandError("No slow-query log yet (SLOW_QUERY_LOG).")
+
+        since = timezone.now() - timedelta(hours=options['hours']) if options['hours'] else None
+        groups = self.group(self.read(files, since))
+        if not groups:
+            self.stdout.write("No slow queries logged.")
+            return
+
+        worst = sorted(groups.values(), key=SORTS[options['sort']], reverse=True)[:options['top']]
+        self.stdout.write(f"{sum(g['count'] for g in groups.values())} slow queries, {len(groups)} fingerprints\n")
+        for rank, group in enumerate(worst, 1):
+            self.print_group(rank, group)
+
+    def read(self, files, since):
+        """Log entries, skipping lines that aren't complete JSON (e.g. mid-rotation)"""
+        for name in files:
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is not None:
+                        logged_at = parse_datetime(entry.get('time') or '')
+                        if logged_at is None or logged_at < since:
+                            continue
+                    yield entry
+
+    def group(self, entries):
+        groups = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'slowest': None, 'plan': None, 'views': Counter()})
+        for entry in entries:
+            group = groups[entry['fingerprint']]
+            group['fingerprint'] = entry['fingerprint']
+            group['count'] += 1
+            group['total_ms'] += entry['ms']
+            group['views'][entry.get('view') or '(no request)'] += 1
+            if group['slowest'] is None or entry['ms'] > group['slowest']['ms']:
+                group['slowest'] = entry
+            # EXPLAIN runs once in a while - keep the newest plan we have
+            if entry.get('plan') and (group['plan'] is None or entry['time'] > group['plan'][0]):
+                group['plan'] = (entry['time'], entry['plan'])
+        return groups
+
+    def print_group(self, rank, group):
+        slowest = group['slowest']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"#{rank} {group['fingerprint']}: {group['count']}x, total {group['total_ms']:.0f} ms, "
+            f"avg {group['total_ms'] / group['count']:.0f} ms, max {slowest['ms']:.0f} ms"
+        ))
+        views = ', '.join(f'{view} ({n})' for view, n in group['views'].most_common(3))
+        self.stdout.write(f"  views: {views}")
+        if slowest.get('path'):
+            self.stdout.write(f"  slowest: {slowest['path']}")
+        sql = slowest['sql'] if len(slowest['sql']) <= 500 else slowest['sql'][:500] + '...'
+        self.stdout.write(f"  sql: {sql}")
+        self.stdout.write(f"  params: {slowest['params']}")
+        if group['plan']:
+            self.stdout.write("  plan:")
+            for line in group['plan'][1]:
+                self.stdout.write(f"    {line}")
+        self.stdout.write("")
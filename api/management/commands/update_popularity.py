@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.popularity import refresh_recent_scores, refresh_scores
+
+
+class Command(BaseCommand):
+    """
+    Recompute popular feed scores.
+    Run it every few minutes (cron / Railway cron job):
+        python manage.py update_popularity --minutes 15
+    """
+
+    help = 'Recompute popularity scores for recently active posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--minutes', type=int, default=15,
+            help='Only refresh posts with likes/comments in the last N minutes (default: 15)'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every post (e.g. after changing the score formula)'
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            updated = refresh_scores()
+        else:
+            updated = refresh_recent_scores(minutes=options['minutes'])
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} post scores."))
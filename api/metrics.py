@@ -0,0 +1,135 @@
+"""
+Prometheus metrics, scraped from GET /api/metrics/
+
+- http_request_duration_seconds: latency per route, method and status
+- db_queries_per_request / db_query_seconds: database work per request
+  (counted by QueryBudgetMiddleware, api/query_budget.py)
+- cache_lookups_total: cache hits and misses per cache (api/cache.py)
+- serializer_seconds: time spent turning objects into response data
+
+Gunicorn runs several worker processes, and a scrape only reaches one of
+them. With PROMETHEUS_MULTIPROC_DIR set, every worker writes its numbers
+to memory-mapped files in that directory and the endpoint adds them all
+up. gunicorn.conf.py sets it up; without it (runserver, tests) each
+process just reports its own numbers.
+
+Routes are labelled by their URL pattern (e.g. api/posts/<int:pk>/)
+rather than the URL, so every post shares one series.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+from .query_budget import with_query_budget
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Request latency',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Database queries run by one request',
+    ['route'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DB_SECONDS = Histogram(
+    'db_query_seconds', 'Time one request spent in database queries',
+    ['route'],
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups', 'Cache reads through single_flight()',
+    ['cache', 'result'],
+)
+SERIALIZER_SECONDS = Histogram(
+    'serializer_seconds', 'Time to build a serializer\'s .data',
+    ['serializer'], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def route_of(request):
+    """The URL pattern that served `request` (a bounded label, unlike the path)"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or match.view_name
+
+
+class MetricsMiddleware:
+    """Time every request; goes first in MIDDLEWARE so it sees the whole request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        route = route_of(request)
+        REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(elapsed)
+
+        stats = getattr(request, '_query_stats', None)
+        if stats is not None:
+            DB_QUERIES.labels(route).observe(stats.count)
+            DB_SECONDS.labels(route).observe(stats.duration)
+
+        return response
+
+
+def record_cache_lookup(key, hit):
+    """Count a cache read; the cache name is the first part of the key (post, user, feed)"""
+    CACHE_LOOKUPS.labels(key.split(':', 1)[0], 'hit' if hit else 'miss').inc()
+
+
+def instrument_serializers():
+    """
+    Time every serializer's .data (called from ApiConfig.ready). Only the
+    first, uncached access is timed; nested serializers count towards
+    their parent.
+    """
+    data = BaseSerializer.data.fget
+    if getattr(data, 'timed', False):
+        return
+
+    def timed_data(self):
+        if hasattr(self, '_data'):
+            return data(self)
+        started = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            serializer = self.child if isinstance(self, ListSerializer) else self
+            SERIALIZER_SECONDS.labels(type(serializer).__name__).observe(time.perf_counter() - started)
+
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+def registry():
+    """Every worker's metrics in multiprocess mode, else this process's"""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    combined = CollectorRegistry()
+    multiprocess.MultiProcessCollector(combined)
+    return combined
+
+
+@with_query_budget(0)
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus text format. With METRICS_TOKEN set, scrapers send it as a
+    Bearer token. Without one it is only served with DEBUG on - routes and
+    traffic shouldn't be public by accident.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=404)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
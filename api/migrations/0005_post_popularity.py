@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-19 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_scores(apps, schema_editor):
+    """Give existing posts a score so they show up in the popular feed"""
+    from api.popularity import compute_score
+
+    Post = apps.get_model('api', 'Post')
+    posts = Post.objects.annotate(
+        num_likes=Count('likes', distinct=True),
+        num_comments=Count('comments', filter=Q(comments__is_deleted=False), distinct=True),
+    )
+    for post in posts.iterator():
+        post.popularity_score = compute_score(post.num_likes, post.num_comments, post.created_at)
+        post.last_activity_at = post.created_at
+        post.save(update_fields=['popularity_score', 'last_activity_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_post_image_notification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='popularity_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-popularity_score', '-id'], name='api_post_popular_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
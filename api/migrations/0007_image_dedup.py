@@ -0,0 +1,67 @@
+# Generated by Django 6.0 on 2026-10-19 10:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    """Existing images: the uploader and every post using them are references"""
+    ImageAsset = apps.get_model('api', 'ImageAsset')
+    for asset in ImageAsset.objects.all():
+        if asset.owner_id:
+            asset.uploaders.add(asset.owner_id)
+        asset.ref_count = asset.uploaders.count() + asset.posts.count()
+        asset.save(update_fields=['ref_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_image_asset'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='phash',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='phash_band_0',
+            field=models.CharField(blank=True, db_index=True, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='phash_band_1',
+            field=models.CharField(blank=True, db_index=True, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='phash_band_2',
+            field=models.CharField(blank=True, db_index=True, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='phash_band_3',
+            field=models.CharField(blank=True, db_index=True, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='uploaders',
+            field=models.ManyToManyField(blank=True, related_name='uploaded_images', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='imageasset',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='images', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,18 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
 from django.forms import ValidationError  # To reference our custom User model
 from cloudinary.models import CloudinaryField
 
+
+class ActiveManager(models.Manager):
+    """Default manager for soft-deleted models: hides rows with is_deleted=True"""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
 class Post(models.Model):
     """
     A Post model - represents user's posts in our social media.
@@ -31,6 +41,24 @@ class Post(models.Model):
         help_text="Upload an image for your post"
     )
     
+    # Image uploaded through /api/upload/image/ (resized WebP variants)
+    image_asset = models.ForeignKey(
+        'ImageAsset',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='posts'
+    )
+    
+    # Upload still being processed - replaced by image_asset when it's done
+    image_job = models.ForeignKey(
+        'ImageJob',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='posts'
+    )
+    
     # Automatic timestamps
     created_at = models.DateTimeField(auto_now_add=True)  # Set on creation
     updated_at = models.DateTimeField(auto_now=True)      # Update on save
@@ -38,11 +66,30 @@ class Post(models.Model):
     # Optional: Soft delete (mark as deleted instead of actually deleting)
     is_deleted = models.BooleanField(default=False)
     
+    # Popular feed ranking (see api/popularity.py)
+    popularity_score = models.FloatField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Last like/comment
+    
+    # Post.objects skips deleted posts, Post.all_objects includes them (admin, cleanup)
+    objects = ActiveManager()
+    all_objects = models.Manager()
+    
     class Meta:
         """Extra model settings"""
         ordering = ['-created_at']  # Show newest posts first
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        base_manager_name = 'all_objects'  # Related lookups still find deleted posts
+        indexes = [
+            # Popular feed pages walk this index with keyset cursors
+            models.Index(fields=['-popularity_score', '-id'], name='api_post_popular_idx'),
+            # A user's posts / the personal feed, newest first. is_deleted comes last:
+            # Django writes is_deleted=False as "NOT is_deleted", which SQLite and MySQL
+            # can't use as an index key, so it must not sit in front of created_at
+            models.Index(fields=['user', 'created_at', 'is_deleted'], name='api_post_user_recent_idx'),
+            # Global feed / post list, newest first
+            models.Index(fields=['created_at', 'is_deleted'], name='api_post_recent_idx'),
+        ]
     
     def __str__(self):
         """How post appears in admin panel"""
@@ -192,10 +239,19 @@ class Comment(models.Model):
     # Soft delete
     is_deleted = models.BooleanField(default=False)
     
+    # Comment.objects skips deleted comments, Comment.all_objects includes them
+    objects = ActiveManager()
+    all_objects = models.Manager()
+    
     class Meta:
         ordering = ['created_at']  # Oldest comments first (or -created_at for newest)
         verbose_name = 'Comment'
         verbose_name_plural = 'Comments'
+        base_manager_name = 'all_objects'
+        indexes = [
+            # Comment threads: top-level comments of a post, oldest first
+            models.Index(fields=['post', 'parent', 'created_at', 'is_deleted'], name='api_comment_thread_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username}: {self.content[:30]}..."
@@ -257,6 +313,11 @@ class Notification(models.Model):
         blank=True
     )
     
+    # When the post is archived (api/archive.py) the links above are cleared -
+    # its id, and the comment's, are kept here (archived posts keep their ids)
+    archived_post_id = models.BigIntegerField(null=True, blank=True)
+    archived_comment_id = models.BigIntegerField(null=True, blank=True)
+    
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -272,4 +333,263 @@ class Notification(models.Model):
     def mark_as_read(self):
         """Mark notification as read"""
         self.is_read = True
-        self.save()        
\ No newline at end of file
+        self.save()        
+
+
+class ImageAsset(models.Model):
+    """
+    An uploaded image, stored as resized WebP variants (see api/images.py).
+    variants maps a variant name to {'path', 'url', 'width', 'height'}.
+    
+    Images are content-addressed: uploading the same bytes again returns
+    the existing asset. ref_count counts what uses the image - each user
+    who uploaded it plus each post showing it - and the files are deleted
+    when it drops to zero.
+    """
+    
+    # First uploader (kept if they delete their account - others may use it)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='images'
+    )
+    
+    # Everyone who uploaded this image - they may attach it to posts or delete it
+    uploaders = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        blank=True,
+        related_name='uploaded_images'
+    )
+    
+    # SHA-256 of the uploaded bytes; also the folder name in the image storage
+    key = models.CharField(max_length=64, unique=True)
+    
+    # Perceptual hash for near-duplicates (only with IMAGE_PERCEPTUAL_DEDUP).
+    # Split into four indexed 16-bit bands: two hashes at most 3 bits apart
+    # always share at least one band, so candidates are an index lookup.
+    phash = models.CharField(max_length=16, blank=True)
+    phash_band_0 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band_1 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band_2 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band_3 = models.CharField(max_length=4, blank=True, db_index=True)
+    
+    ref_count = models.PositiveIntegerField(default=0)
+    
+    variants = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Image {self.key[:12]} ({self.ref_count} refs)"
+    
+    def save(self, *args, **kwargs):
+        for band in range(4):
+            setattr(self, f'phash_band_{band}', self.phash[band * 4:band * 4 + 4])
+        super().save(*args, **kwargs)
+    
+    def urls(self):
+        """{variant name: url}"""
+        return {name: variant['url'] for name, variant in self.variants.items()}
+    
+    def srcset(self):
+        """HTML srcset value, e.g. "thumb.webp 150w, medium.webp 600w, ..." """
+        by_width = {}
+        for variant in sorted(self.variants.values(), key=lambda v: v['width']):
+            by_width.setdefault(variant['width'], variant['url'])  # Small images give equal widths
+        return ', '.join(f"{url} {width}w" for width, url in by_width.items())
+
+
+class UploadSession(models.Model):
+    """
+    A chunked image upload in progress (see api/chunked_upload.py).
+    The bytes are kept in a file on disk until the upload is finalized.
+    """
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    
+    size = models.PositiveIntegerField()              # Total bytes the client will send
+    received = models.PositiveIntegerField(default=0)  # Bytes stored so far = next offset
+    content_type = models.CharField(max_length=20, blank=True)  # From the first chunk's magic bytes
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Upload {self.id} by {self.user.username} ({self.received}/{self.size} bytes)"
+
+
+class ImageJob(models.Model):
+    """
+    Background processing of an uploaded image (see api/image_jobs.py).
+    The upload is spooled to disk, then resized and stored off the request.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='image_jobs'
+    )
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    key = models.CharField(max_length=64)  # Content hash of the upload
+    
+    # The stored image, once done
+    asset = models.ForeignKey(
+        ImageAsset,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Finding jobs to retry after a restart
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"Image job {self.id} ({self.status})"
+
+
+class ArchivedPost(models.Model):
+    """
+    A post moved out of the Post table by the archiver (see api/archive.py).
+    Keeps the post's id. Its likes and comments are stored with it as JSON,
+    so the hot Like / Comment tables shrink too.
+    """
+    
+    id = models.BigIntegerField(primary_key=True)  # Same id the post had
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_posts'
+    )
+    
+    content = models.TextField(max_length=1000)
+    image = CloudinaryField('image', null=True, blank=True)
+    image_asset = models.ForeignKey(
+        ImageAsset,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='archived_posts'
+    )
+    
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    popularity_score = models.FloatField(default=0)
+    
+    liked_by = models.JSONField(default=list)  # User ids
+    comments = models.JSONField(default=list)  # [{id, user_id, parent_id, content, created_at}]
+    
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # A user's archived posts / deep feed pages, newest first
+            models.Index(fields=['user', 'created_at'], name='api_archpost_user_idx'),
+            models.Index(fields=['created_at', 'id'], name='api_archpost_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived post #{self.id}"
+    
+    @property
+    def likes_count(self):
+        return len(self.liked_by)
+    
+    @property
+    def comments_count(self):
+        return len(self.comments)
+
+
+class ArchivedNotification(models.Model):
+    """A read notification moved out of the Notification table (see api/archive.py)"""
+    
+    id = models.BigIntegerField(primary_key=True)
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_notifications'
+    )
+    
+    type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    message = models.CharField(max_length=255)
+    
+    related_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    
+    # Plain ids - the post or comment may be archived or deleted by now
+    related_post_id = models.BigIntegerField(null=True, blank=True)
+    related_comment_id = models.BigIntegerField(null=True, blank=True)
+    
+    is_read = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='api_archnotif_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived {self.type} notification for user #{self.user_id}"
+
+
+class AccountDeletion(models.Model):
+    """
+    A deleted account whose data is being removed in the background
+    (see api/account_deletion.py). Kept afterwards as a record.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ]
+    
+    # Plain id, not a foreign key - the user row is deleted at the end
+    user_id = models.BigIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    step = models.CharField(max_length=30, blank=True)  # Last step worked on
+    deleted_rows = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Deletion of {self.username} ({self.status})"
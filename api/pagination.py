@@ -0,0 +1,71 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    """Turn a list of keyset values into an opaque URL-safe cursor"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into its keyset values (raises ValueError if invalid)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+    # Keyset values are plain numbers or strings (dates are ISO strings)
+    if not isinstance(values, list) or not all(
+        isinstance(v, (int, float, str)) and not isinstance(v, bool) for v in values
+    ):
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def keyset_filter(fields, values):
+    """
+    Build the "comes after this row" filter for a descending keyset.
+    For fields (a, b) and values (x, y): a < x OR (a = x AND b < y)
+    """
+    condition = Q()
+    equal_so_far = Q()
+    for field, value in zip(fields, values):
+        condition |= equal_so_far & Q(**{f'{field}__lt': value})
+        equal_so_far &= Q(**{field: value})
+    return condition
+
+
+def paginate_keyset(queryset, fields, cursor=None, page_size=20):
+    """
+    Get one page of a queryset ordered by `fields` (all descending).
+    Returns (items, next_cursor) - next_cursor is None on the last page.
+    page_size must be at least 1.
+    No COUNT and no OFFSET, so every page costs the same.
+    """
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(fields):
+            raise ValueError("Invalid cursor.")
+        try:
+            queryset = queryset.filter(keyset_filter(fields, values))
+        except (TypeError, ValidationError) as e:
+            # e.g. a string where the field wants a number
+            raise ValueError("Invalid cursor.") from e
+
+    queryset = queryset.order_by(*[f'-{field}' for field in fields])
+
+    # Fetch one extra row to know if there is a next page
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if items and len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([getattr(items[-1], field) for field in fields])
+
+    return items, next_cursor
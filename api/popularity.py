@@ -0,0 +1,83 @@
+"""
+Popularity engine for the popular feed.
+
+Every post gets a time-decayed engagement score:
+
+    score = log2(1 + likes + 2 * comments) + (created_at - EPOCH) / HALF_LIFE
+
+Ranking by this number gives the same order as ranking by
+engagement * 2 ** (-age / HALF_LIFE), because "now" is the same for every
+post. So a stored score never goes stale just because time passes - it only
+has to be recomputed when a post gets new likes or comments.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+# A comment takes more effort than a like, so it counts more
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+
+# Fixed reference point for the age part of the score
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def half_life_seconds():
+    """How long it takes for a post to need twice the engagement to keep its rank"""
+    return getattr(settings, 'POPULARITY_HALF_LIFE_HOURS', 12) * 3600
+
+
+def compute_score(likes, comments, created_at):
+    """Decayed engagement score for one post"""
+    engagement = 1 + LIKE_WEIGHT * likes + COMMENT_WEIGHT * comments
+    age_offset = (created_at - SCORE_EPOCH).total_seconds() / half_life_seconds()
+    return math.log2(engagement) + age_offset
+
+
+def mark_active(post_id):
+    """Flag a post so the next refresh recomputes its score"""
+    from .models import Post
+
+    # update() skips auto_now, so updated_at stays the real edit time
+    Post.objects.filter(pk=post_id).update(last_activity_at=timezone.now())
+
+
+def refresh_scores(since=None, batch_size=500):
+    """
+    Recompute scores for posts with activity after `since` (or all posts).
+    Returns how many posts were updated.
+    """
+    from .models import Post
+
+    posts = Post.objects.filter(is_deleted=False)
+    if since is not None:
+        posts = posts.filter(last_activity_at__gte=since)
+
+    posts = posts.annotate(
+        num_likes=Count('likes', distinct=True),
+        num_comments=Count('comments', filter=Q(comments__is_deleted=False), distinct=True),
+    ).only('id', 'created_at', 'popularity_score').order_by('id')
+
+    updated = 0
+    batch = []
+    for post in posts.iterator(chunk_size=batch_size):
+        post.popularity_score = compute_score(post.num_likes, post.num_comments, post.created_at)
+        batch.append(post)
+        if len(batch) >= batch_size:
+            Post.objects.bulk_update(batch, ['popularity_score'])
+            updated += len(batch)
+            batch = []
+
+    if batch:
+        Post.objects.bulk_update(batch, ['popularity_score'])
+        updated += len(batch)
+
+    return updated
+
+
+def refresh_recent_scores(minutes=15):
+    """Recompute scores for posts that had activity in the last few minutes"""
+    return refresh_scores(since=timezone.now() - timedelta(minutes=minutes))
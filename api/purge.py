@@ -0,0 +1,81 @@
+"""
+Hard-delete soft-deleted content.
+
+Deleting a post or comment only sets is_deleted=True, so the rows, their
+likes, comments and notifications stay in the tables. Once the grace period
+(PURGE_GRACE_DAYS) has passed, `python manage.py purge_deleted` removes them.
+
+Everything is deleted in small batches, children before parents, each batch
+in its own short transaction followed by a pause - so the purge never holds
+locks long enough to slow down live requests. It can be stopped and started
+again at any time.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Comment, Like, Notification, Post
+
+# Rows per batch / seconds to wait between batches
+BATCH_SIZE = 500
+PAUSE = 0.2
+
+
+def purge_steps(older_than):
+    """(name, queryset) pairs to delete in order - children first"""
+    posts = Post.all_objects.filter(is_deleted=True, updated_at__lt=older_than)
+    comments = Comment.all_objects.filter(
+        Q(post__in=posts) | Q(is_deleted=True, updated_at__lt=older_than)
+    )
+    return [
+        ('notifications', Notification.objects.filter(
+            Q(related_post__in=posts) | Q(related_comment__in=comments)
+        )),
+        ('likes', Like.objects.filter(post__in=posts)),
+        ('comments', comments),  # Also removes their replies
+        ('posts', posts),
+    ]
+
+
+def delete_in_batches(queryset, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """
+    Delete `queryset` batch_size rows at a time (walking the primary key).
+    Calls progress(deleted, rows_per_second) after each batch; returns the
+    number of rows deleted, including rows removed by cascades.
+    """
+    model = queryset.model
+    deleted = 0
+    working = 0.0  # Time spent deleting, without the pauses
+    last_pk = None
+
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+
+        started = time.monotonic()
+        with transaction.atomic():
+            count, _ = model._base_manager.filter(pk__in=ids).delete()
+        working += time.monotonic() - started
+
+        deleted += count
+        last_pk = ids[-1]
+        if progress:
+            progress(deleted, deleted / working if working else 0)
+        time.sleep(pause)
+
+
+def purge_deleted(older_than, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """
+    Purge content soft-deleted before `older_than`. progress(step, deleted,
+    rows_per_second) is called after every batch. Returns {step: rows}.
+    """
+    totals = {}
+    for name, queryset in purge_steps(older_than):
+        step_progress = (lambda deleted, rate, name=name: progress(name, deleted, rate)) if progress else None
+        totals[name] = delete_in_batches(queryset, batch_size, pause, step_progress)
+    return totals
@@ -0,0 +1,170 @@
+"""
+Per-request query budget and N+1 detector.
+
+QueryBudgetMiddleware counts the database queries of every request and
+how long they took, and groups them by shape - the SQL with numbers and
+IN (...) lists blanked out. The same shape running many times in one
+request is the signature of an N+1: a query per row instead of one for
+all of them.
+
+- over budget (QUERY_BUDGET, default 50): a warning is logged, or with
+  QUERY_BUDGET_STRICT=True an exception is raised, so tests fail
+- a shape repeated QUERY_REPEAT_THRESHOLD times (default 5): a warning
+- with DEBUG=True every response also gets headers:
+
+    X-DB-Queries: 12
+    X-DB-Time-Ms: 4.8
+    X-DB-Repeated: 1
+
+Every view declares its budget - the most queries it runs with a cold
+cache - or opts out with None. Views whose serializers still run a query
+per row say so, which keeps their repeats out of the N+1 warnings:
+
+    class FeedView(ConditionalGetMixin, generics.ListAPIView):
+        query_budget = 101
+        known_n_plus_one = True  # Per-post queries in PostSerializer
+
+    class BatchRequestView(APIView):
+        query_budget = None  # Runs other views - they have budgets of their own
+
+    @with_query_budget(3)
+    def health_check(request): ...
+
+Views without one get QUERY_BUDGET. Take known_n_plus_one off a view
+once it's fixed; don't add it to new ones.
+
+Only queries run on the request's own thread are counted - not the ones
+the async views (api/async_views.py) or parallel batches send to a pool.
+api/tests.py checks every URL against its view's budget.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# "Not declared on the view" - None already means "no budget"
+DEFAULT = object()
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more queries than its budget (QUERY_BUDGET_STRICT)"""
+
+
+def default_budget():
+    """Queries a request may run unless its view says otherwise"""
+    return getattr(settings, 'QUERY_BUDGET', 50)
+
+
+def repeat_threshold():
+    """Runs of the same query shape in one request that count as an N+1"""
+    return getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+
+
+def query_shape(sql):
+    """`sql` with the parts that change from row to row blanked out"""
+    shape = re.sub(r'\bIN \([^()]*\)', 'IN (...)', sql)
+    shape = re.sub(r'\b\d+\b', 'N', shape)
+    return re.sub(r'\s+', ' ', shape).strip()
+
+
+class QueryStats:
+    """Execute wrapper that counts queries, their time and their shapes"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self, threshold=None):
+        """{shape: times} for the shapes that ran at least `threshold` times"""
+        threshold = threshold or repeat_threshold()
+        return {shape: times for shape, times in self.shapes.items() if times >= threshold}
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run on this thread, on every database"""
+    stats = QueryStats()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        yield stats
+
+
+def with_query_budget(budget):
+    """Declare a function view's budget, like `query_budget = ...` on a class"""
+    def decorate(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorate
+
+
+def declared(view_func, name, default):
+    """An attribute declared on the view class (or function) behind `view_func`"""
+    view = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None) or view_func
+    return getattr(view, name, default)
+
+
+def budget_for(view_func):
+    """The view's `query_budget`, or the default one"""
+    budget = declared(view_func, 'query_budget', DEFAULT)
+    return default_budget() if budget is DEFAULT else budget
+
+
+def known_n_plus_one(view_func):
+    """Whether the view is known to repeat queries per row"""
+    return declared(view_func, 'known_n_plus_one', False)
+
+
+class QueryBudgetMiddleware:
+    """Count each request's queries and complain about budgets and N+1s"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._query_budget = default_budget()
+        request._known_n_plus_one = False
+        with count_queries() as stats:
+            response = self.get_response(request)
+        request._query_stats = stats  # For MetricsMiddleware (api/metrics.py)
+
+        budget = request._query_budget
+        repeated = stats.repeated()
+        where = f'{request.method} {request.path}'
+
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time-Ms'] = f'{stats.duration * 1000:.1f}'
+            response['X-DB-Repeated'] = str(len(repeated))
+
+        if not request._known_n_plus_one:
+            for shape, times in repeated.items():
+                logger.warning('Possible N+1 on %s: %d runs of %s', where, times, shape)
+
+        if budget is not None and stats.count > budget:
+            message = f'{where} ran {stats.count} queries (budget {budget})'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = budget_for(view_func)
+        request._known_n_plus_one = known_n_plus_one(view_func)
@@ -0,0 +1,102 @@
+"""
+OpenAPI schema serving without generating it on every request.
+
+`python manage.py build_schema` writes the schema to api/static/api/ as
+openapi.json and openapi.yaml. collectstatic then gives them a content
+hash, and WhiteNoise serves them with far-future cache headers. When the
+files are there:
+
+- /api/schema/ redirects to the hashed static file
+- /api/docs/ and /api/redoc/ point the browser straight at it
+
+bin/post_compile runs both on deploy. When the files are missing (local
+development, or build_schema was not run), the schema is generated once
+per process and kept in memory - and the files are looked for again on
+the next request, so a worker started before they were published still
+picks them up.
+
+This module imports drf_spectacular, so only load it lazily (see api.lazy).
+"""
+import threading
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import HttpResponseRedirect
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from rest_framework.response import Response
+
+# Renderer format -> static file written by build_schema
+SCHEMA_FILES = {
+    'yaml': 'api/openapi.yaml',
+    'json': 'api/openapi.json',
+}
+
+_memo = {}
+_memo_lock = threading.Lock()
+_urls = {}  # Renderer format -> static URL, once found
+
+
+def static_schema_url(format):
+    """Hashed static URL of the pre-built schema, or None if it isn't built (yet)"""
+    if format not in _urls:
+        name = SCHEMA_FILES[format]
+        try:
+            if not staticfiles_storage.exists(name):
+                return None
+            _urls[format] = staticfiles_storage.url(name)
+        except ValueError:
+            # Not in the manifest this process loaded - collectstatic may have run since
+            if hasattr(staticfiles_storage, 'load_manifest'):
+                staticfiles_storage.hashed_files = staticfiles_storage.load_manifest()
+            return None
+    return _urls[format]
+
+
+def generate_schema(version=None):
+    """Build the schema dict, once per process and API version"""
+    if version not in _memo:
+        with _memo_lock:
+            if version not in _memo:
+                generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(api_version=version)
+                _memo[version] = generator.get_schema(request=None, public=True)
+    return _memo[version]
+
+
+class SchemaView(SpectacularAPIView):
+    """Redirect to the pre-built schema file, or serve the in-memory copy"""
+
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get('lang') and not request.GET.get('version'):
+            renderer, _ = self.perform_content_negotiation(request)
+            url = static_schema_url(renderer.format)
+            if url:
+                return HttpResponseRedirect(url)
+        return super().get(request, *args, **kwargs)
+
+    def _get_schema_response(self, request):
+        if request.GET.get('lang'):
+            # Translated schemas are rare - generate them the normal way
+            return super()._get_schema_response(request)
+
+        version = self.api_version or request.version or self._get_version_parameter(request)
+        return Response(
+            data=generate_schema(version),
+            headers={"Content-Disposition": f'inline; filename="{self._get_filename(request, version)}"'}
+        )
+
+
+class StaticSchemaUrlMixin:
+    """Point the docs UI at the pre-built schema file when there is one"""
+
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get('lang') and not request.GET.get('version'):
+            self.url = static_schema_url('json')
+        return super().get(request, *args, **kwargs)
+
+
+class SchemaSwaggerView(StaticSchemaUrlMixin, SpectacularSwaggerView):
+    pass
+
+
+class SchemaRedocView(StaticSchemaUrlMixin, SpectacularRedocView):
+    pass
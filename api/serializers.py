@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import Post,Follow, Like,Comment
+from .models import Post,Follow, Like,Comment, ImageAsset, ImageJob, ArchivedPost
 from django.contrib.auth import get_user_model
+from .image_jobs import resolve_if_done
 
 User = get_user_model()
 
@@ -32,6 +33,24 @@ class PostSerializer(serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
     recent_comments = serializers.SerializerMethodField()
     
+    # Image from /api/upload/image/ - send its id, get back the resized variants
+    image_asset = serializers.PrimaryKeyRelatedField(
+        queryset=ImageAsset.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    image_variants = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    
+    # Or send the upload's job_id while it is still processing - the post
+    # shows image_status "pending" until the image is ready
+    image_job = serializers.PrimaryKeyRelatedField(
+        queryset=ImageJob.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    image_status = serializers.SerializerMethodField()
+    
     class Meta:
         model = Post
         fields = [
@@ -40,6 +59,11 @@ class PostSerializer(serializers.ModelSerializer):
             'user_id',
             'content',
             'image',
+            'image_asset',
+            'image_variants',    # {"thumb": url, "medium": url, "full": url}
+            'image_srcset',      # For <img srcset="...">
+            'image_job',
+            'image_status',      # "ready", "pending", "processing", "failed" or null
             'created_at',
             'updated_at',
             'likes_count',
@@ -49,7 +73,8 @@ class PostSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = [
             'id', 'created_at', 'updated_at', 'user', 
-            'likes_count', 'comments_count', 'is_liked', 'recent_comments'
+            'likes_count', 'comments_count', 'is_liked', 'recent_comments',
+            'image_variants', 'image_srcset', 'image_status'
         ]
     
     def get_is_liked(self, obj):
@@ -64,6 +89,48 @@ class PostSerializer(serializers.ModelSerializer):
         comments = obj.comments.filter(is_deleted=False).order_by('-created_at')[:3]
         return CommentSerializer(comments, many=True, read_only=True).data
     
+    def get_image_variants(self, obj):
+        """Variant URLs of the post's uploaded image"""
+        return obj.image_asset.urls() if obj.image_asset else None
+    
+    def get_image_srcset(self, obj):
+        """srcset of the post's uploaded image"""
+        return obj.image_asset.srcset() if obj.image_asset else None
+    
+    def get_image_status(self, obj):
+        """Whether the post's uploaded image is ready yet"""
+        if obj.image_asset_id:
+            return 'ready'
+        if obj.image_job_id:
+            return obj.image_job.status
+        return None
+    
+    def validate_image_job(self, value):
+        """Users can only attach their own uploads"""
+        request = self.context.get('request')
+        if value and request and value.user_id != request.user.id:
+            raise serializers.ValidationError("You can only use images you uploaded.")
+        if value and value.status == 'failed':
+            raise serializers.ValidationError(f"This image could not be processed: {value.error}")
+        return value
+    
+    def validate(self, attrs):
+        """A finished job is stored as the image itself"""
+        job = attrs.get('image_job')
+        if job is not None and job.status == 'done':
+            attrs['image_asset'] = job.asset
+            attrs['image_job'] = None
+        return attrs
+    
+    def validate_image_asset(self, value):
+        """Users can only attach images they uploaded"""
+        request = self.context.get('request')
+        if value and self.instance is not None and self.instance.image_asset_id == value.pk:
+            return value  # Unchanged
+        if value and request and not value.uploaders.filter(pk=request.user.pk).exists():
+            raise serializers.ValidationError("You can only use images you uploaded.")
+        return value
+    
     def validate_content(self, value):
         """Validate post content"""
         if len(value.strip()) == 0:
@@ -83,6 +150,8 @@ class PostSerializer(serializers.ModelSerializer):
     
         # Create post
         post = Post.objects.create(**validated_data)
+        if post.image_job_id:
+            resolve_if_done(post.image_job_id)  # Finished while we were saving
         return post
     
     def update(self, instance, validated_data):
@@ -90,9 +159,73 @@ class PostSerializer(serializers.ModelSerializer):
         # Users can only update content and image
         instance.content = validated_data.get('content', instance.content)
         instance.image = validated_data.get('image', instance.image)
+        instance.image_asset = validated_data.get('image_asset', instance.image_asset)
+        instance.image_job = validated_data.get('image_job', instance.image_job)
         instance.save()
+        if instance.image_job_id:
+            resolve_if_done(instance.image_job_id)
         return instance
 
+
+class PostBatchItemSerializer(serializers.Serializer):
+    """
+    One post of POST /api/posts/batch/. Images are sent as ids and checked
+    for the whole batch at once (see api/batch_posts.py).
+    """
+    
+    content = serializers.CharField(allow_blank=True, trim_whitespace=False)
+    image_asset = serializers.IntegerField(required=False, allow_null=True)
+    image_job = serializers.UUIDField(required=False, allow_null=True)
+    
+    # Same rules as a single post
+    validate_content = PostSerializer.validate_content
+
+
+class ArchivedPostSerializer(serializers.ModelSerializer):
+    """Read-only: an archived post, shaped like PostSerializer (recent comments carry user ids)"""
+    
+    user = UserBasicSerializer(read_only=True)
+    likes_count = serializers.IntegerField(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
+    is_liked = serializers.SerializerMethodField()
+    recent_comments = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    image_status = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ArchivedPost
+        fields = [
+            'id', 'user', 'content', 'image', 'image_asset', 'image_variants',
+            'image_srcset', 'image_status', 'created_at', 'updated_at',
+            'likes_count', 'comments_count', 'is_liked', 'recent_comments',
+            'archived',          # Always true - can't be liked or commented any more
+        ]
+        read_only_fields = fields
+    
+    def get_is_liked(self, obj):
+        request = self.context.get('request')
+        return bool(request and request.user.pk in obj.liked_by)
+    
+    def get_recent_comments(self, obj):
+        """3 most recent top-level comments (stored with the post)"""
+        comments = [c for c in obj.comments if c['parent_id'] is None][-3:]
+        return list(reversed(comments))
+    
+    def get_image_variants(self, obj):
+        return obj.image_asset.urls() if obj.image_asset else None
+    
+    def get_image_srcset(self, obj):
+        return obj.image_asset.srcset() if obj.image_asset else None
+    
+    def get_image_status(self, obj):
+        return 'ready' if obj.image_asset_id else None
+    
+    def get_archived(self, obj):
+        return True
+
+
 class FollowSerializer(serializers.ModelSerializer):
     """Serializer for Follow relationships"""
     
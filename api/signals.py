@@ -1,6 +1,17 @@
-from django.db.models.signals import post_save
+import logging
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
 from django.dispatch import receiver
-from .models import Follow, Like, Comment, Notification
+from django.db import transaction, connections
+from django.db.models import Q
+from django.contrib.auth import get_user_model
+from .models import Post, Follow, Like, Comment, Notification, ArchivedPost
+from .popularity import compute_score, mark_active
+from .cache import bump_version
+from . import executors, feed_buffer
+from .images import add_reference, release_reference
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Follow)
 def create_follow_notification(sender, instance, created, **kwargs):
@@ -36,4 +47,164 @@ def create_comment_notification(sender, instance, created, **kwargs):
             related_user=instance.user,
             related_post=instance.post,
             related_comment=instance
-        )
\ No newline at end of file
+        )
+
+@receiver(post_save, sender=Post)
+def set_initial_popularity(sender, instance, created, **kwargs):
+    """New posts start with a zero-engagement score so they can rank right away"""
+    if created:
+        Post.objects.filter(pk=instance.pk).update(
+            popularity_score=compute_score(0, 0, instance.created_at),
+            last_activity_at=instance.created_at
+        )
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+def mark_post_active(sender, instance, **kwargs):
+    """Likes and comments change engagement - queue the post for a score refresh"""
+    mark_active(instance.post_id)
+
+
+# Cache invalidation - see api/cache.py
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_cache(sender, instance, **kwargs):
+    """Post changed (edit / soft delete) - also changes the author's posts_count"""
+    bump_version('post', instance.pk)
+    bump_version('user', instance.user_id)
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_counts_cache(sender, instance, **kwargs):
+    """Likes and comments change a post's counts and recent comments"""
+    bump_version('post', instance.post_id)
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_cache(sender, instance, **kwargs):
+    """Follows change both users' follower / following counts"""
+    bump_version('user', instance.follower_id)
+    bump_version('user', instance.following_id)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Profile changed (also drops the cached authenticated user)"""
+    bump_version('user', instance.pk)
+    bump_version('auth', instance.pk)
+
+# Posts and comments show their author's username and picture
+AUTHOR_FIELDS = ('username', 'profile_picture')
+
+def author_fields(user):
+    # From __dict__, so deferred fields aren't loaded just for this
+    return tuple(str(user.__dict__.get(name) or '') for name in AUTHOR_FIELDS)
+
+@receiver(post_init, sender=User)
+def remember_author_fields(sender, instance, **kwargs):
+    """Remember the loaded name / picture, so a save can tell whether they changed"""
+    instance._saved_author_fields = author_fields(instance)
+
+@receiver(post_save, sender=User)
+def invalidate_authored_posts(sender, instance, created, **kwargs):
+    """New name or picture - drop the cached posts that show it (as author or commenter)"""
+    fields = author_fields(instance)
+    if created or fields == instance._saved_author_fields:
+        return
+    instance._saved_author_fields = fields
+    # A busy account can be on thousands of posts - bump them after the response
+    user_id = instance.pk
+    transaction.on_commit(lambda: refresh_in_background(user_id))
+
+def refresh_in_background(user_id):
+    executors.get_executor('author-refresh', 1).submit(_refresh_in_pool, user_id)
+
+def _refresh_in_pool(user_id):
+    try:
+        refresh_authored_posts(user_id)
+    except Exception:
+        # The old name stays on those posts until their cache entries expire
+        logger.exception("Refreshing the posts of user %s failed", user_id)
+    finally:
+        connections.close_all()
+
+def refresh_authored_posts(user_id):
+    """Bump every post the user wrote or commented on, and re-serialize the buffered ones"""
+    post_ids = set()
+    posts = Post.objects.filter(Q(user_id=user_id) | Q(comments__user_id=user_id)).values_list('id', flat=True)
+    for post_id in posts.distinct().iterator(chunk_size=500):
+        bump_version('post', post_id)
+        post_ids.add(post_id)
+    feed_buffer.refresh_many(post_ids)
+
+
+# Global feed ring buffer - see api/feed_buffer.py
+# Updated on commit, so a rolled back post never shows up in the feed
+
+@receiver(post_save, sender=Post)
+def update_feed_buffer(sender, instance, created, **kwargs):
+    """New posts go in, soft-deleted posts come out, edits are refreshed"""
+    if created:
+        transaction.on_commit(lambda: feed_buffer.push(instance))
+    elif instance.is_deleted:
+        transaction.on_commit(lambda: feed_buffer.remove(instance.pk))
+    else:
+        transaction.on_commit(lambda: feed_buffer.refresh(instance.pk))
+
+@receiver(post_delete, sender=Post)
+def remove_from_feed_buffer(sender, instance, **kwargs):
+    """Hard delete of a live post (soft-deleted ones are already out)"""
+    if not instance.is_deleted:
+        transaction.on_commit(lambda: feed_buffer.remove(instance.pk))
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def refresh_feed_buffer_counts(sender, instance, **kwargs):
+    """Likes and comments change the buffered post's counts"""
+    post_id = instance.post_id
+    transaction.on_commit(lambda: feed_buffer.refresh(post_id))
+
+
+# Image reference counting - see api/images.py
+# Every post showing an uploaded image holds one reference to it
+
+@receiver(post_init, sender=Post)
+def remember_image_asset(sender, instance, **kwargs):
+    """Remember the loaded image, so a save can tell whether it changed"""
+    instance._saved_image_asset_id = instance.__dict__.get('image_asset_id')  # No query if deferred
+
+@receiver(post_save, sender=Post)
+def count_image_reference(sender, instance, created, **kwargs):
+    """The post started or stopped showing an uploaded image"""
+    old = None if created else instance._saved_image_asset_id
+    new = instance.__dict__.get('image_asset_id')
+    if old != new:
+        if new:
+            add_reference(new)
+        if old:
+            release_reference(old)
+    instance._saved_image_asset_id = new
+
+@receiver(post_delete, sender=Post)
+def release_image_reference(sender, instance, **kwargs):
+    """Hard-deleted posts let go of their image"""
+    if instance.image_asset_id:
+        release_reference(instance.image_asset_id)
+
+@receiver(post_delete, sender=ArchivedPost)
+def release_archived_image_reference(sender, instance, **kwargs):
+    """Archived posts hold their image too (see api/archive.py)"""
+    if instance.image_asset_id:
+        release_reference(instance.image_asset_id)
+
+@receiver(pre_delete, sender=User)
+def release_uploaded_images(sender, instance, **kwargs):
+    """A deleted account lets go of the images it uploaded"""
+    for asset_id in instance.uploaded_images.values_list('id', flat=True):
+        release_reference(asset_id)
@@ -0,0 +1,232 @@
+"""
+Slow-query log.
+
+Every database connection gets an execute wrapper that times its queries.
+Queries slower than SLOW_QUERY_MS (a SLOW_QUERY_SAMPLE_RATE share of
+them) are written to a rotating log, one JSON object per line. Each
+process writes its own file, SLOW_QUERY_LOG with its pid added
+(tmp/slow_queries.1234.log): gunicorn workers rotating one shared file
+would rename it under each other and lose lines.
+
+    {"time": "...", "ms": 812.4, "db": "default", "fingerprint": "3b9f0c2a51de",
+     "sql": "SELECT ...", "params": "(5, '%cat%')", "view": "api.views.FeedView",
+     "route": "api/feed/", "path": "/api/feed/?search=cat&date_from=2024-01-01",
+     "plan": ["SEARCH api_post USING INDEX ...", ...]}
+
+- fingerprint: hash of the query's shape (api/query_budget.py), so the
+  same query with other values groups together
+- view / route / path: the request that ran it (none in commands)
+- plan: the database's EXPLAIN for SELECTs - run on a background thread
+  after the request's query, and at most once per fingerprint every
+  EXPLAIN_EVERY seconds per process
+
+Writing the log and running EXPLAIN both happen on that thread, so the
+request only pays for a timer. See the worst queries with:
+
+    python manage.py slow_query_report
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from . import executors
+from .db_router import current_request
+from .query_budget import query_shape
+
+# EXPLAIN each fingerprint at most this often (seconds, per process)
+EXPLAIN_EVERY = 300
+
+# Slow queries waiting to be logged; more are dropped rather than queued
+MAX_PENDING = 100
+
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_explained = {}  # fingerprint -> when it was last explained
+_explained_lock = threading.Lock()
+_log = logging.getLogger('api.slow_queries.file')
+_log.propagate = False
+_log_lock = threading.Lock()
+_local = threading.local()
+
+
+def threshold_ms():
+    """Queries at least this slow are logged"""
+    return getattr(settings, 'SLOW_QUERY_MS', 500)
+
+
+def sample_rate():
+    """Share of slow queries logged (0 turns the log off)"""
+    return getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 1.0)
+
+
+def log_path():
+    return getattr(settings, 'SLOW_QUERY_LOG', os.path.join(settings.BASE_DIR, 'tmp', 'slow_queries.log'))
+
+
+def process_log_path():
+    """This process's log: SLOW_QUERY_LOG with the pid before the extension"""
+    root, ext = os.path.splitext(log_path())
+    return f'{root}.{os.getpid()}{ext}'
+
+
+def log_files():
+    """Every process's log and rotated copies, newest first"""
+    root, ext = os.path.splitext(os.path.abspath(log_path()))
+    # slow_queries.log, slow_queries.1234.log, slow_queries.1234.log.2, ...
+    pattern = re.compile(rf'{re.escape(os.path.basename(root))}(\.\d+)?{re.escape(ext)}(\.\d+)?')
+    folder = os.path.dirname(root)
+    if not os.path.isdir(folder):
+        return []
+    names = [os.path.join(folder, name) for name in os.listdir(folder) if pattern.fullmatch(name)]
+    return sorted(names, key=os.path.getmtime, reverse=True)
+
+
+def fingerprint(sql):
+    """Short id for the query's shape"""
+    return hashlib.sha1(query_shape(sql).encode()).hexdigest()[:12]
+
+
+def get_executor():
+    """One thread that runs EXPLAINs and writes the log"""
+    return executors.get_executor('slow-query', 1)
+
+
+def _handler():
+    """The rotating file handler for this process's log"""
+    path = os.path.abspath(process_log_path())
+    with _log_lock:
+        for handler in list(_log.handlers):
+            if handler.baseFilename == path:
+                return handler
+            _log.removeHandler(handler)
+            handler.close()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=getattr(settings, 'SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=getattr(settings, 'SLOW_QUERY_LOG_BACKUPS', 5),
+            encoding='utf-8',
+        )
+        _log.addHandler(handler)
+        _log.setLevel(logging.INFO)
+        return handler
+
+
+def should_explain(record):
+    if not record['sql'].lstrip().upper().startswith('SELECT'):
+        return False  # Never risk running a write twice
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(record['fingerprint'], -EXPLAIN_EVERY) < EXPLAIN_EVERY:
+            return False
+        _explained[record['fingerprint']] = now
+    return True
+
+
+def explain(alias, sql, params):
+    """The database's plan for `sql`, one line per row"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        return [str(row[-1]) for row in rows]  # id, parent, notused, detail
+    return [' | '.join(str(value) for value in row) for row in rows]
+
+
+def _write(record, alias, params):
+    """Runs on the slow-query thread"""
+    _local.busy = True  # Don't log our own EXPLAINs
+    try:
+        if should_explain(record):
+            try:
+                record['plan'] = explain(alias, record['sql'], params)
+            except Exception as e:
+                record['plan'] = [f'EXPLAIN failed: {e}']
+        _handler()
+        _log.info(json.dumps(record, default=str))
+    finally:
+        _local.busy = False
+        _pending.release()
+        close_old_connections()
+
+
+def request_info():
+    """view / route / path of the request running on this thread, if any"""
+    request = current_request()
+    if request is None:
+        return {'view': None, 'route': None, 'path': None}
+
+    match = getattr(request, 'resolver_match', None)
+    view = None
+    if match is not None:
+        func = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None) or match.func
+        view = f'{func.__module__}.{func.__qualname__}'
+    return {
+        'view': view,
+        'route': match.route if match is not None else None,
+        'path': request.get_full_path(),
+    }
+
+
+def record_slow_query(alias, sql, params, elapsed):
+    if random.random() >= sample_rate():
+        return
+    if not _pending.acquire(blocking=False):
+        return  # The log is falling behind - skip this one
+
+    record = {
+        'time': timezone.now().isoformat(),
+        'ms': round(elapsed * 1000, 1),
+        'db': alias,
+        'fingerprint': fingerprint(sql),
+        'sql': sql,
+        'params': repr(params)[:1000],
+        **request_info(),
+        'plan': None,
+    }
+    get_executor().submit(_write, record, alias, params)
+
+
+def slow_query_wrapper(alias):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed * 1000 >= threshold_ms() and not many and not getattr(_local, 'busy', False):
+                record_slow_query(alias, sql, params, elapsed)
+    wrapper.slow_query_log = True
+    return wrapper
+
+
+def add_wrapper(sender, connection, **kwargs):
+    # Called again when a connection reconnects - only wrap it once
+    if not any(getattr(w, 'slow_query_log', False) for w in connection.execute_wrappers):
+        # First, not last: connections open mid-request, inside `with execute_wrapper(...)`
+        # blocks (api/query_budget.py), which pop the last wrapper when they end
+        connection.execute_wrappers.insert(0, slow_query_wrapper(connection.alias))
+
+
+def install():
+    """Time the queries of every new connection (ApiConfig.ready)"""
+    connection_created.connect(add_wrapper, dispatch_uid='api.slow_queries')
+    for connection in connections.all(initialized_only=True):
+        add_wrapper(None, connection)
+
+
+def drain():
+    """Wait until every slow query so far has been logged"""
+    get_executor().submit(lambda: None).result()
@@ -1,3 +1,1692 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, resolve
+from django.utils import timezone
+from drf_spectacular.drainage import GENERATOR_STATS
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.authentication import invalidate_cached_user
+
+from . import feed_buffer, schema, signals, slow_queries
+from .cache import acquire_lease, get_post_data, get_user_data, get_version, release_lease, single_flight
+from .db_router import reads_only, route_request, sticky_key
+from .health import health_check
+from .image_jobs import job_path
+from .images import content_hash, ingest, release_reference
+from .account_deletion import request_deletion, run_deletion
+from .archive import archived_post_count
+from .models import AccountDeletion, ArchivedNotification, ArchivedPost, Comment, Follow, ImageAsset, ImageJob, Like, Notification, Post, UploadSession
+from .pagination import encode_cursor
+from .popularity import refresh_scores
+from .ranking import rank_posts
+from .query_budget import DEFAULT, QueryBudgetExceeded, budget_for, count_queries, declared, known_n_plus_one, query_shape
+from .async_views import AsyncFeedView, AsyncNotificationListView, AsyncUserFollowDetailView
+from .views import (
+    BatchRequestView, FeedView, NotificationListView, PostDetailView, PostListCreateView, UserFollowDetailView,
+)
+
+User = get_user_model()
+
+
+def query_plan(sql):
+    """
+    What the database would do to run `sql`: the tables it reads row by row
+    (no index) and whether it sorts the rows itself instead of reading them
+    in index order.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET enable_seqscan = off')  # Test tables are tiny - don't let size decide
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+        columns = [col[0].lower() for col in cursor.description]
+        rows = cursor.fetchall()
+
+    scanned, sorts = set(), False
+    for row in rows:
+        if connection.vendor == 'mysql':
+            plan = dict(zip(columns, row))
+            if plan['type'] == 'ALL':
+                scanned.add(plan['table'])
+            sorts = sorts or 'Using filesort' in (plan['extra'] or '')
+        elif connection.vendor == 'sqlite':
+            # "SCAN api_post" is a full scan, "SCAN api_post USING INDEX ..." walks an index
+            match = re.match(r'SCAN (\w+)$', row[-1])
+            if match:
+                scanned.add(match.group(1))
+            sorts = sorts or row[-1] == 'USE TEMP B-TREE FOR ORDER BY'
+        else:
+            match = re.search(r'Seq Scan on (\w+)', row[0])
+            if match:
+                scanned.add(match.group(1))
+            sorts = sorts or re.match(r'\s*(->\s*)?Sort\b', row[0]) is not None
+    return scanned, sorts
+
+
+def quiet_query_budget(cls):
+    """
+    No budget or N+1 warnings for this class - its rows aren't the ones the
+    budgets were measured with (QueryBudgetTests checks those)
+    """
+    cls = override_settings(QUERY_REPEAT_THRESHOLD=10**6)(cls)
+    return mock.patch('api.query_budget.budget_for', lambda view_func: None)(cls)
+
+
+class AliceAndBobMixin:
+    """Users alice and bob, an empty cache, and self.client signed in as alice"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pw12345678')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw12345678')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()  # Feeds and posts are cached - start every test from the database
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+
+@quiet_query_budget
+class QueryPlanTests(AliceAndBobMixin, TestCase):
+    """Hot endpoints must find Post and Comment rows through an index, not a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+
+        for i in range(30):
+            Post.objects.create(user=cls.bob, content=f'post {i}', is_deleted=(i % 5 == 0))
+            Post.objects.create(user=cls.alice, content=f'own post {i}')
+        cls.post = Post.objects.filter(user=cls.bob).first()
+        for i in range(20):
+            comment = Comment.objects.create(user=cls.alice, post=cls.post, content=f'comment {i}')
+            Comment.objects.create(user=cls.bob, post=cls.post, parent=comment, content=f'reply {i}')
+
+    def page_query(self, url, table):
+        """The SQL that loaded the page of `table` rows for `url`"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        pattern = re.compile(rf'FROM [`"]?{table}[`"]?\s.*ORDER BY', re.S)
+        for query in queries:
+            if query['sql'].startswith('SELECT') and pattern.search(query['sql']):
+                return query['sql']
+        self.fail(f'No ordered query on {table} for {url}')
+
+    def assertUsesIndex(self, url, table, ordered=True):
+        """`ordered`: the index also gives the page order, so nothing is sorted"""
+        sql = self.page_query(url, table)
+        scanned, sorts = query_plan(sql)
+        self.assertNotIn(table, scanned, f'{url} scans all of {table}:\n{sql}')
+        if ordered:
+            self.assertFalse(sorts, f'{url} sorts {table} rows instead of reading them in order:\n{sql}')
+
+    def test_post_list(self):
+        self.assertUsesIndex('/api/posts/', 'api_post')
+
+    def test_user_posts(self):
+        self.assertUsesIndex('/api/posts/user/bob/', 'api_post')
+
+    def test_personal_feed(self):
+        # Posts of several authors are merged, so they have to be sorted
+        self.assertUsesIndex('/api/feed/', 'api_post', ordered=False)
+
+    def test_global_feed(self):
+        self.assertUsesIndex('/api/feed/global/', 'api_post')
+
+    def test_comment_list(self):
+        self.assertUsesIndex(f'/api/posts/{self.post.pk}/comments/', 'api_comment')
+
+    def test_deleted_posts_hidden(self):
+        """The default manager skips soft-deleted rows"""
+        self.assertEqual(Post.objects.filter(user=self.bob).count(), 24)
+        self.assertEqual(Post.all_objects.filter(user=self.bob).count(), 30)
+
+
+# A request for each URL, checked against its view's query_budget with a
+# cold cache (the worst case) and the rows from QueryBudgetTests.setUpTestData:
+# route -> [(method, url, body)]. {names} in urls and bodies are filled in
+# from QueryBudgetTests.ids. Every route in api/urls.py and accounts/urls.py
+# needs an entry.
+BUDGET_REQUESTS = {
+    'api/': [('get', '/api/', None)],
+    'api/batch/': [('post', '/api/batch/', {'requests': [
+        {'id': 'me', 'url': '/api/accounts/me/'},
+        {'id': 'notifications', 'url': '/api/notifications/'},
+    ]})],
+    'api/posts/': [
+        ('get', '/api/posts/', None),
+        ('post', '/api/posts/', {'content': 'New post', 'user_id': '{alice}'}),
+    ],
+    'api/posts/batch/': [('post', '/api/posts/batch/', {'posts': [{'content': f'Batch {i}'} for i in range(10)]})],
+    'api/posts/<int:pk>/': [('get', '/api/posts/{post}/', None)],
+    'api/posts/user/<str:username>/': [('get', '/api/posts/user/bob/', None)],
+    'api/^follow/follow/$': [('post', '/api/follow/follow/', {'username': 'carol'})],
+    'api/^follow/unfollow/$': [('post', '/api/follow/unfollow/', {'username': 'bob'})],
+    'api/^follow/followers/$': [('get', '/api/follow/followers/', None)],
+    'api/^follow/following/$': [('get', '/api/follow/following/', None)],
+    'api/users/<str:username>/': [('get', '/api/users/bob/', None)],
+    'api/feed/': [('get', '/api/feed/', None)],
+    'api/feed/global/': [('get', '/api/feed/global/', None)],
+    'api/feed/popular/': [('get', '/api/feed/popular/', None)],
+    'api/posts/<int:post_id>/likes/': [
+        ('get', '/api/posts/{post}/likes/', None),
+        ('post', '/api/posts/{post}/likes/', None),
+    ],
+    'api/posts/<int:post_id>/unlike/': [('delete', '/api/posts/{liked_post}/unlike/', None)],
+    'api/posts/<int:post_id>/comments/': [
+        ('get', '/api/posts/{post}/comments/', None),
+        ('post', '/api/posts/{post}/comments/', {'content': 'New comment', 'post_id': '{post}'}),
+    ],
+    'api/comments/<int:pk>/': [('get', '/api/comments/{own_comment}/', None)],
+    'api/comments/<int:comment_id>/reply/': [('post', '/api/comments/{comment}/reply/', {'content': 'Reply', 'post_id': '{post}'})],
+    # Uploads: only the requests that don't touch image storage
+    'api/upload/image/': [('post', '/api/upload/image/', None)],
+    'api/upload/image/jobs/<uuid:job_id>/': [('get', '/api/upload/image/jobs/{missing_uuid}/', None)],
+    'api/upload/image/chunked/': [('post', '/api/upload/image/chunked/', {'size': 0})],
+    'api/upload/image/chunked/<uuid:upload_id>/': [('get', '/api/upload/image/chunked/{missing_uuid}/', None)],
+    'api/upload/image/chunked/<uuid:upload_id>/finalize/': [
+        ('post', '/api/upload/image/chunked/{missing_uuid}/finalize/', None),
+    ],
+    'api/delete/image/<str:public_id>/': [('delete', '/api/delete/image/{others_image}/', None)],
+    'api/notifications/': [('get', '/api/notifications/', None)],
+    'api/notifications/<int:pk>/read/': [('patch', '/api/notifications/{notification}/read/', None)],
+    'api/health/': [('get', '/api/health/', None)],
+    'api/metrics/': [('get', '/api/metrics/', None)],
+    'api/accounts/users/': [('get', '/api/accounts/users/', None)],
+    'api/accounts/register/': [('post', '/api/accounts/register/', {
+        'username': 'dave', 'email': 'dave@example.com', 'password': 'Pw-12345678', 'password2': 'Pw-12345678',
+    })],
+    'api/accounts/login/': [('post', '/api/accounts/login/', {'username': 'alice', 'password': 'pw12345678'})],
+    'api/accounts/token/refresh/': [('post', '/api/accounts/token/refresh/', {'refresh': '{refresh}'})],
+    'api/accounts/me/': [('get', '/api/accounts/me/', None)],
+    'api/accounts/users/<str:username>/': [('get', '/api/accounts/users/bob/', None)],
+}
+
+def routes(patterns, prefix):
+    """Every route under `patterns`, as 'prefix/route'"""
+    for entry in patterns:
+        if isinstance(entry, URLResolver):
+            yield from routes(entry.url_patterns, prefix + str(entry.pattern))
+        elif 'format>' not in str(entry.pattern) and str(entry.pattern) != '^$':
+            # Skips the router's .json suffixes and its root, which /api/ shadows
+            yield prefix + str(entry.pattern)
+
+
+@quiet_query_budget  # The views' budgets are checked here
+class QueryBudgetTests(AliceAndBobMixin, TestCase):
+    """Every endpoint stays within its query budget and has no new N+1"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pw12345678')
+        for name in ('erin', 'frank'):
+            User.objects.create_user(name, f'{name}@example.com', 'pw12345678')
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        Follow.objects.create(follower=cls.bob, following=cls.alice)
+        Follow.objects.create(follower=cls.carol, following=cls.alice)
+
+        # Enough rows on every page for an N+1 to show
+        for i in range(10):
+            post = Post.objects.create(user=cls.bob, content=f'post {i}')
+            Post.objects.create(user=cls.alice, content=f'own post {i}')
+            Like.objects.create(user=cls.carol, post=post)
+            comment = Comment.objects.create(user=cls.carol, post=post, content=f'comment {i}')
+            Comment.objects.create(user=cls.bob, post=post, parent=comment, content=f'reply {i}')
+        cls.post = Post.objects.filter(user=cls.bob).first()
+        cls.own_post = Post.objects.filter(user=cls.alice).first()
+        cls.liked_post = Post.objects.filter(user=cls.bob).last()
+        Like.objects.create(user=cls.alice, post=cls.liked_post)
+        for user in (cls.bob, cls.carol):
+            Comment.objects.create(user=user, post=cls.own_post, content='on your post')
+            Like.objects.create(user=user, post=cls.own_post)
+        for i in range(5):
+            comment = Comment.objects.create(user=cls.carol, post=cls.post, content=f'thread {i}')
+            Comment.objects.create(user=cls.bob, post=cls.post, parent=comment, content=f'thread reply {i}')
+        cls.comment = Comment.objects.filter(post=cls.post, parent=None).first()
+        cls.own_comment = Comment.objects.create(user=cls.alice, post=cls.post, content='my comment')
+        cls.notification = Notification.objects.filter(user=cls.alice).first()
+        cls.others_image = ImageAsset.objects.create(owner=cls.bob, key='b' * 64, ref_count=1)
+        cls.others_image.uploaders.add(cls.bob)
+
+    def setUp(self):
+        super().setUp()
+        self.ids = {
+            'post': self.post.pk, 'own_post': self.own_post.pk, 'liked_post': self.liked_post.pk,
+            'alice': self.alice.pk, 'comment': self.comment.pk, 'own_comment': self.own_comment.pk,
+            'notification': self.notification.pk,
+            'others_image': self.others_image.key, 'missing_uuid': uuid.uuid4(),
+            'refresh': str(RefreshToken.for_user(self.alice)),
+        }
+
+    def run_request(self, method, url, body):
+        """Response and query stats; whatever the request wrote is rolled back"""
+        cache.clear()
+        if isinstance(body, dict):
+            body = {key: value.format(**self.ids) if isinstance(value, str) else value for key, value in body.items()}
+        with transaction.atomic():
+            with count_queries() as stats:
+                response = getattr(self.client, method)(url.format(**self.ids), body, format='json')
+            transaction.set_rollback(True)
+        return response, stats
+
+    def test_every_url_has_a_budget(self):
+        from accounts.urls import urlpatterns as account_urls
+        from api.urls import urlpatterns as api_urls
+
+        urls = set(routes(api_urls, 'api/')) | set(routes(account_urls, 'api/accounts/'))
+        self.assertEqual(urls - set(BUDGET_REQUESTS), set(), 'Add these routes to BUDGET_REQUESTS')
+        self.assertEqual(set(BUDGET_REQUESTS) - urls, set(), 'These routes are gone - remove them from BUDGET_REQUESTS')
+
+        undeclared = {
+            route for route, requests in BUDGET_REQUESTS.items()
+            if declared(resolve(requests[0][1].format(**self.ids)).func, 'query_budget', DEFAULT) is DEFAULT
+        }
+        self.assertEqual(undeclared, set(), 'Give these views a query_budget')
+
+    def test_budgets(self):
+        for route, requests in BUDGET_REQUESTS.items():
+            for method, url, body in requests:
+                with self.subTest(route=route, method=method):
+                    view = resolve(url.format(**self.ids)).func
+                    response, stats = self.run_request(method, url, body)
+                    self.assertLess(response.status_code, 500)
+                    budget = budget_for(view)
+                    if budget is not None:
+                        self.assertLessEqual(stats.count, budget, f'{method.upper()} {url} ran {stats.count} queries')
+                    if not known_n_plus_one(view):
+                        self.assertEqual(stats.repeated(5), {}, f'N+1 on {method.upper()} {url}')
+
+    def test_admin_changelists(self):
+        """The admin lists load authors, posts and like counts with the rows"""
+        # No collectstatic in tests - serve admin assets without the manifest
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+        self.enterContext(override_settings(STORAGES=storages))
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw12345678')
+        self.client.force_login(admin)
+        for url in ['/admin/api/post/', '/admin/api/comment/', '/admin/api/like/', '/admin/api/follow/']:
+            with self.subTest(url=url):
+                with count_queries() as stats:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(stats.repeated(5), {}, f'N+1 on {url}')
+
+
+class QueryBudgetMiddlewareTests(AliceAndBobMixin, TestCase):
+    """What QueryBudgetMiddleware reports"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(5):
+            Post.objects.create(user=cls.alice, content=f'post {i}')
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        response = self.client.get('/api/notifications/')
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertGreaterEqual(float(response['X-DB-Time-Ms']), 0)
+        self.assertEqual(response['X-DB-Repeated'], '0')
+
+    def test_no_headers_without_debug(self):
+        response = self.client.get('/api/notifications/')
+        self.assertNotIn('X-DB-Queries', response)
+
+    def test_over_budget_warns(self):
+        with mock.patch.object(NotificationListView, 'query_budget', 1), \
+                self.assertLogs('api.query_budget', 'WARNING') as logs:
+            response = self.client.get('/api/notifications/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('GET /api/notifications/ ran', logs.output[0])
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_budget_fails(self):
+        with mock.patch.object(NotificationListView, 'query_budget', 1), self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/notifications/')
+
+    @override_settings(QUERY_BUDGET=1, QUERY_BUDGET_STRICT=True)
+    def test_view_budget(self):
+        """A view's own query_budget wins; None means no limit; QUERY_BUDGET for the rest"""
+        self.assertIsNone(budget_for(BatchRequestView.as_view()))
+        self.assertEqual(budget_for(health_check), 3)
+        self.assertEqual(budget_for(lambda request: None), 1)
+        response = self.client.post('/api/batch/', {'requests': [{'id': 'me', 'url': '/api/accounts/me/'}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_n_plus_one_warns(self):
+        # PostSerializer counts likes per post - a known N+1, so quiet unless that's taken off
+        with self.assertNoLogs('api.query_budget', 'WARNING'):
+            self.client.get('/api/posts/')
+        with mock.patch.object(PostListCreateView, 'known_n_plus_one', False), \
+                self.assertLogs('api.query_budget', 'WARNING') as logs:
+            self.client.get('/api/posts/')
+        self.assertTrue(any('Possible N+1 on GET /api/posts/' in line for line in logs.output))
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape('SELECT * FROM api_post WHERE id IN (%s, %s, %s)\n  LIMIT 21'),
+            query_shape('SELECT * FROM api_post WHERE id IN (%s) LIMIT 10'),
+        )
+        self.assertNotEqual(query_shape('SELECT * FROM api_post'), query_shape('SELECT * FROM api_like'))
+
+
+@quiet_query_budget
+class MetricsTests(AliceAndBobMixin, TestCase):
+    """GET /api/metrics/ reports what requests did"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = Post.objects.create(user=cls.alice, content='hello')
+
+    @override_settings(DEBUG=True)
+    def test_request_metrics(self):
+        self.client.get(f'/api/posts/{self.post.pk}/')
+        text = self.client.get('/api/metrics/').content.decode()
+
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="api/posts/<int:pk>/",status="200"}', text)
+        self.assertIn('db_queries_per_request_count{route="api/posts/<int:pk>/"}', text)
+        self.assertIn('cache_lookups_total{cache="post",result="miss"}', text)
+        self.assertIn('serializer_seconds_count{serializer="PostSerializer"}', text)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        response = self.client.get('/api/metrics/', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_no_token_in_production(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+@quiet_query_budget
+class SlowQueryLogTests(AliceAndBobMixin, TestCase):
+    """Slow queries are logged with their request and plan, and summarized"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Post.objects.create(user=cls.alice, content='a post about cats')
+
+    def setUp(self):
+        super().setUp()
+        slow_queries._explained.clear()
+        self.log = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'slow.log')
+
+    def test_log_and_report(self):
+        self.enterContext(override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_LOG=self.log))  # Every query is "slow"
+        self.client.get('/api/feed/?search=cats&date_from=2024-01-01T00:00:00Z')
+        slow_queries.drain()
+
+        # This process's file - SLOW_QUERY_LOG with the pid added
+        own_log = slow_queries.process_log_path()
+        self.assertEqual(os.path.basename(own_log), f'slow.{os.getpid()}.log')
+        with open(own_log) as f:
+            entries = [json.loads(line) for line in f]
+        feed = [e for e in entries if e['view'] == 'api.views.FeedView' and 'LIKE' in e['sql']]
+        self.assertTrue(feed)
+        self.assertEqual(feed[0]['route'], 'api/feed/')
+        self.assertIn('search=cats', feed[0]['path'])
+        self.assertTrue(any(e['plan'] for e in feed))
+
+        # The report reads every process's file, rotated copies included
+        folder = os.path.dirname(self.log)
+        for name in ['slow.99999.log.1', 'other.1.log']:
+            shutil.copy(own_log, os.path.join(folder, name))
+        self.assertEqual(
+            sorted(os.path.basename(name) for name in slow_queries.log_files()),
+            sorted(['slow.99999.log.1', f'slow.{os.getpid()}.log'])
+        )
+
+        out = StringIO()
+        call_command('slow_query_report', top=100, stdout=out)
+        self.assertIn(f"{2 * len(entries)} slow queries", out.getvalue())
+        self.assertIn(feed[0]['fingerprint'], out.getvalue())
+        self.assertIn('plan:', out.getvalue())
+
+    def test_fast_queries_not_logged(self):
+        with override_settings(SLOW_QUERY_MS=60_000, SLOW_QUERY_LOG=self.log):
+            self.client.get('/api/feed/')
+            slow_queries.drain()
+            self.assertEqual(slow_queries.log_files(), [])
+
+
+@quiet_query_budget
+class PopularFeedTests(AliceAndBobMixin, TestCase):
+    """GET /api/feed/popular/: keyset pages in score order, bad input is a 400"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(5):
+            post = Post.objects.create(user=cls.alice, content=f'post {i}')
+            for _ in range(i):
+                Comment.objects.create(user=cls.alice, post=post, content='comment')
+        refresh_scores()
+
+    def test_pages_follow_score(self):
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get('/api/feed/popular/', params).json()
+            seen += [post['id'] for post in data['posts']]
+            cursor = data['pagination']['next_cursor']
+            if cursor is None:
+                break
+
+        expected = list(Post.objects.order_by('-popularity_score', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_clamped(self):
+        for page_size, expected in [('0', 1), ('-3', 1), ('1000', 5)]:
+            with self.subTest(page_size=page_size):
+                response = self.client.get('/api/feed/popular/', {'page_size': page_size})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['posts']), expected)
+                self.assertEqual(response.json()['pagination']['page_size'], max(1, min(int(page_size), 100)))
+
+    def test_bad_input(self):
+        for params in [
+            {'page_size': 'abc'},
+            {'cursor': 'not-a-cursor'},
+            {'cursor': encode_cursor([[1], 1])},
+            {'cursor': encode_cursor(['high', 1])},
+            {'cursor': encode_cursor([1.5])},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/feed/popular/', params).status_code, 400)
+
+
+@quiet_query_budget
+class RankedFeedTests(AliceAndBobMixin, TestCase):
+    """GET /api/feed/?rank=relevance (api/ranking.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pw12345678')
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        Follow.objects.create(follower=cls.alice, following=cls.carol)
+
+        # Alice often interacts with Bob, never with Carol
+        old = Post.objects.create(user=cls.bob, content='old bob post')
+        Like.objects.create(user=cls.alice, post=old)
+        Comment.objects.create(user=cls.alice, post=old, content='nice')
+        cls.bob_post = Post.objects.create(user=cls.bob, content='bob post')
+        cls.carol_post = Post.objects.create(user=cls.carol, content='carol post')  # A little newer
+        for i in range(6):
+            Post.objects.create(user=cls.carol, content=f'filler {i}')
+
+    def feed(self, **params):
+        return self.client.get('/api/feed/', {'rank': 'relevance', **params}).json()
+
+    def test_affinity_and_engagement(self):
+        ranked = rank_posts(self.alice, Post.objects.all())
+        # About the same age, but Alice interacts with Bob
+        self.assertLess(ranked.index(self.bob_post.pk), ranked.index(self.carol_post.pk))
+
+        # Engagement lifts Carol's post above Bob's
+        for user in (self.bob, self.alice):
+            for _ in range(3):
+                Comment.objects.create(user=user, post=self.carol_post, content='wow')
+        ranked = rank_posts(self.alice, Post.objects.all())
+        self.assertLess(ranked.index(self.carol_post.pk), ranked.index(self.bob_post.pk))
+
+    def test_pages_cover_the_feed_once(self):
+        first = self.feed(page_size=4)
+        self.assertEqual(first['feed_info']['rank'], 'relevance')
+        ids = [p['id'] for p in first['posts']]
+        for page in range(2, first['pagination']['total_pages'] + 1):
+            ids += [p['id'] for p in self.feed(page_size=4, page=page)['posts']]
+        self.assertEqual(sorted(ids), sorted(Post.objects.values_list('id', flat=True)))
+
+    def test_ranking_is_cached_while_scrolling(self):
+        before = [p['id'] for p in self.feed(page_size=20)['posts']]
+        Post.objects.create(user=self.bob, content='brand new')
+        self.assertEqual([p['id'] for p in self.feed(page_size=20)['posts']], before)
+
+        cache.clear()  # The short TTL passed
+        self.assertEqual(len(self.feed(page_size=20)['posts']), len(before) + 1)
+
+    def test_filters_apply(self):
+        ids = {p['id'] for p in self.feed(user='bob', page_size=20)['posts']}
+        self.assertEqual(ids, set(Post.objects.filter(user=self.bob).values_list('id', flat=True)))
+
+
+@quiet_query_budget
+class VersionedCacheTests(AliceAndBobMixin, TestCase):
+    """Cached posts / profiles (api/cache.py) are dropped by bumping their version"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = Post.objects.create(user=cls.alice, content='hello')
+
+    def test_cached_until_changed(self):
+        self.assertEqual(get_post_data(self.post.pk)['content'], 'hello')
+        with self.assertNumQueries(0):
+            get_post_data(self.post.pk)
+
+        Post.objects.filter(pk=self.post.pk).update(content='sneaky')  # No signal, no bump
+        self.assertEqual(get_post_data(self.post.pk)['content'], 'hello')
+
+        self.post.content = 'edited'
+        self.post.save()
+        self.assertEqual(get_post_data(self.post.pk)['content'], 'edited')
+
+    def test_likes_and_comments_bump_the_post(self):
+        get_post_data(self.post.pk)
+        Like.objects.create(user=self.bob, post=self.post)
+        self.assertEqual(get_post_data(self.post.pk)['likes_count'], 1)
+        Comment.objects.create(user=self.bob, post=self.post, content='hi')
+        self.assertEqual(get_post_data(self.post.pk)['comments_count'], 1)
+
+    @mock.patch('api.signals.refresh_in_background', signals.refresh_authored_posts)
+    def test_rename_refreshes_posts_and_comments(self):
+        Comment.objects.create(user=self.bob, post=self.post, content='hi')
+        data = get_post_data(self.post.pk)
+        self.assertEqual(data['user']['username'], 'alice')
+        self.assertEqual(data['recent_comments'][0]['user']['username'], 'bob')
+
+        for user, name in [(self.alice, 'alice2'), (self.bob, 'bob2')]:
+            with self.captureOnCommitCallbacks(execute=True):
+                user.username = name
+                user.save()
+        data = get_post_data(self.post.pk)
+        self.assertEqual(data['user']['username'], 'alice2')
+        self.assertEqual(data['recent_comments'][0]['user']['username'], 'bob2')
+        self.assertIsNone(get_user_data('alice'))
+        self.assertEqual(get_user_data('alice2')['id'], self.alice.pk)
+
+    def test_rename_refresh_runs_after_commit(self):
+        version = get_version('post', self.post.pk)
+        with mock.patch('api.signals.refresh_in_background') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(1):  # Just the UPDATE - no post lookups in the request
+                    self.alice.username = 'alice2'
+                    self.alice.save()
+                self.assertEqual(get_version('post', self.post.pk), version)
+        refresh.assert_called_once_with(self.alice.pk)
+
+    def test_other_user_saves_keep_posts(self):
+        version = get_version('post', self.post.pk)
+        alice = User.objects.get(pk=self.alice.pk)
+        alice.bio = 'new bio'
+        alice.save()
+        self.assertEqual(get_version('post', self.post.pk), version)
+
+
+@quiet_query_budget
+class AuthUserCacheTests(AliceAndBobMixin, TestCase):
+    """CachedJWTAuthentication (accounts/authentication.py) serves the user from the cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()  # Signs in with a real token instead
+        token = RefreshToken.for_user(self.alice).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def user_lookups(self):
+        """Queries on the users table during one request to /api/accounts/me/"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/accounts/me/').status_code, 200)
+        table = User._meta.db_table
+        return sum(1 for q in queries if q['sql'].lstrip().startswith('SELECT') and f'FROM "{table}"' in q['sql'])
+
+    def test_second_request_skips_the_lookup(self):
+        self.assertEqual(self.user_lookups(), 1)
+        self.assertEqual(self.user_lookups(), 0)
+
+    def test_deactivation_logs_out(self):
+        self.client.get('/api/accounts/me/')
+        alice = User.objects.get(pk=self.alice.pk)
+        alice.is_active = False
+        alice.save()
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 401)
+
+    def test_update_needs_explicit_invalidation(self):
+        self.client.get('/api/accounts/me/')
+        User.objects.filter(pk=self.alice.pk).update(is_active=False)  # No signal
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 200)
+
+        invalidate_cached_user(self.alice.pk)
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 401)
+
+
+class SingleFlightTests(TestCase):
+    """single_flight() (api/cache.py): one rebuild at a time, stale copies meanwhile"""
+
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self, value='fresh'):
+        def build():
+            self.builds += 1
+            return value
+        return build
+
+    def put(self, value, expires_in, delta=0.0):
+        """A cached entry whose soft TTL ends `expires_in` seconds from now"""
+        cache.set('k', {'value': value, 'expires': time.time() + expires_in, 'delta': delta}, 60)
+
+    def test_miss_builds_once(self):
+        self.assertEqual(single_flight('k', self.build(), 60), 'fresh')
+        self.assertEqual(single_flight('k', self.build(), 60), 'fresh')
+        self.assertEqual(self.builds, 1)
+
+    def test_none_is_not_cached(self):
+        self.assertIsNone(single_flight('k', self.build(None), 60))
+        self.assertIsNone(cache.get('k'))
+
+    def test_stale_entry_is_rebuilt(self):
+        self.put('old', expires_in=-1)
+        self.assertEqual(single_flight('k', self.build(), 60), 'fresh')
+        self.assertEqual(self.builds, 1)
+
+    def test_stale_entry_served_while_another_worker_rebuilds(self):
+        self.put('old', expires_in=-1)
+        acquire_lease('k', 10)
+        self.assertEqual(single_flight('k', self.build(), 60), 'old')
+        self.assertEqual(self.builds, 0)
+
+    def test_early_refresh_near_expiry(self):
+        # Slow to build and a second from expiry - a large -log(random) refreshes early
+        self.put('old', expires_in=1, delta=0.5)
+        with mock.patch('api.cache.random.random', return_value=0.001):
+            self.assertEqual(single_flight('k', self.build(), 60), 'fresh')
+        self.put('old', expires_in=1, delta=0.5)
+        with mock.patch('api.cache.random.random', return_value=0.999):
+            self.assertEqual(single_flight('k', self.build(), 60), 'old')
+        self.assertEqual(self.builds, 1)
+
+    def test_miss_waits_for_the_lease_holder(self):
+        acquire_lease('k', 10)
+
+        def other_worker():
+            time.sleep(0.2)
+            self.put('theirs', expires_in=60)
+            cache.delete('k:lease')
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        self.assertEqual(single_flight('k', self.build(), 60), 'theirs')
+        thread.join()
+        self.assertEqual(self.builds, 0)
+
+    def test_miss_builds_itself_when_the_lease_holder_gives_up(self):
+        acquire_lease('k', 10)
+        self.assertEqual(single_flight('k', self.build(), 60, lease_timeout=0.2), 'fresh')
+        self.assertEqual(self.builds, 1)
+
+
+@quiet_query_budget
+@override_settings(GLOBAL_FEED_BUFFER_SIZE=3)
+class GlobalFeedBufferTests(AliceAndBobMixin, TestCase):
+    """GET /api/feed/global/ served from the ring buffer (api/feed_buffer.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.posts = [Post.objects.create(user=cls.alice, content=f'post {i}') for i in range(7)]
+
+    def feed(self, status_code=200, **params):
+        response = self.client.get('/api/feed/global/', params)
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json()
+
+    def newest_first(self):
+        return list(Post.objects.filter(is_deleted=False).order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_pages_run_past_the_buffer(self):
+        ids = []
+        for page in range(1, 5):
+            ids += [p['id'] for p in self.feed(page=page, page_size=2)['posts']]
+        self.assertEqual(ids, self.newest_first())
+
+    def test_cursor_walk(self):
+        data = self.feed(page_size=2)
+        ids = [p['id'] for p in data['posts']]
+        while data['pagination']['next_cursor']:
+            data = self.feed(page_size=2, cursor=data['pagination']['next_cursor'])
+            ids += [p['id'] for p in data['posts']]
+        self.assertEqual(ids, self.newest_first())
+
+    def test_buffered_page_does_not_query_posts(self):
+        self.feed(page_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            self.feed(page_size=3)
+        self.assertFalse([q['sql'] for q in queries if 'FROM "api_post"' in q['sql']])
+
+    @mock.patch('api.signals.refresh_in_background', signals.refresh_authored_posts)
+    def test_signals_keep_the_buffer_current(self):
+        self.feed()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(user=self.alice, content='newest')
+        self.assertEqual(self.feed()['posts'][0]['id'], post.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.alice, post=post)
+        self.assertEqual(self.feed()['posts'][0]['likes_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.username = 'alice2'
+            self.alice.save()
+        self.assertEqual({p['user']['username'] for p in self.feed()['posts']}, {'alice2'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.is_deleted = True
+            post.save()
+        self.assertEqual([p['id'] for p in self.feed()['posts']], self.newest_first())
+        self.assertNotIn(post.pk, self.newest_first())
+
+    def test_post_created_during_a_rebuild(self):
+        build = feed_buffer._build
+        created = []
+
+        def build_then_post():
+            value = build()
+            if not created:
+                # A post commits after the rebuild's query, before the buffer is stored
+                with self.captureOnCommitCallbacks(execute=True):
+                    created.append(Post.objects.create(user=self.alice, content='newest'))
+            return value
+
+        with mock.patch('api.feed_buffer._build', build_then_post):
+            self.assertEqual(self.feed()['posts'][0]['id'], created[0].pk)
+        self.assertEqual([p['id'] for p in self.feed()['posts']], self.newest_first())
+
+    def test_busy_writer_is_waited_for(self):
+        self.feed()
+        lease = f'{feed_buffer.BUFFER_KEY}:write'
+        token = acquire_lease(lease, 5)
+        timer = threading.Timer(0.1, release_lease, [lease, token])
+        timer.start()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(user=self.alice, content='newest')
+        timer.join()
+
+        # Added to the cached buffer, not dropped with it
+        entry = cache.get(feed_buffer.BUFFER_KEY)
+        self.assertEqual(entry['value']['entries'][0]['key'][1], post.pk)
+        self.assertEqual(self.feed()['posts'][0]['id'], post.pk)
+
+    def test_page_size(self):
+        for params in [{'page_size': '0'}, {'page_size': '-2'}, {'page_size': 'abc'}, {'page': 'abc'},
+                       {'page_size': '0', 'search': 'post'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.feed(400, **params), {'error': 'Invalid page number.'})
+        self.assertEqual(len(self.feed(page_size=1000)['posts']), 7)
+
+    def test_cursor(self):
+        for cursor in ['not-a-cursor', encode_cursor([1, 2]), encode_cursor(['yesterday', 1]),
+                       encode_cursor(['2024-01-01T00:00:00', 1])]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.feed(400, cursor=cursor), {'error': 'Invalid cursor.'})
+
+        # Any UTC offset works - the cursor is compared in the buffer's format
+        third = Post.objects.get(pk=self.newest_first()[2])
+        created_at = third.created_at.astimezone(timezone.get_fixed_timezone(120)).isoformat()
+        ids = [p['id'] for p in self.feed(cursor=encode_cursor([created_at, third.pk]))['posts']]
+        self.assertEqual(ids, self.newest_first()[3:])
+
+
+@quiet_query_budget
+class ConditionalGetTests(AliceAndBobMixin, TestCase):
+    """ETag / If-None-Match (api/conditional.py): 304 until something changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        cls.post = Post.objects.create(user=cls.bob, content='hello')
+
+    def etag(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Authorization', response['Vary'])
+        return response['ETag']
+
+    def assertNotModified(self, url, etag, **params):
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def assertChanges(self, url, change, **params):
+        """304 before `change`, a new ETag after it"""
+        etag = self.etag(url, **params)
+        self.assertNotModified(url, etag, **params)
+        change()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_detail(self):
+        url = f'/api/posts/{self.post.pk}/'
+        self.assertChanges(url, lambda: Like.objects.create(user=self.bob, post=self.post))
+        self.assertChanges(url, lambda: Comment.objects.create(user=self.bob, post=self.post, content='hi'))
+        self.assertChanges(url, lambda: Post.objects.get(pk=self.post.pk).save())
+
+    def test_etag_is_per_viewer(self):
+        url = f'/api/posts/{self.post.pk}/'
+        etag = self.etag(url)
+        self.client.force_authenticate(self.bob)
+        self.assertNotEqual(self.etag(url), etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_feeds(self):
+        self.assertChanges('/api/feed/', lambda: Post.objects.create(user=self.bob, content='new'))
+        self.assertChanges('/api/feed/', lambda: Like.objects.create(user=self.alice, post=self.post))
+
+        def post_on_commit():
+            # The global feed buffer is updated on commit
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.create(user=self.bob, content='newer')
+        self.assertChanges('/api/feed/global/', post_on_commit)
+
+    def test_profile(self):
+        self.assertChanges('/api/users/bob/', lambda: Follow.objects.filter(follower=self.alice).delete())
+        self.assertChanges('/api/accounts/me/', lambda: Post.objects.create(user=self.alice, content='mine'))
+
+    def test_notifications(self):
+        self.assertChanges('/api/notifications/', lambda: Follow.objects.create(follower=self.bob, following=self.alice))
+        etag = self.etag('/api/notifications/')
+        self.assertEqual(
+            self.client.get('/api/notifications/', {'mark_read': 'true'}, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+
+@quiet_query_budget
+class SchemaTests(TestCase):
+    """OpenAPI schema (api/schema.py): the pre-built static file when there is one"""
+
+    def setUp(self):
+        schema._urls.clear()
+        self.addCleanup(schema._urls.clear)
+        self.enterContext(GENERATOR_STATS.silence())  # Schema warnings aren't what's tested here
+
+    def test_generated_once_without_a_built_file(self):
+        self.assertIsNone(schema.static_schema_url('json'))
+        response = self.client.get('/api/schema/', {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/api/feed/', json.loads(response.content)['paths'])
+        self.assertIs(schema.generate_schema(), schema.generate_schema())
+
+    def test_file_published_after_start(self):
+        storage = mock.Mock()
+        storage.exists.return_value = False
+        storage.url.return_value = '/static/api/openapi.0123abcd.json'
+        with mock.patch('api.schema.staticfiles_storage', storage):
+            self.assertIsNone(schema.static_schema_url('json'))
+            storage.exists.return_value = True  # collectstatic ran
+            self.assertEqual(schema.static_schema_url('json'), '/static/api/openapi.0123abcd.json')
+            self.assertEqual(schema.static_schema_url('json'), '/static/api/openapi.0123abcd.json')
+        self.assertEqual(storage.exists.call_count, 2)  # Found once, then remembered
+
+    def test_redirects_to_the_built_file(self):
+        built = {'json': '/static/api/openapi.0123abcd.json', 'yaml': '/static/api/openapi.0123abcd.yaml'}
+        with mock.patch('api.schema.static_schema_url', side_effect=built.get):
+            response = self.client.get('/api/schema/', {'format': 'json'})
+            self.assertRedirects(response, built['json'], fetch_redirect_response=False)
+            response = self.client.get('/api/schema/')
+            self.assertRedirects(response, built['yaml'], fetch_redirect_response=False)
+            self.assertContains(self.client.get('/api/docs/'), built['json'])
+
+            # Translated schemas are still generated
+            self.assertEqual(self.client.get('/api/schema/', {'lang': 'de'}).status_code, 200)
+
+
+def image_bytes(size=(2000, 1000), color=(200, 40, 40), format='PNG', stripe='left'):
+    """An encoded test image: a solid block with a light stripe (so dHash has something to see)"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', size, color)
+    left = 0 if stripe == 'left' else size[0] * 2 // 3
+    ImageDraw.Draw(image).rectangle([left, 0, left + size[0] // 3, size[1]], fill=(250, 250, 250))
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class TempImageStorageMixin:
+    """Save image variants to a temporary directory instead of the real 'images' storage"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        storages = {**settings.STORAGES, 'images': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': self.media, 'base_url': '/media/images/'},
+        }}
+        self.enterContext(override_settings(STORAGES=storages, MEDIA_ROOT=self.media))
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        )
+
+
+@quiet_query_budget
+class ImageAssetTests(TempImageStorageMixin, AliceAndBobMixin, TestCase):
+    """WebP variants and content-hash dedup with reference counts (api/images.py)"""
+
+    def ingest(self, user, data):
+        return ingest(user, content_hash(data), data)
+
+    def test_webp_variants(self):
+        asset, deduplicated = self.ingest(self.alice, image_bytes())
+        self.assertFalse(deduplicated)
+        self.assertEqual(
+            {name: (v['width'], v['height']) for name, v in asset.variants.items()},
+            {'thumb': (150, 75), 'medium': (600, 300), 'full': (1200, 600)},
+        )
+        for name in ('thumb', 'medium', 'full'):
+            with open(os.path.join(self.media, asset.variants[name]['path']), 'rb') as f:
+                head = f.read(12)
+            self.assertEqual((head[:4], head[8:12]), (b'RIFF', b'WEBP'))
+        self.assertIn('600w', asset.srcset())
+
+    def test_small_images_are_not_upscaled(self):
+        asset, _ = self.ingest(self.alice, image_bytes(size=(100, 50)))
+        self.assertEqual({(v['width'], v['height']) for v in asset.variants.values()}, {(100, 50)})
+
+    def test_same_bytes_share_an_asset(self):
+        data = image_bytes()
+        asset, _ = self.ingest(self.alice, data)
+        again, deduplicated = self.ingest(self.bob, data)
+        self.assertTrue(deduplicated)
+        self.assertEqual(again.pk, asset.pk)
+        self.ingest(self.bob, data)  # One reference per uploader
+        asset.refresh_from_db()
+        self.assertEqual(asset.ref_count, 2)
+        self.assertEqual(len(self.stored_files()), 3)
+
+    def test_references_and_deletion(self):
+        asset, _ = self.ingest(self.alice, image_bytes())
+        post = Post.objects.create(user=self.alice, content='pic', image_asset=asset)
+        asset.refresh_from_db()
+        self.assertEqual(asset.ref_count, 2)
+
+        post.image_asset = None
+        post.save()
+        asset.refresh_from_db()
+        self.assertEqual(asset.ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(release_reference(asset.pk))
+        self.assertFalse(ImageAsset.objects.filter(pk=asset.pk).exists())
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(IMAGE_PERCEPTUAL_DEDUP=True)
+    def test_perceptual_dedup(self):
+        asset, _ = self.ingest(self.alice, image_bytes())
+        resaved, deduplicated = self.ingest(self.bob, image_bytes(size=(1000, 500), format='JPEG'))
+        self.assertTrue(deduplicated)
+        self.assertEqual(resaved.pk, asset.pk)
+
+        _, deduplicated = self.ingest(self.bob, image_bytes(stripe='right'))
+        self.assertFalse(deduplicated)
+
+
+@quiet_query_budget
+class ChunkedUploadTests(TempImageStorageMixin, AliceAndBobMixin, TestCase):
+    """Resumable uploads (api/chunked_upload.py): offsets, resume and finalize"""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(
+            CHUNKED_UPLOAD_DIR=os.path.join(self.media, 'uploads'), IMAGE_JOBS_EAGER=True
+        ))
+        self.data = image_bytes()
+
+    def start(self, size=None):
+        response = self.client.post('/api/upload/image/chunked/', {'size': size or len(self.data)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return f"/api/upload/image/chunked/{response.json()['upload_id']}/"
+
+    def put(self, url, offset, chunk):
+        return self.client.put(url, chunk, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def finalize(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url + 'finalize/')
+
+    def test_upload_resume_and_finalize(self):
+        url = self.start()
+        half = len(self.data) // 2
+        self.assertEqual(self.put(url, 0, self.data[:half]).json()['offset'], half)
+
+        # A retry of the first chunk is refused with where to continue
+        response = self.put(url, 0, self.data[:half])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, half))
+        self.assertEqual(self.client.get(url).json()['offset'], half)
+        self.assertEqual(self.finalize(url).status_code, 400)
+
+        self.assertEqual(self.put(url, half, self.data[half:]).json()['offset'], len(self.data))
+        response = self.finalize(url)
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['image']['public_id'], content_hash(self.data))
+        self.assertEqual(self.finalize(url).status_code, 404)
+
+    def test_chunk_limits(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, self.data + b'x').status_code, 400)  # Past the declared size
+        self.assertEqual(self.put(url, 5, self.data[5:10]).status_code, 409)
+        self.assertEqual(self.client.post('/api/upload/image/chunked/', {'size': 0}, format='json').status_code, 400)
+
+    def test_not_an_image(self):
+        url = self.start(size=100)
+        self.assertEqual(self.put(url, 0, b'%PDF-1.7' + b'\0' * 92).status_code, 415)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_concurrent_finalize(self):
+        url = self.start()
+        self.put(url, 0, self.data)
+        session = UploadSession.objects.get()
+
+        # Another request holds the finalize lock
+        token = acquire_lease(f'upload:{session.id}:finalize', 60)
+        self.assertEqual(self.finalize(url).status_code, 409)
+        release_lease(f'upload:{session.id}:finalize', token)
+
+        # Another worker (without a shared cache) already moved the file away
+        with mock.patch('api.chunked_upload.create_job_from_file', side_effect=FileNotFoundError):
+            self.assertEqual(self.finalize(url).status_code, 409)
+        self.assertEqual(self.finalize(url).status_code, 202)
+        self.assertEqual(ImageJob.objects.get().status, 'done')
+
+
+@quiet_query_budget
+class ImageJobTests(TempImageStorageMixin, AliceAndBobMixin, TestCase):
+    """Background image jobs (api/image_jobs.py) and retry_image_jobs after a restart"""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(CHUNKED_UPLOAD_DIR=os.path.join(self.media, 'uploads')))
+
+    def upload(self, data):
+        """Upload, but 'restart' before the job runs: its on-commit submit is dropped"""
+        image = SimpleUploadedFile('a.png', data, content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.client.post('/api/upload/image/', {'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return ImageJob.objects.get(pk=response.json()['job_id'])
+
+    def retry(self):
+        ImageJob.objects.update(updated_at=timezone.now() - timezone.timedelta(minutes=30))
+        call_command('retry_image_jobs', minutes=10, stdout=StringIO())
+
+    def test_interrupted_job_is_retried(self):
+        job = self.upload(image_bytes())
+        post = self.client.post('/api/posts/', {'content': 'pic', 'user_id': self.alice.pk, 'image_job': str(job.id)}, format='json')
+        self.assertEqual(post.status_code, 201, post.content)
+        self.assertEqual(post.json()['image_status'], 'pending')
+
+        call_command('retry_image_jobs', minutes=10, stdout=StringIO())  # Too recent to be stale
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+
+        self.retry()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertFalse(os.path.exists(job_path(job)))
+        self.assertEqual(Post.objects.get(pk=post.json()['id']).image_asset_id, job.asset_id)
+        self.assertEqual(self.client.get(f'/api/upload/image/jobs/{job.id}/').json()['status'], 'done')
+
+    def test_lost_upload_fails(self):
+        job = self.upload(image_bytes())
+        os.remove(job_path(job))
+        self.retry()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('upload the image again', job.error)
+
+    def test_broken_image_fails(self):
+        job = self.upload(image_bytes()[:200])
+        self.retry()
+        response = self.client.get(f'/api/upload/image/jobs/{job.id}/').json()
+        self.assertEqual(response['status'], 'failed')
+        self.assertIn('Could not read image', response['error'])
+
+    def test_repeat_upload_is_done_at_once(self):
+        data = image_bytes()
+        with override_settings(IMAGE_JOBS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/upload/image/', {'image': SimpleUploadedFile('a.png', data, content_type='image/png')})
+        self.assertEqual(self.upload(data).status, 'done')
+
+
+@quiet_query_budget
+@override_settings(DATABASE_REPLICAS=['test_replica'], REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTests(AliceAndBobMixin, TestCase):
+    """
+    api/db_router.py with a real second database: a SQLite file that
+    lags behind the primary (it never sees the primary's writes). It is
+    set up here rather than in settings, so the test runner doesn't make
+    it a mirror of the primary.
+    """
+
+    databases = '__all__'  # Includes test_replica, added in setUpClass
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['test_replica'] = {
+            **connections['default'].settings_dict,
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+            'TEST': {'NAME': None, 'MIRROR': None},
+        }
+        call_command('migrate', database='test_replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['test_replica'].close()
+        del connections['test_replica']
+        del connections.settings['test_replica']
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for user in (cls.alice, cls.bob):
+            user.save(using='test_replica')
+        Post.objects.create(user=cls.alice, content='on both')
+        Post(pk=Post.objects.get().pk, user=cls.alice, content='on both').save(using='test_replica')
+
+    def posts(self, client=None):
+        return [p['content'] for p in (client or self.client).get('/api/posts/').json()['results']]
+
+    def test_reads_go_to_the_replica(self):
+        Post.objects.create(user=self.alice, content='primary only')  # Not replicated yet
+        self.assertEqual(self.posts(), ['on both'])
+        self.assertEqual(Post.objects.count(), 2)  # Outside a request: the primary
+
+    def test_writer_reads_the_primary_for_a_while(self):
+        response = self.client.post('/api/posts/', {'content': 'new', 'user_id': self.alice.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(cache.get(sticky_key(self.alice.pk)))
+        self.assertEqual(sorted(self.posts()), ['new', 'on both'])
+
+        bob = APIClient()
+        bob.force_authenticate(self.bob)
+        self.assertEqual(self.posts(bob), ['on both'])  # Not sticky - still the replica
+
+        cache.delete(sticky_key(self.alice.pk))  # REPLICA_STICKY_SECONDS passed
+        self.assertEqual(self.posts(), ['on both'])
+
+    def test_reads_only(self):
+        Post.objects.create(user=self.alice, content='primary only')
+        request = RequestFactory().post('/api/batch/')
+
+        def read(reads_only_first):
+            def view(request):
+                if reads_only_first:
+                    reads_only()
+                return list(Post.objects.order_by('id').values_list('content', flat=True))
+            return route_request(request, view)
+
+        self.assertEqual(read(False), ['on both', 'primary only'])  # A POST reads the primary
+        self.assertEqual(read(True), ['on both'])
+
+        # POST /api/batch/ with only reads in it stays on the replica
+        response = self.client.post('/api/batch/', {'requests': [{'id': 'posts', 'url': '/api/posts/'}]}, format='json')
+        body = response.json()['responses']['posts']['body']
+        self.assertEqual([p['content'] for p in body['results']], ['on both'])
+        self.assertIsNone(cache.get(sticky_key(self.alice.pk)))
+
+
+@quiet_query_budget
+class PurgeDeletedTests(AliceAndBobMixin, TestCase):
+    """purge_deleted (api/purge.py): soft-deleted content goes after the grace period"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.old = Post.objects.create(user=cls.alice, content='deleted long ago')
+        cls.recent = Post.objects.create(user=cls.alice, content='deleted yesterday')
+        cls.live = Post.objects.create(user=cls.alice, content='live')
+        for post in (cls.old, cls.recent, cls.live):
+            Like.objects.create(user=cls.bob, post=post)
+            Comment.objects.create(user=cls.bob, post=post, content='hi')
+        cls.old_comment = Comment.objects.create(user=cls.bob, post=cls.live, content='deleted comment')
+
+        for obj in (cls.old, cls.recent, cls.old_comment):
+            obj.is_deleted = True  # Soft delete, like the DELETE endpoints
+            obj.save()
+        long_ago = timezone.now() - timezone.timedelta(days=40)
+        Post.all_objects.filter(pk=cls.old.pk).update(updated_at=long_ago)
+        Comment.all_objects.filter(pk=cls.old_comment.pk).update(updated_at=long_ago)
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_deleted', '--days', '30', '--pause', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        out = self.purge('--dry-run')
+        self.assertIn('posts: 1 rows', out)
+        self.assertIn('comments: 2 rows', out)
+        self.assertIn('likes: 1 rows', out)
+        self.assertTrue(Post.all_objects.filter(pk=self.old.pk).exists())
+
+    def test_purges_after_the_grace_period(self):
+        self.purge('--batch-size', '1')
+        self.assertFalse(Post.all_objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(Comment.all_objects.filter(post=self.old).exists())
+        self.assertFalse(Comment.all_objects.filter(pk=self.old_comment.pk).exists())
+        self.assertFalse(Like.objects.filter(post=self.old).exists())
+        self.assertFalse(Notification.objects.filter(related_post=self.old).exists())
+        self.assertFalse(Notification.objects.filter(related_comment=self.old_comment).exists())
+
+        # Inside the grace period, or not deleted at all
+        self.assertTrue(Post.all_objects.filter(pk=self.recent.pk).exists())
+        self.assertEqual(Like.objects.filter(post__in=[self.recent, self.live]).count(), 2)
+        self.assertEqual(Comment.all_objects.filter(post=self.live).count(), 1)
+
+        self.assertIn('Purged 0 notifications', self.purge())  # Nothing left to do
+
+
+@quiet_query_budget
+class ArchiveTests(AliceAndBobMixin, TestCase):
+    """archive_cold (api/archive.py): old rows move to the archive tables, reads fall back to them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.old_post = Post.objects.create(user=cls.alice, content='old')
+        Like.objects.create(user=cls.bob, post=cls.old_post)  # Unread notification for Alice
+        cls.comment = Comment.objects.create(user=cls.bob, post=cls.old_post, content='nice')
+        cls.new_post = Post.objects.create(user=cls.alice, content='new')
+
+        cls.days_ago = lambda days: timezone.now() - timezone.timedelta(days=days)
+        Post.objects.filter(pk=cls.old_post.pk).update(created_at=cls.days_ago(400))
+
+    def archive(self):
+        call_command('archive_cold', '--days', '180', '--pause', '0', stdout=StringIO())
+
+    def test_posts_move_with_their_likes_and_comments(self):
+        self.assertEqual(archived_post_count(), 0)
+        self.archive()
+        self.assertFalse(Post.all_objects.filter(pk=self.old_post.pk).exists())
+        self.assertFalse(Comment.all_objects.filter(pk=self.comment.pk).exists())
+
+        archived = ArchivedPost.objects.get(pk=self.old_post.pk)
+        self.assertEqual(archived.liked_by, [self.bob.pk])
+        self.assertEqual([c['content'] for c in archived.comments], ['nice'])
+        self.assertEqual(archived_post_count(), 1)
+
+        # The user's posts continue into the archive
+        posts = self.client.get('/api/posts/user/alice/').json()['results']
+        self.assertEqual([(p['id'], p.get('archived', False)) for p in posts],
+                         [(self.new_post.pk, False), (self.old_post.pk, True)])
+
+    def test_notifications_keep_their_links(self):
+        self.archive()
+        notifications = {n['type']: n for n in self.client.get('/api/notifications/').json()['notifications']}
+        self.assertEqual(notifications['like']['related_post_id'], self.old_post.pk)
+        self.assertEqual(notifications['comment']['related_post_id'], self.old_post.pk)
+        self.assertEqual(notifications['comment']['related_comment_id'], self.comment.pk)
+
+        # ... and the link still opens the post
+        response = self.client.get(f'/api/posts/{self.old_post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['archived'])
+
+        # Archived later, once read and old
+        Notification.objects.update(is_read=True, created_at=self.days_ago(300))
+        self.archive()
+        self.assertEqual(
+            set(ArchivedNotification.objects.values_list('related_post_id', flat=True)), {self.old_post.pk}
+        )
+
+    def test_notifications_are_listed_by_date_across_tables(self):
+        Notification.objects.all().delete()
+        make = lambda days, is_read: Notification.objects.create(
+            user=self.alice, type='system', message=f'{days} days', is_read=is_read
+        ).pk
+        ids = {days: make(days, is_read) for days, is_read in [(1, True), (250, False), (200, True), (300, True)]}
+        for days, pk in ids.items():
+            Notification.objects.filter(pk=pk).update(created_at=self.days_ago(days))
+
+        self.archive()
+        self.assertEqual(ArchivedNotification.objects.count(), 2)  # Read and old; the unread one stays
+        data = self.client.get('/api/notifications/').json()
+        self.assertEqual([n['message'] for n in data['notifications']], ['1 days', '200 days', '250 days', '300 days'])
+        self.assertEqual((data['total_count'], data['unread_count']), (4, 1))
+
+    def test_archived_posts_list_likes_and_comments(self):
+        reply = Comment.objects.create(user=self.alice, post=self.old_post, parent=self.comment, content='thanks')
+        self.archive()
+        likes = self.client.get(f'/api/posts/{self.old_post.pk}/likes/').json()['results']
+        self.assertEqual([like['user']['username'] for like in likes], ['bob'])
+
+        comments = self.client.get(f'/api/posts/{self.old_post.pk}/comments/').json()['results']
+        self.assertEqual([c['content'] for c in comments], ['nice'])
+        self.assertEqual([r['id'] for r in comments[0]['replies']], [reply.pk])
+
+    def test_archived_posts_refuse_likes_and_comments(self):
+        self.archive()
+        for method, url, body in [
+            ('post', f'/api/posts/{self.old_post.pk}/likes/', None),
+            ('delete', f'/api/posts/{self.old_post.pk}/unlike/', None),
+            ('post', f'/api/posts/{self.old_post.pk}/comments/', {'content': 'late', 'post_id': self.old_post.pk}),
+        ]:
+            response = getattr(self.client, method)(url, body)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('archived', response.json()['error'])
+
+        # Not archived either - still a 404
+        self.assertEqual(self.client.post('/api/posts/999999/likes/').status_code, 404)
+
+    def test_posts_count_includes_archived_posts(self):
+        self.archive()
+        alice = User.objects.get(pk=self.alice.pk)
+        self.assertEqual(alice.archived_posts_count, 1)
+        with self.assertNumQueries(1):  # Only the hot posts are counted
+            self.assertEqual(alice.posts_count, 2)
+
+    def test_account_deletion_updates_the_archived_count(self):
+        self.archive()
+        self.assertEqual(archived_post_count(), 1)
+        run_deletion(request_deletion(self.alice).pk, pause=0)
+        self.assertEqual(archived_post_count(), 0)
+
+
+@quiet_query_budget
+class AccountDeletionTests(AliceAndBobMixin, TestCase):
+    """DELETE /api/accounts/me/: deactivated at once, data removed in the background (api/account_deletion.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        Follow.objects.create(follower=cls.bob, following=cls.alice)
+        cls.alice_post = Post.objects.create(user=cls.alice, content='mine')
+        Like.objects.create(user=cls.bob, post=cls.alice_post)
+        cls.bob_post = Post.objects.create(user=cls.bob, content='theirs')
+        Like.objects.create(user=cls.alice, post=cls.bob_post)
+        Comment.objects.create(user=cls.alice, post=cls.bob_post, content='hi bob')
+        Comment.objects.create(user=cls.bob, post=cls.bob_post, content='hi all')
+
+        # An archived post of Bob's that Alice liked and commented on
+        ArchivedPost.objects.create(
+            id=10**6, user=cls.bob, content='archived', created_at=timezone.now(), updated_at=timezone.now(),
+            liked_by=[cls.alice.pk, cls.bob.pk],
+            comments=[
+                {'id': 1, 'user_id': cls.alice.pk, 'parent_id': None, 'content': 'a', 'created_at': ''},
+                {'id': 2, 'user_id': cls.bob.pk, 'parent_id': 1, 'content': 'reply', 'created_at': ''},
+                {'id': 3, 'user_id': cls.bob.pk, 'parent_id': None, 'content': 'b', 'created_at': ''},
+            ],
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()  # Signs in with a real token instead
+        token = RefreshToken.for_user(self.alice).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def request_deletion(self):
+        """DELETE the account, without starting the background worker"""
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.delete('/api/accounts/me/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        return AccountDeletion.objects.get(user_id=self.alice.pk)
+
+    def test_deactivated_at_once(self):
+        deletion = self.request_deletion()
+        self.assertEqual(deletion.status, 'pending')
+        self.assertFalse(User.objects.get(pk=self.alice.pk).is_active)
+        self.assertEqual(self.client.get('/api/accounts/me/').status_code, 401)  # Cached user dropped
+
+    def test_removes_everything(self):
+        get_post_data(self.bob_post.pk)  # Cached with Alice's like and comment
+        run_deletion(self.request_deletion().pk, pause=0)
+
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+        self.assertEqual(AccountDeletion.objects.get().status, 'done')
+        self.assertFalse(Post.all_objects.filter(user_id=self.alice.pk).exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(Notification.objects.filter(Q(user_id=self.alice.pk) | Q(related_user_id=self.alice.pk)).exists())
+
+        data = get_post_data(self.bob_post.pk)
+        self.assertEqual((data['likes_count'], data['comments_count']), (0, 1))
+
+        archived = ArchivedPost.objects.get()
+        self.assertEqual(archived.liked_by, [self.bob.pk])
+        self.assertEqual([c['id'] for c in archived.comments], [3])  # Alice's comment and the reply to it
+
+    def test_interrupted_deletion_is_resumed(self):
+        deletion = self.request_deletion()
+        AccountDeletion.objects.filter(pk=deletion.pk).update(
+            status='running', updated_at=timezone.now() - timezone.timedelta(hours=1)
+        )
+        out = StringIO()
+        call_command('delete_accounts', '--minutes', '10', stdout=out)
+        self.assertIn('Finished 1 account deletions', out.getvalue())
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+
+
+@quiet_query_budget
+class PostBatchCreateTests(AliceAndBobMixin, TestCase):
+    """POST /api/posts/batch/ (api/batch_posts.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.own_image = ImageAsset.objects.create(owner=cls.alice, key='a' * 64, ref_count=0)
+        cls.own_image.uploaders.add(cls.alice)
+        cls.others_image = ImageAsset.objects.create(owner=cls.bob, key='b' * 64, ref_count=1)
+        cls.others_image.uploaders.add(cls.bob)
+
+    def create(self, posts, status_code):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/batch/', {'posts': posts}, format='json')
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json()
+
+    def test_identical_posts_get_their_own_ids(self):
+        # On MySQL this runs the row-at-a-time insert
+        data = self.create([{'content': 'same'}] * 3, 201)
+        ids = [result['id'] for result in data['results']]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(sorted(ids), sorted(Post.objects.values_list('pk', flat=True)))
+
+    def test_side_effects(self):
+        get_user_data('alice')  # Cached with no posts
+        data = self.create([{'content': 'one'}, {'content': 'two', 'image_asset': self.own_image.pk}], 201)
+
+        ids = [result['id'] for result in data['results']]
+        for post in Post.objects.filter(pk__in=ids):
+            self.assertIsNotNone(post.popularity_score)
+            self.assertEqual(post.last_activity_at, post.created_at)
+        self.own_image.refresh_from_db()
+        self.assertEqual(self.own_image.ref_count, 1)
+        self.assertEqual(get_user_data('alice')['posts_count'], 2)
+
+        feed = self.client.get('/api/feed/global/').json()['posts']
+        self.assertEqual(sorted(p['id'] for p in feed), sorted(ids))
+
+    def test_bad_items_fail_alone(self):
+        data = self.create([
+            {'content': 'fine'},
+            {'content': ''},
+            {'content': 'not mine', 'image_asset': self.others_image.pk},
+            {'content': 'no such job', 'image_job': str(uuid.uuid4())},
+        ], 207)
+        self.assertEqual((data['created'], data['failed']), (1, 3))
+        self.assertEqual([r['status'] for r in data['results']], [201, 400, 400, 400])
+        self.assertIn('content', data['results'][1]['errors'])
+        self.assertEqual(data['results'][2]['errors'], {'image_asset': ["You can only use images you uploaded."]})
+        self.assertIn('image_job', data['results'][3]['errors'])
+        self.assertEqual(Post.objects.count(), 1)
+
+        self.assertEqual(self.create([{'content': ''}], 400)['created'], 0)
+        self.assertEqual(self.create([], 400), {'error': 'Send a non-empty list of posts.'})
+        with override_settings(POST_BATCH_MAX=2):
+            self.assertEqual(self.create([{'content': 'x'}] * 3, 400), {'error': 'At most 2 posts per batch.'})
+
+
+
+@quiet_query_budget
+class BatchRequestTests(AliceAndBobMixin, TestCase):
+    """POST /api/batch/ (api/batch_requests.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = Post.objects.create(user=cls.alice, content='hello')
+
+    def setUp(self):
+        super().setUp()
+        self.client.raise_request_exception = False  # A failing sub-request is a 500 in the batch, not an error here
+
+    def batch(self, requests, status_code=200, **extra):
+        response = self.client.post('/api/batch/', {'requests': requests, **extra}, format='json')
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json()
+
+    def test_batches_cannot_be_nested(self):
+        for url in ['/api/batch/', '/api/batch/?x=1', '/api/%62atch/', '/api/b%61tch/']:
+            with self.subTest(url=url):
+                data = self.batch([{'id': 'inner', 'method': 'POST', 'url': url}], 400)
+                self.assertEqual(data, {'error': "Request inner: batches can't be nested."})
+        # Only the batch endpoint itself - other URLs with "batch" in them are fine
+        data = self.batch([{'id': 'posts', 'method': 'POST', 'url': '/api/posts/batch/', 'body': {'posts': [{'content': 'hi'}]}}])
+        self.assertEqual(data['responses']['posts']['status'], 201)
+
+    def test_bad_batches(self):
+        self.assertEqual(self.batch([], 400), {'error': 'Send a non-empty list of requests.'})
+        self.assertEqual(self.batch([{'id': 1, 'url': '/admin/'}], 400), {'error': 'Request 1: url must be an /api/ path.'})
+        self.assertEqual(self.batch([{'id': 1, 'url': '/api/'}, {'id': '1', 'url': '/api/'}], 400), {'error': 'Duplicate request id: 1'})
+        self.assertIn("can't be set", self.batch([{'id': 1, 'url': '/api/', 'headers': {'Authorization': 'x'}}], 400)['error'])
+
+    def test_failures_stay_in_their_sub_request(self):
+        with mock.patch.object(PostDetailView, 'get', side_effect=RuntimeError('boom')), \
+                self.assertLogs('django.request', 'ERROR'):
+            data = self.batch([
+                {'id': 'broken', 'url': f'/api/posts/{self.post.pk}/'},
+                {'id': 'missing', 'url': '/api/nope/'},
+                {'id': 'invalid', 'method': 'POST', 'url': '/api/posts/batch/', 'body': {'posts': []}},
+                {'id': 'posts', 'url': '/api/posts/'},
+            ])['responses']
+        self.assertEqual({key: value['status'] for key, value in data.items()},
+                         {'broken': 500, 'missing': 404, 'invalid': 400, 'posts': 200})
+        self.assertEqual(data['invalid']['body'], {'error': 'Send a non-empty list of posts.'})
+        self.assertEqual(data['posts']['body']['results'][0]['id'], self.post.pk)
+
+    def test_parallel(self):
+        # Sub-requests that stay off the database - pool threads can't see this test's transaction
+        with mock.patch.object(PostDetailView, 'get', side_effect=RuntimeError('boom')), \
+                self.assertLogs('django.request', 'ERROR'):
+            data = self.batch([
+                {'id': 'root', 'url': '/api/'},
+                {'id': 'broken', 'url': f'/api/posts/{self.post.pk}/'},
+                {'id': 'missing', 'url': '/api/nope/'},
+            ], parallel=True)['responses']
+        self.assertEqual([(key, value['status']) for key, value in data.items()],
+                         [('root', 200), ('broken', 500), ('missing', 404)])
+        self.assertEqual(data['root']['body']['message'], 'Social Media API')
+
+
+class AsyncViewParityTests(TransactionTestCase):
+    """
+    The async views (api/async_views.py, ASYNC_VIEWS=True) answer exactly
+    like the sync ones. A TransactionTestCase: their queries run on other
+    threads, which can't see a test transaction.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw12345678')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw12345678')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw12345678')
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        Follow.objects.create(follower=self.bob, following=self.alice)
+        for i in range(12):
+            post = Post.objects.create(user=self.bob if i % 3 else self.carol, content=f'cat post {i}' if i % 2 else f'post {i}')
+            Like.objects.create(user=self.alice, post=post)
+            Comment.objects.create(user=self.bob, post=post, content='nice')
+        own = Post.objects.create(user=self.alice, content='mine')
+        for user in (self.bob, self.carol):
+            Like.objects.create(user=user, post=own)
+        Notification.objects.filter(pk__in=Notification.objects.filter(user=self.alice).values('pk')[:1]).update(is_read=True)
+        self.token = f'Bearer {RefreshToken.for_user(self.alice).access_token}'
+
+    def get(self, view, path, kwargs=None, **headers):
+        request = RequestFactory().get(path, headers={'Authorization': self.token, **headers})
+        view = view.as_view()
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        response = view(request, **(kwargs or {}))
+        return response.render() if hasattr(response, 'render') else response
+
+    def assertSameResponse(self, sync_view, async_view, path, kwargs=None, **headers):
+        expected = self.get(sync_view, path, kwargs, **headers)
+        actual = self.get(async_view, path, kwargs, **headers)
+        self.assertEqual(actual.status_code, expected.status_code, path)
+        self.assertEqual(actual.content, expected.content, path)
+        self.assertEqual(actual.get('ETag'), expected.get('ETag'), path)
+        return expected
+
+    def test_feed(self):
+        for query in ['', '?page=2', '?page_size=3&page=3', '?search=cat', '?page=99', '?page=0']:
+            with self.subTest(query=query):
+                self.assertSameResponse(FeedView, AsyncFeedView, f'/api/feed/{query}')
+
+        etag = self.get(FeedView, '/api/feed/')['ETag']
+        response = self.assertSameResponse(FeedView, AsyncFeedView, '/api/feed/', If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_notifications(self):
+        response = self.assertSameResponse(NotificationListView, AsyncNotificationListView, '/api/notifications/')
+        self.assertEqual(json.loads(response.content)['total_count'], Notification.objects.filter(user=self.alice).count())
+
+        etag = response['ETag']
+        response = self.assertSameResponse(
+            NotificationListView, AsyncNotificationListView, '/api/notifications/', If_None_Match=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_profile(self):
+        for username in ['bob', 'carol', 'alice', 'nobody']:
+            with self.subTest(username=username):
+                self.assertSameResponse(
+                    UserFollowDetailView, AsyncUserFollowDetailView, f'/api/users/{username}/', {'username': username}
+                )
 
-# Create your tests here.
@@ -1,14 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    PostListCreateView, PostDetailView, UserPostsView,
+    BatchRequestView, PostListCreateView, PostBatchCreateView, PostDetailView, UserPostsView,
     FollowViewSet, UserFollowDetailView,
-    FeedView, GlobalFeedView,
+    FeedView, GlobalFeedView, PopularFeedView,
     LikeView, UnlikeView, CommentListCreateView, CommentDetailView, ReplyCreateView, NotificationListView, NotificationDetailView,  
 )
 from django.http import JsonResponse
-from .image_views import ImageUploadView, ImageDeleteView
+from .image_views import ImageUploadView, ImageDeleteView, ImageJobView, ChunkedUploadStartView, ChunkedUploadView, ChunkedUploadFinishView
 from .health import health_check
+from .metrics import metrics_view
+from .query_budget import with_query_budget
+from django.conf import settings
+
+# Async versions of the busiest reads, for ASGI servers (api/async_views.py)
+if settings.ASYNC_VIEWS:
+    from .async_views import AsyncFeedView, AsyncNotificationListView, AsyncUserFollowDetailView
+    FeedView, NotificationListView, UserFollowDetailView = AsyncFeedView, AsyncNotificationListView, AsyncUserFollowDetailView
 
 
 # Create router for ViewSet
@@ -16,10 +24,12 @@ router = DefaultRouter()
 router.register(r'follow', FollowViewSet, basename='follow')
 
 
+@with_query_budget(0)
 def api_root(request):
     return JsonResponse({
         'message': 'Social Media API',
         'endpoints': {
+            'batch': 'POST /api/batch/',
             'accounts': {
                 'register': '/api/accounts/register/',
                 'login': '/api/accounts/login/',
@@ -29,6 +39,7 @@ def api_root(request):
             'posts': {
                 'all_posts': '/api/posts/',
                 'create_post': 'POST /api/posts/',
+                'create_posts_batch': 'POST /api/posts/batch/',
                 'post_detail': '/api/posts/{id}/',
                 'user_posts': '/api/posts/user/{username}/',
             },
@@ -42,6 +53,7 @@ def api_root(request):
             'feed': {
                 'personal_feed': '/api/feed/',
                 'global_feed': '/api/feed/global/',
+                'popular_feed': '/api/feed/popular/',
             },
             'interactions': {
                 'like_post': 'POST /api/posts/{id}/likes/',
@@ -56,8 +68,12 @@ def api_root(request):
 urlpatterns = [
     path('', api_root, name='api-root'),
     
+    # Several calls in one request
+    path('batch/', BatchRequestView.as_view(), name='batch'),
+    
     # Post endpoints
     path('posts/', PostListCreateView.as_view(), name='post-list-create'),
+    path('posts/batch/', PostBatchCreateView.as_view(), name='post-batch-create'),
     path('posts/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
     path('posts/user/<str:username>/', UserPostsView.as_view(), name='user-posts'),
     
@@ -70,6 +86,7 @@ urlpatterns = [
     # Feed endpoints
     path('feed/', FeedView.as_view(), name='personal-feed'),
     path('feed/global/', GlobalFeedView.as_view(), name='global-feed'),
+    path('feed/popular/', PopularFeedView.as_view(), name='popular-feed'),
     
     # Like endpoints
     path('posts/<int:post_id>/likes/', LikeView.as_view(), name='post-likes'),
@@ -82,6 +99,10 @@ urlpatterns = [
 
      # Image endpoints
     path('upload/image/', ImageUploadView.as_view(), name='upload-image'),
+    path('upload/image/jobs/<uuid:job_id>/', ImageJobView.as_view(), name='image-job'),
+    path('upload/image/chunked/', ChunkedUploadStartView.as_view(), name='upload-image-chunked'),
+    path('upload/image/chunked/<uuid:upload_id>/', ChunkedUploadView.as_view(), name='upload-image-chunk'),
+    path('upload/image/chunked/<uuid:upload_id>/finalize/', ChunkedUploadFinishView.as_view(), name='upload-image-finalize'),
     path('delete/image/<str:public_id>/', ImageDeleteView.as_view(), name='delete-image'),
 
      # Notification endpoints
@@ -89,4 +110,5 @@ urlpatterns = [
     path('notifications/<int:pk>/read/', NotificationDetailView.as_view(), name='notification-read'),
 
      path('health/', health_check, name='health-check'),
+     path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -3,14 +3,27 @@ from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView 
-from .models import Notification, Post, Follow, Like, Comment  
-from .serializers import PostSerializer, FollowSerializer, User, UserDetailSerializer, LikeSerializer, CommentSerializer, NotificationSerializer  
+from .models import Notification, Post, Follow, Like, Comment, ArchivedPost, ArchivedNotification
+from .serializers import PostSerializer, ArchivedPostSerializer, FollowSerializer, User, UserBasicSerializer, UserDetailSerializer, LikeSerializer, CommentSerializer, NotificationSerializer  
 from accounts.permissions import IsOwnerOrReadOnly
 from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from django.core.paginator import Paginator
-from django.db.models import Q 
+from django.db.models import Q, Max, Count
 from .filters import PostFilter, UserFilter
+from .pagination import paginate_keyset, keyset_filter, encode_cursor, decode_cursor
+from . import feed_buffer
+from .ranking import get_ranked_feed
+from .cache import get_post_data, get_user_data, add_post_viewer_state, add_user_viewer_state, single_flight, get_versions
+from .archive import HotThenArchive, MergedByDate, archived_post_count
+from .batch_posts import create_posts, max_batch_size
+from .batch_requests import run_batch, validate_batch
+from .db_router import reads_only
+from .conditional import ConditionalGetMixin, make_etag, post_versions, user_profile_etag
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from datetime import timezone as dt_timezone
+from django.http import Http404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from django.contrib.auth import get_user_model 
@@ -36,7 +49,67 @@ class PostListCreateView(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PostBatchCreateView(APIView):
+    """
+    Create many posts in one request (see api/batch_posts.py).
+    POST: {"posts": [{"content": "...", "image_asset": 3}, ...]}
+    
+    Every post gets its own result. 201 if all were created, 207 if only
+    some, 400 if none.
+    """
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
+    
+    def post(self, request):
+        items = request.data.get('posts') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Send a non-empty list of posts."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        limit = max_batch_size()
+        if len(items) > limit:
+            return Response({"error": f"At most {limit} posts per batch."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = create_posts(request.user, items)
+        created = sum(1 for result in results if result['status'] == 201)
+        
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }, status=response_status)
+
+
+class BatchRequestView(APIView):
+    """
+    Run several API calls in one request (see api/batch_requests.py).
+    POST: {"requests": [{"id": "me", "method": "GET", "url": "/api/accounts/me/"}, ...],
+           "parallel": true}
+    
+    Responses come back keyed by request id.
+    """
+    
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = None  # Runs other views - see api/query_budget.py
+    
+    def post(self, request):
+        error = validate_batch(request.data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        reads_only()  # Sub-requests that write are tracked on their own
+        responses = run_batch(request, request.data['requests'], request.data.get('parallel', False))
+        return Response({'responses': responses})
+
+
+class PostDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     View to retrieve, update, or delete a single post.
     GET: Get post details
@@ -46,8 +119,30 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    query_budget = 20
     queryset = Post.objects.filter(is_deleted=False)
     
+    def get_etag(self, request, *args, **kwargs):
+        """Last edit + cache version (bumped by likes and comments) + viewer"""
+        pk = self.kwargs['pk']
+        updated_at = Post.objects.filter(pk=pk, is_deleted=False).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        return make_etag('post', pk, updated_at.isoformat(), post_versions([pk]), request.user.pk)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Serve the post from the cache, then add this user's is_liked"""
+        data = get_post_data(self.kwargs['pk'])
+        if data is None:
+            # Archived posts keep their id, so links (e.g. in notifications) still work
+            archived = ArchivedPost.objects.select_related('user', 'image_asset').filter(pk=self.kwargs['pk']).first()
+            if archived is None:
+                raise Http404("No Post matches the given query.")
+            return Response(ArchivedPostSerializer(archived, context={'request': request}).data)
+        
+        add_post_viewer_state([data], request.user)
+        return Response(data)
+    
     def get_object(self):
         """Get the post object, check permissions"""
         post = get_object_or_404(Post, pk=self.kwargs['pk'], is_deleted=False)
@@ -82,6 +177,8 @@ class UserPostsView(generics.ListAPIView):
     
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 138
+    known_n_plus_one = True  # Per-post queries in PostSerializer (api/query_budget.py)
     
     def get_queryset(self):
         """Get posts by specific user"""
@@ -89,7 +186,22 @@ class UserPostsView(generics.ListAPIView):
         return Post.objects.filter(
             user__username=username,
             is_deleted=False
-        ).select_related('user')  # Optimize database query
+        ).select_related('user', 'image_asset')  # Optimize database query
+    
+    def list(self, request, *args, **kwargs):
+        """Newest posts first; older pages continue into the user's archived posts"""
+        archived = ArchivedPost.objects.filter(
+            user__username=self.kwargs['username']
+        ).select_related('user', 'image_asset')
+        posts = HotThenArchive(self.filter_queryset(self.get_queryset()), archived)
+        
+        page = self.paginate_queryset(posts)
+        data = [
+            PostSerializer(post, context=self.get_serializer_context()).data if isinstance(post, Post)
+            else ArchivedPostSerializer(post, context=self.get_serializer_context()).data
+            for post in page
+        ]
+        return self.get_paginated_response(data)
     
 
 class FollowViewSet(ViewSet):
@@ -99,6 +211,7 @@ class FollowViewSet(ViewSet):
     """
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 9
     
     @action(detail=False, methods=['POST'])
     def follow(self, request):
@@ -203,44 +316,82 @@ class FollowViewSet(ViewSet):
         return Response(serializer.data)
 
 
-class UserFollowDetailView(generics.RetrieveAPIView):
+class UserFollowDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = UserDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 11
     queryset = User.objects.all()
     lookup_field = 'username'
     
+    def get_etag(self, request, *args, **kwargs):
+        """Profile edit time + cache version (bumped by follows and posts) + viewer"""
+        return user_profile_etag(self.kwargs['username'], request.user)
+    
     def retrieve(self, request, *args, **kwargs):
         """Enhanced response with feed stats"""
-        response = super().retrieve(request, *args, **kwargs)
+        # Profile comes from the cache, follow flags are per viewer
+        data = get_user_data(self.kwargs['username'])
+        if data is None:
+            raise Http404("No User matches the given query.")
         
-        user = self.get_object()
+        add_user_viewer_state(data, request.user)
+        is_own_profile = data['id'] == request.user.pk
         
         # Add feed-related stats
-        response.data['feed_stats'] = {
-            'total_posts': user.posts_count,
+        data['feed_stats'] = {
+            'total_posts': data['posts_count'],
             'posts_in_your_feed': Post.objects.filter(
-                user=user,
+                user_id=data['id'],
                 is_deleted=False,
                 user__followers__follower=request.user
-            ).count() if request.user != user else 'N/A (your own profile)',
-            'would_see_in_feed': request.user.is_following(user)
+            ).count() if not is_own_profile else 'N/A (your own profile)',
+            'would_see_in_feed': data['is_following']
         }
         
-        return response
+        return Response(data)
     
 
-class FeedView(generics.ListAPIView):
+class FeedView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 101
+    known_n_plus_one = True  # Per-post queries in PostSerializer (api/query_budget.py)
+    
+    def get_etag(self, request, *args, **kwargs):
+        """Newest timeline entry, size and last edit + versions of the posts on this page"""
+        if request.query_params.get('rank') == 'relevance':
+            return None  # Ranked pages are already cached per user
+        
+        try:
+            page_size = int(request.query_params.get('page_size', 10))
+            page_number = int(request.query_params.get('page', 1))
+        except ValueError:
+            return None
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        timeline = queryset.aggregate(
+            newest=Max('id'), changed=Max('updated_at'), total=Count('id', distinct=True)
+        )
+        start = (page_number - 1) * page_size
+        page_ids = list(queryset.values_list('id', flat=True)[start:start + page_size]) if start >= 0 else []
+        
+        return make_etag(
+            'feed', request.user.pk, request.query_params.urlencode(),
+            timeline['newest'], timeline['changed'], timeline['total'],
+            get_versions('user', [request.user.pk]),  # following_count
+            post_versions(page_ids)
+        )
     
     def get_queryset(self):
         user = self.request.user
         
         # Get base queryset
+        # Authors as a subquery (not a join) so each author's posts come from an index
+        following = Follow.objects.filter(follower=user).values('following_id')
         posts = Post.objects.filter(
-            Q(user__followers__follower=user) | Q(user=user),
+            Q(user_id__in=following) | Q(user=user),
             is_deleted=False
-        ).select_related('user').order_by('-created_at')
+        ).select_related('user', 'image_asset').order_by('-created_at')
         
         # Filter by date if provided
         date_from = self.request.query_params.get('date_from', None)
@@ -270,7 +421,17 @@ class FeedView(generics.ListAPIView):
         page_size = int(request.query_params.get('page_size', 10))
         page_number = int(request.query_params.get('page', 1))
         
-        paginator = Paginator(queryset, page_size)
+        # Ranking mode: chronological (default) or relevance
+        rank = request.query_params.get('rank', 'chronological')
+        if rank == 'relevance':
+            filters_applied = {
+                key: request.query_params.get(key)
+                for key in ('date_from', 'date_to', 'user', 'search')
+            }
+            # Page through the cached ranked ids, then load just this page
+            paginator = Paginator(get_ranked_feed(request.user, queryset, filters_applied), page_size)
+        else:
+            paginator = Paginator(queryset, page_size)
         
         try:
             page = paginator.page(page_number)
@@ -280,13 +441,28 @@ class FeedView(generics.ListAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        serializer = self.get_serializer(page.object_list, many=True)
+        if rank == 'relevance':
+            posts_by_id = Post.objects.filter(is_deleted=False).select_related('user', 'image_asset').in_bulk(page.object_list)
+            posts = [posts_by_id[pk] for pk in page.object_list if pk in posts_by_id]
+        else:
+            posts = page.object_list
         
-        return Response({
+        serializer = self.get_serializer(posts, many=True)
+        
+        return Response(self.feed_data(
+            request, paginator, page, serializer.data, request.user.following_count, rank
+        ))
+    
+    def feed_data(self, request, paginator, page, posts_data, following_count, rank):
+        """Response body for one feed page (shared with AsyncFeedView)"""
+        page_size = paginator.per_page
+        page_number = page.number
+        return {
             'feed_info': {
                 'user': request.user.username,
-                'following_count': request.user.following_count,
+                'following_count': following_count,
                 'posts_in_feed': paginator.count,
+                'rank': 'relevance' if rank == 'relevance' else 'chronological',
             },
             'pagination': {
                 'count': paginator.count,
@@ -304,12 +480,12 @@ class FeedView(generics.ListAPIView):
                 'user': request.query_params.get('user'),
                 'search': request.query_params.get('search'),
             },
-            'posts': serializer.data
-        })
+            'posts': posts_data
+        }
     
 
 
-class GlobalFeedView(generics.ListAPIView):
+class GlobalFeedView(ConditionalGetMixin, generics.ListAPIView):
     """
     Global feed - all public posts (from all users)
     GET: Get paginated feed of all posts
@@ -317,43 +493,262 @@ class GlobalFeedView(generics.ListAPIView):
     
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 165
+    known_n_plus_one = True  # Per-post queries in PostSerializer (api/query_budget.py)
+    
+    def page_params(self, request):
+        """(page_number, page_size) from the query, page_size capped at 100; None if invalid"""
+        try:
+            page_size = int(request.query_params.get('page_size', 20))
+            page_number = int(request.query_params.get('page', 1))
+        except ValueError:
+            return None
+        if page_size < 1:
+            return None
+        return page_number, min(page_size, 100)
+    
+    def get_etag(self, request, *args, **kwargs):
+        """For pages inside the buffer: the buffered posts + their versions (for is_liked)"""
+        if not set(request.query_params) <= {'page', 'page_size'}:
+            return None
+        
+        params = self.page_params(request)
+        if params is None:
+            return None
+        page_number, page_size = params
+        
+        buffer = feed_buffer.get_buffer()
+        start = (page_number - 1) * page_size
+        entries = buffer['entries'][start:start + page_size] if start >= 0 else []
+        if len(entries) < page_size and start + len(entries) < buffer['count']:
+            return None  # Page runs past the buffer
+        
+        return make_etag(
+            'global', request.user.pk, page_number, page_size, buffer['count'],
+            repr(entries), post_versions([e['key'][1] for e in entries])
+        )
     
     def get_queryset(self):
         """Get all public posts"""
         return Post.objects.filter(
             is_deleted=False
-        ).select_related('user').order_by('-created_at')
+        ).select_related('user', 'image_asset').order_by('-created_at')
     
-    def list(self, request, *args, **kwargs):
+    def build_page(self, page_number, page_size):
+        """Serialize one page (same for every user), or None if the page is invalid"""
         queryset = self.filter_queryset(self.get_queryset())
-        
-        # Pagination
-        page_size = int(request.query_params.get('page_size', 20))
-        page_number = int(request.query_params.get('page', 1))
-        
         paginator = Paginator(queryset, page_size)
         
         try:
             page = paginator.page(page_number)
         except:
+            return None
+        
+        # No request in the context - is_liked is added per user afterwards
+        serializer = self.get_serializer_class()(page.object_list, many=True)
+        
+        return {
+            'count': paginator.count,
+            'total_pages': paginator.num_pages,
+            'posts': serializer.data,
+        }
+    
+    def list(self, request, *args, **kwargs):
+        # Pagination
+        params = self.page_params(request)
+        if params is None:
             return Response(
                 {"error": "Invalid page number."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        page_number, page_size = params
         
-        serializer = self.get_serializer(page.object_list, many=True)
+        # Plain feed requests are served from the shared ring buffer
+        if set(request.query_params) <= {'page', 'page_size', 'cursor'}:
+            return self.list_from_buffer(request, page_number, page_size)
+        
+        # Filtered / ordered feeds: every user still gets the same pages,
+        # so build each one once and share it.
+        # single_flight stops all workers rebuilding a page when it expires.
+        cache_key = 'feed:global:' + request.query_params.urlencode()
+        data = single_flight(
+            cache_key,
+            lambda: self.build_page(page_number, page_size),
+            settings.FEED_CACHE_TTL
+        )
+        
+        if data is None:
+            return Response(
+                {"error": "Invalid page number."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         return Response({
             'feed_type': 'global',
             'pagination': {
-                'count': paginator.count,
-                'total_pages': paginator.num_pages,
+                'count': data['count'],
+                'total_pages': data['total_pages'],
                 'current_page': page_number,
             },
-            'posts': serializer.data
+            'posts': add_post_viewer_state(data['posts'], request.user)
         })    
     
 
+    def list_from_buffer(self, request, page_number, page_size):
+        """
+        Serve a page from the newest-posts buffer (api/feed_buffer.py).
+        Pages past the end of the buffer use keyset queries from its last post.
+        """
+        buffer = feed_buffer.get_buffer()
+        entries = buffer['entries']
+        count = buffer['count'] + archived_post_count()
+        cursor = request.query_params.get('cursor')
+        
+        if cursor:
+            # Keyset: everything after the cursor's (created_at, id)
+            try:
+                after = decode_cursor(cursor)
+                if len(after) != 2 or not isinstance(after[0], str) or not isinstance(after[1], int):
+                    raise ValueError
+                # Same format as the buffer keys, so they compare as strings
+                created_at = parse_datetime(after[0])
+                if created_at is None or created_at.tzinfo is None:
+                    raise ValueError
+                after = [created_at.astimezone(dt_timezone.utc).isoformat(timespec='microseconds'), after[1]]
+            except ValueError:
+                return Response(
+                    {"error": "Invalid cursor."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            start = next((i for i, e in enumerate(entries) if e['key'] < after), len(entries))
+        else:
+            start = (page_number - 1) * page_size
+            if page_number < 1 or (start >= count and page_number != 1):
+                return Response(
+                    {"error": "Invalid page number."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            after = None
+        
+        posts = [e['post'] for e in entries[start:start + page_size]]
+        last_key = entries[start + len(posts) - 1]['key'] if posts else after
+        archived_posts = []
+        
+        # Ran off the end of the buffer - continue from its last post in the
+        # database, and past the oldest post into the archive (api/archive.py)
+        missing = page_size - len(posts)
+        if missing and len(entries) < count:
+            tail = entries[-1]['key'] if entries else None
+            offset = max(start - len(entries), 0)
+            if tail is not None and after is not None and after < tail:
+                tail, offset = after, 0  # Cursor is already past the buffer
+            queryset = self.get_queryset().order_by('-created_at', '-id')
+            archived = ArchivedPost.objects.select_related('user', 'image_asset')
+            if tail is not None:
+                queryset = queryset.filter(keyset_filter(['created_at', 'id'], tail))
+                archived = archived.filter(keyset_filter(['created_at', 'id'], tail))
+            extra = HotThenArchive(queryset, archived)[offset:offset + missing]
+            posts += self.get_serializer_class()([p for p in extra if isinstance(p, Post)], many=True).data
+            archived_posts = [p for p in extra if isinstance(p, ArchivedPost)]  # Always after the hot posts
+            if extra:
+                last_key = feed_buffer.entry_key(extra[-1])
+        
+        shown = len(posts) + len(archived_posts)
+        has_next = start + shown < count if not cursor else shown == page_size
+        
+        # is_liked: hot posts from the Like table, archived posts know their likes
+        posts = add_post_viewer_state(posts, request.user)
+        posts += ArchivedPostSerializer(archived_posts, many=True, context={'request': request}).data
+        
+        return Response({
+            'feed_type': 'global',
+            'pagination': {
+                'count': count,
+                'total_pages': max(-(-count // page_size), 1),
+                'current_page': page_number,
+                'next_cursor': encode_cursor(last_key) if has_next and last_key else None,
+            },
+            'posts': posts
+        })
+
+
+class PopularFeedView(generics.ListAPIView):
+    """
+    Popular feed - posts ranked by time-decayed engagement
+    GET: Get a page of popular posts (use next_cursor for the next page)
+    """
+    
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 163
+    known_n_plus_one = True  # Per-post queries in PostSerializer (api/query_budget.py)
+    
+    def get_queryset(self):
+        """Get all public posts (ordering comes from the keyset)"""
+        return Post.objects.filter(is_deleted=False).select_related('user', 'image_asset')
+    
+    def build_page(self, cursor, page_size):
+        """Serialize one page (same for every user), or None if the cursor is invalid"""
+        # Keyset pagination - walks the (popularity_score, id) index
+        try:
+            posts, next_cursor = paginate_keyset(
+                self.get_queryset(), ['popularity_score', 'id'], cursor, page_size
+            )
+        except ValueError:
+            return None
+        
+        return {
+            'next_cursor': next_cursor,
+            'posts': self.get_serializer_class()(posts, many=True).data,
+        }
+    
+    def list(self, request, *args, **kwargs):
+        try:
+            page_size = max(1, min(int(request.query_params.get('page_size', 20)), 100))
+        except ValueError:
+            return Response(
+                {"error": "page_size must be a number."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        cursor = request.query_params.get('cursor')
+        
+        # Shared between users, rebuilt by one worker at a time
+        data = single_flight(
+            f'feed:popular:{page_size}:{cursor}',
+            lambda: self.build_page(cursor, page_size),
+            settings.FEED_CACHE_TTL
+        )
+        
+        if data is None:
+            return Response(
+                {"error": "Invalid cursor."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'feed_type': 'popular',
+            'pagination': {
+                'page_size': page_size,
+                'next_cursor': data['next_cursor'],
+                'has_next': data['next_cursor'] is not None,
+            },
+            'posts': add_post_viewer_state(data['posts'], request.user)
+        })
+
+
+def archived_post_error(post_id, action):
+    """Error for a like / comment on a post that isn't in the Post table"""
+    if ArchivedPost.objects.filter(pk=post_id).exists():
+        return Response(
+            {"error": f"This post is archived and can no longer be {action}."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(
+        {"error": "Post not found."},
+        status=status.HTTP_404_NOT_FOUND
+    )
+
+
 class LikeView(generics.ListCreateAPIView):
     """
     Handle likes on posts.
@@ -363,12 +758,24 @@ class LikeView(generics.ListCreateAPIView):
     
     serializer_class = LikeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 8
     
     def get_queryset(self):
         """Get likes for a specific post"""
         post_id = self.kwargs.get('post_id')
         return Like.objects.filter(post_id=post_id).select_related('user')
     
+    def list(self, request, *args, **kwargs):
+        """Likes of an archived post are stored with it - list those users instead"""
+        archived = ArchivedPost.objects.filter(pk=kwargs.get('post_id')).first()
+        if archived is None:
+            return super().list(request, *args, **kwargs)
+        
+        users = User.objects.in_bulk(archived.liked_by)
+        page = self.paginate_queryset([users[pk] for pk in archived.liked_by if pk in users])
+        data = [{'user': UserBasicSerializer(user).data} for user in page]  # No like id or date is kept
+        return self.get_paginated_response(data)
+    
     def create(self, request, *args, **kwargs):
         """Like a post"""
         post_id = kwargs.get('post_id')
@@ -376,10 +783,7 @@ class LikeView(generics.ListCreateAPIView):
         try:
             post = Post.objects.get(id=post_id, is_deleted=False)
         except Post.DoesNotExist:
-            return Response(
-                {"error": "Post not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            return archived_post_error(post_id, "liked")
         
         # Check if already liked
         if Like.objects.filter(user=request.user, post=post).exists():
@@ -402,6 +806,7 @@ class UnlikeView(generics.DestroyAPIView):
     """
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
     
     def delete(self, request, *args, **kwargs):
         post_id = kwargs.get('post_id')
@@ -409,10 +814,7 @@ class UnlikeView(generics.DestroyAPIView):
         try:
             post = Post.objects.get(id=post_id, is_deleted=False)
         except Post.DoesNotExist:
-            return Response(
-                {"error": "Post not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            return archived_post_error(post_id, "unliked")
         
         # Find and delete like
         like = Like.objects.filter(user=request.user, post=post).first()
@@ -440,6 +842,8 @@ class CommentListCreateView(generics.ListCreateAPIView):
     
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 30
+    known_n_plus_one = True  # Per-comment queries in CommentSerializer (api/query_budget.py)
     
     def get_queryset(self):
         """Get comments for a specific post"""
@@ -450,6 +854,26 @@ class CommentListCreateView(generics.ListCreateAPIView):
             parent__isnull=True  # Only top-level comments (not replies)
         ).select_related('user').prefetch_related('replies').order_by('created_at')
     
+    def list(self, request, *args, **kwargs):
+        """Comments of an archived post are stored with it (with user ids, like its recent_comments)"""
+        archived = ArchivedPost.objects.filter(pk=kwargs.get('post_id')).first()
+        if archived is None:
+            return super().list(request, *args, **kwargs)
+        
+        comments = [dict(c, replies=[]) for c in archived.comments]
+        by_id = {c['id']: c for c in comments}
+        for comment in comments:
+            if comment['parent_id'] in by_id:
+                by_id[comment['parent_id']]['replies'].append(comment)
+        page = self.paginate_queryset([c for c in comments if c['parent_id'] is None])
+        return self.get_paginated_response(page)
+    
+    def create(self, request, *args, **kwargs):
+        """Add a comment - archived posts can't get new ones"""
+        if not Post.objects.filter(id=kwargs.get('post_id')).exists():
+            return archived_post_error(kwargs.get('post_id'), "commented on")
+        return super().create(request, *args, **kwargs)
+    
     def perform_create(self, serializer):
         """Create comment - set post from URL"""
         post_id = self.kwargs.get('post_id')
@@ -467,6 +891,7 @@ class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
     queryset = Comment.objects.filter(is_deleted=False)
     
     def get_object(self):
@@ -502,6 +927,7 @@ class ReplyCreateView(generics.CreateAPIView):
     
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 11
     
     def create(self, request, *args, **kwargs):
         """Create a reply to a comment"""
@@ -532,29 +958,42 @@ class ReplyCreateView(generics.CreateAPIView):
 class PostListCreateView(generics.ListCreateAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 98
+    known_n_plus_one = True  # Per-post queries in PostSerializer (api/query_budget.py)
     
     # Add filter backends
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = PostFilter
     search_fields = ['content', 'user__username']
-    ordering_fields = ['created_at', 'updated_at', 'likes_count']
+    ordering_fields = ['created_at', 'updated_at', 'popularity_score']
     ordering = ['-created_at']  # Default ordering
     
     def get_queryset(self):
-        return Post.objects.filter(is_deleted=False).select_related('user')    
+        return Post.objects.filter(is_deleted=False).select_related('user', 'image_asset')    
     
 
 
-class NotificationListView(generics.ListAPIView):
+class NotificationListView(ConditionalGetMixin, generics.ListAPIView):
     """Get user's notifications"""
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 8
     serializer_class = NotificationSerializer 
     
+    def get_etag(self, request, *args, **kwargs):
+        """Newest notification + total / unread counts"""
+        if request.query_params.get('mark_read', '').lower() == 'true':
+            return None  # Has a side effect - always run it
+        
+        summary = Notification.objects.filter(user=request.user).aggregate(
+            newest=Max('id'), total=Count('id'), unread=Count('id', filter=Q(is_read=False))
+        )
+        return make_etag('notifications', request.user.pk, summary['newest'], summary['total'], summary['unread'])
+    
     def get_queryset(self):
         return Notification.objects.filter(
             user=self.request.user
-        ).select_related('related_user', 'related_post', 'related_comment')
+        ).select_related('related_user')
     
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -564,37 +1003,45 @@ class NotificationListView(generics.ListAPIView):
         if mark_read:
             queryset.update(is_read=True)
         
+        # Newest 50 - older ones continue into the archive (api/archive.py)
+        archived = ArchivedNotification.objects.filter(user=request.user).select_related('related_user')
+        all_notifications = MergedByDate(queryset, archived)
+        
         # Prepare response
-        notifications = []
-        for notification in queryset:
-            notifications.append({
-                'id': notification.id,
-                'type': notification.type,
-                'message': notification.message,
-                'is_read': notification.is_read,
-                'created_at': notification.created_at,
-                'related_user': {
-                    'username': notification.related_user.username if notification.related_user else None,
-                    'profile_picture': notification.related_user.profile_picture if notification.related_user else None,
-                } if notification.related_user else None,
-                'related_post_id': notification.related_post.id if notification.related_post else None,
-                'related_comment_id': notification.related_comment.id if notification.related_comment else None,
-            })
+        notifications = [self.notification_data(n) for n in all_notifications[:50]]
         
         # Count unread
         unread_count = queryset.filter(is_read=False).count()
         
         return Response({
             'unread_count': unread_count,
-            'total_count': queryset.count(),
-            'notifications': notifications[:50]  # Limit to 50
+            'total_count': all_notifications.count(),
+            'notifications': notifications
         })
+    
+    def notification_data(self, notification):
+        """One notification in the response (shared with AsyncNotificationListView)"""
+        return {
+            'id': notification.id,
+            'type': notification.type,
+            'message': notification.message,
+            'is_read': notification.is_read,
+            'created_at': notification.created_at,
+            'related_user': {
+                'username': notification.related_user.username if notification.related_user else None,
+                'profile_picture': notification.related_user.profile_picture if notification.related_user else None,
+            } if notification.related_user else None,
+            # Hot notifications about an archived post keep its id in archived_post_id
+            'related_post_id': notification.related_post_id or getattr(notification, 'archived_post_id', None),
+            'related_comment_id': notification.related_comment_id or getattr(notification, 'archived_comment_id', None),
+        }
 
 
 class NotificationDetailView(APIView):
     """Mark notification as read"""
     
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 4
     
     def patch(self, request, pk):
         try:
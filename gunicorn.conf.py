@@ -0,0 +1,24 @@
+"""
+Gunicorn settings (read automatically by `gunicorn socialmedia.wsgi:application`).
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR
+(see api/metrics.py). It defaults to tmp/metrics and is emptied on start,
+so counters begin at zero with each deploy.
+"""
+import os
+import shutil
+from pathlib import Path
+
+
+def on_starting(server):
+    # Before the workers fork, so they all inherit it
+    metrics_dir = os.environ.setdefault(
+        'PROMETHEUS_MULTIPROC_DIR', str(Path(__file__).resolve().parent / 'tmp' / 'metrics')
+    )
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -12,12 +12,9 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 
 from pathlib import Path
-import cloudinary
-import cloudinary.uploader
-from cloudinary.utils import cloudinary_url
-import cloudinary.api
 import dj_database_url
-from decouple import config 
+from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',  # Times the whole request (api/metrics.py)
+    'api.query_budget.QueryBudgetMiddleware',  # Before the rest, so it counts every query (api/query_budget.py)
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -63,6 +62,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.db_router.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -102,6 +102,119 @@ DATABASES = {
     )
 }
 
+# Read replicas (api/db_router.py): comma-separated database URLs.
+# Reads go to a replica, writes to the primary above.
+# Needs a CACHE_URL every worker shares - see the check after CACHES.
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+
+for i, url in enumerate(DATABASE_REPLICA_URLS):
+    alias = f'replica_{i}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}  # Tests read their own writes
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.db_router.PrimaryReplicaRouter']
+
+# How long a user keeps reading from the primary after a write (seconds).
+# Should be longer than the usual replication lag.
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+
+
+# Cache
+# Local memory by default (per worker). Set CACHE_URL to share one cache between workers:
+#   redis://localhost:6379/0, memcached://localhost:11211 or file:///tmp/socialmedia-cache
+
+CACHE_URL = config('CACHE_URL', default='')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': CACHE_URL[len('memcached://'):],
+        }
+    }
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'socialmedia',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# A user who just wrote is pinned to the primary through a cache key
+# (api/db_router.py). In a per-worker cache the other workers never see it,
+# and the user's next request may read a replica that hasn't caught up.
+if DATABASE_REPLICAS and not CACHE_URL.startswith(('redis://', 'rediss://', 'memcached://', 'file://')):
+    raise ImproperlyConfigured(
+        "DATABASE_REPLICA_URLS needs a CACHE_URL shared by all workers "
+        "(redis://, memcached://, or file:// on a single host)."
+    )
+
+# How long cached posts / profiles live (seconds)
+CACHE_TTL = config('CACHE_TTL', default=300, cast=int)
+
+# How long shared feed pages (global / popular) are served before a rebuild (seconds)
+FEED_CACHE_TTL = config('FEED_CACHE_TTL', default=30, cast=int)
+
+# How many of the newest posts the global feed keeps in its shared buffer (api/feed_buffer.py)
+GLOBAL_FEED_BUFFER_SIZE = config('GLOBAL_FEED_BUFFER_SIZE', default=200, cast=int)
+
+# How long soft-deleted posts and comments are kept before purge_deleted removes them (days)
+PURGE_GRACE_DAYS = config('PURGE_GRACE_DAYS', default=30, cast=int)
+
+# Posts and read notifications older than this move to archive tables (days, see api/archive.py)
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=180, cast=int)
+
+# Most posts one POST /api/posts/batch/ request may create (api/batch_posts.py)
+POST_BATCH_MAX = config('POST_BATCH_MAX', default=100, cast=int)
+
+# POST /api/batch/: most sub-requests per batch, and threads for "parallel": true (api/batch_requests.py)
+BATCH_MAX_REQUESTS = config('BATCH_MAX_REQUESTS', default=20, cast=int)
+BATCH_WORKERS = config('BATCH_WORKERS', default=8, cast=int)
+
+# Serve the feed, notification list and profile views as async views (api/async_views.py).
+# Turn on when running under ASGI: uvicorn socialmedia.asgi:application
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# Threads (and so database connections) the async views run their queries on
+ASYNC_QUERY_THREADS = config('ASYNC_QUERY_THREADS', default=32, cast=int)
+
+# Queries a request may run before a warning is logged (views declare their
+# own; this is for the rest), and how many runs of the same query count as an
+# N+1 (api/query_budget.py). Strict raises instead.
+QUERY_BUDGET = config('QUERY_BUDGET', default=50, cast=int)
+QUERY_REPEAT_THRESHOLD = config('QUERY_REPEAT_THRESHOLD', default=5, cast=int)
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
+# GET /api/metrics/ (api/metrics.py): if set, scrapers must send "Authorization: Bearer <token>".
+# Left empty, the endpoint is a 404 unless DEBUG is on.
+# Workers share metrics through PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py).
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Slow-query log (api/slow_queries.py): queries over SLOW_QUERY_MS, with their EXPLAIN plans,
+# go to a rotating JSON-lines log, one file per process (pid added to the name). A sample rate of 0 turns it off.
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=500, cast=int)
+SLOW_QUERY_SAMPLE_RATE = config('SLOW_QUERY_SAMPLE_RATE', default=1.0, cast=float)
+SLOW_QUERY_LOG = config('SLOW_QUERY_LOG', default=str(BASE_DIR / 'tmp' / 'slow_queries.log'))
+SLOW_QUERY_LOG_MAX_BYTES = config('SLOW_QUERY_LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+SLOW_QUERY_LOG_BACKUPS = config('SLOW_QUERY_LOG_BACKUPS', default=5, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -139,7 +252,36 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# Uploaded images (see api/images.py). The resized variants are written to
+# the 'images' storage below - the local filesystem by default, but any
+# Django storage backend can be plugged in with IMAGE_STORAGE_BACKEND.
+MEDIA_URL = config('MEDIA_URL', default='/media/')
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+IMAGE_STORAGE_BACKEND = config('IMAGE_STORAGE_BACKEND', default='django.core.files.storage.FileSystemStorage')
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)  # Processing threads per process
+CHUNKED_UPLOAD_DIR = config('CHUNKED_UPLOAD_DIR', default=str(BASE_DIR / 'tmp' / 'uploads'))  # Uploads waiting to be processed
+IMAGE_JOBS_EAGER = config('IMAGE_JOBS_EAGER', default=False, cast=bool)  # Process uploads in the request (tests)
+IMAGE_PERCEPTUAL_DEDUP = config('IMAGE_PERCEPTUAL_DEDUP', default=False, cast=bool)  # Also match near-duplicates
+
+# STATICFILES_STORAGE / DEFAULT_FILE_STORAGE are gone since Django 5.1 -
+# storages are configured here. The manifest storage gives every static
+# file (including the pre-built OpenAPI schema) a content hash.
+STORAGES = {
+    'default': {
+        'BACKEND': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+    'images': {
+        'BACKEND': IMAGE_STORAGE_BACKEND,
+        'OPTIONS': {
+            'location': str(Path(MEDIA_ROOT) / 'images'),
+            'base_url': MEDIA_URL + 'images/',
+        } if IMAGE_STORAGE_BACKEND == 'django.core.files.storage.FileSystemStorage' else {},
+    },
+}
 
 
 REST_FRAMEWORK = {
@@ -147,7 +289,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [  
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -183,34 +325,20 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Authenticated users are cached for this long (seconds) - see accounts/authentication.py
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=60, cast=int)
 
 
-import cloudinary
-import cloudinary.uploader
-from cloudinary.utils import cloudinary_url
-
-# Configuration       
-cloudinary.config( 
-    cloud_name = "doqyvdg56", 
-    api_key = "892487376518276", 
-    api_secret = "Plm6m-BJ1hoZEVQxpnKW9QGs1W0", # Click 'View API Keys' above to copy your API secret
-    secure=True
-)
 
-# Upload an image
-upload_result = cloudinary.uploader.upload("https://res.cloudinary.com/demo/image/upload/getting-started/shoes.jpg",
-                                           public_id="shoes")
-print(upload_result["secure_url"])
-
-# Optimize delivery by resizing and applying auto-format and auto-quality
-optimize_url, _ = cloudinary_url("shoes", fetch_format="auto", quality="auto")
-print(optimize_url)
-
-# Transform the image: auto-crop to square aspect_ratio
-auto_crop_url, _ = cloudinary_url("shoes", width=500, height=500, crop="auto", gravity="auto")
-print(auto_crop_url)
+# Cloudinary (image uploads)
+# Credentials come from the environment. Nothing talks to Cloudinary at import
+# time - the upload client is set up on first use (api/cloudinary_client.py).
+CLOUDINARY_STORAGE = {
+    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME', default=''),
+    'API_KEY': config('CLOUDINARY_API_KEY', default=''),
+    'API_SECRET': config('CLOUDINARY_API_SECRET', default=''),
+}
 
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
 
 SPECTACULAR_SETTINGS = {
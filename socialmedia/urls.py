@@ -14,17 +14,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.urls import path, include
 from django.contrib import admin
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from api.lazy import lazy_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('api/accounts/', include('accounts.urls')),
     
-    # Documentation
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # Documentation (imported on first use - drf_spectacular is slow to import).
+    # The schema itself is pre-built by `manage.py build_schema`, see api/schema.py
+    path('api/schema/', lazy_view('api.schema.SchemaView'), name='schema'),
+    path('api/docs/', lazy_view('api.schema.SchemaSwaggerView', url_name='schema'), name='swagger-ui'),
+    path('api/redoc/', lazy_view('api.schema.SchemaRedocView', url_name='schema'), name='redoc'),
 ]
+
+# Locally stored images (api/images.py). In production the web server or a
+# CDN should serve MEDIA_ROOT instead.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)